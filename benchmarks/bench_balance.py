@@ -0,0 +1,116 @@
+"""Contention benchmark of the BalanceTable: many threads sending transfers at the same time.
+
+* legacy: the original BalanceTable (no locking, the whole table printed twice per transfer)
+* global lock: one lock around every transfer, short log line
+* striped: client.balance_table.BalanceTable (per-stripe locks taken in a fixed order)
+
+Workloads, over a table of ACCOUNTS accounts:
+* disjoint: every thread moves money back and forth between its own pair of accounts
+* overlapping: every thread picks random pairs among HOT_ACCOUNTS shared accounts
+
+Output goes to os.devnull, so printing costs formatting but not terminal I/O. After each run the
+total amount of money is checked: lost updates show up as a changed total.
+
+Usage: python -m benchmarks.bench_balance [transfers] [thread counts...]   (default: 40000, 1 4 16)
+"""
+import contextlib
+import os
+import random
+import sys
+import threading
+import time
+from client.balance_table import BalanceTable
+
+ACCOUNTS = 1000
+HOT_ACCOUNTS = 8
+
+
+class LegacyBalanceTable:
+    """update_balance as it was before the striped locks, kept here for comparison."""
+    def __init__(self, initial_balances):
+        self.table = initial_balances
+
+    def get_balance(self, client):
+        return self.table.get(client, 0)
+
+    def update_balance(self, sender, receiver, amount):
+        print(self.table)
+        if self.table[sender] < amount:
+            raise ValueError("Insufficient funds")
+        self.table[sender] -= amount
+        self.table[receiver] = self.get_balance(receiver) + amount
+        print(f"Balance updated in {sender}'s account. {sender}'s new Balance Table : {self.table}")
+
+
+class GlobalLockBalanceTable(LegacyBalanceTable):
+    def __init__(self, initial_balances):
+        super().__init__(initial_balances)
+        self.lock = threading.Lock()
+
+    def update_balance(self, sender, receiver, amount):
+        with self.lock:
+            if self.table[sender] < amount:
+                raise ValueError("Insufficient funds")
+            self.table[sender] -= amount
+            self.table[receiver] = self.get_balance(receiver) + amount
+            sender_balance = self.table[sender]
+        print(f"Balance updated in {sender}'s account. {sender}'s new balance: {sender_balance}")
+
+
+TABLES = {"legacy": LegacyBalanceTable, "global lock": GlobalLockBalanceTable, "striped": BalanceTable}
+
+
+def disjoint_pairs(thread_index, count, rng):
+    first, second = f"Account{2 * thread_index}", f"Account{2 * thread_index + 1}"
+    return [(first, second, 1) if i % 2 == 0 else (second, first, 1) for i in range(count)]
+
+
+def overlapping_pairs(thread_index, count, rng):
+    transfers = []
+    for _ in range(count):
+        sender, receiver = rng.sample(range(HOT_ACCOUNTS), 2)
+        transfers.append((f"Account{sender}", f"Account{receiver}", 1))
+    return transfers
+
+
+WORKLOADS = {"disjoint": disjoint_pairs, "overlapping": overlapping_pairs}
+
+
+def run(table_class, workload, transfers, thread_count):
+    table = table_class({f"Account{i}": 1_000_000 for i in range(ACCOUNTS)})
+    total = sum(table.table.values())
+    per_thread = transfers // thread_count
+    plans = [workload(t, per_thread, random.Random(t)) for t in range(thread_count)]
+    barrier = threading.Barrier(thread_count + 1)
+
+    def worker(plan):
+        barrier.wait()
+        for sender, receiver, amount in plan:
+            table.update_balance(sender, receiver, amount)
+
+    threads = [threading.Thread(target=worker, args=(plan,)) for plan in plans]
+    with open(os.devnull, "w") as sink, contextlib.redirect_stdout(sink):
+        for thread in threads:
+            thread.start()
+        barrier.wait()
+        start = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+    return per_thread * thread_count / elapsed, sum(table.table.values()) == total
+
+
+def main():
+    transfers = int(sys.argv[1]) if len(sys.argv) > 1 else 40_000
+    thread_counts = [int(arg) for arg in sys.argv[2:]] or [1, 4, 16]
+    for workload_name, workload in WORKLOADS.items():
+        for thread_count in thread_counts:
+            results = []
+            for name, table_class in TABLES.items():
+                rate, conserved = run(table_class, workload, transfers, thread_count)
+                results.append(f"{name} {rate:>10,.0f}/s{'' if conserved else ' (LOST UPDATES)'}")
+            print(f"{workload_name:>11} x{thread_count:<3} " + " | ".join(results))
+
+
+if __name__ == "__main__":
+    main()
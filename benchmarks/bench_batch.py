@@ -0,0 +1,73 @@
+"""Throughput / commit latency of batched transaction submission, sweeping the batch size.
+
+Two clients run in this process on loopback, ClientA connected to ClientB only so every broadcast
+reaches ClientB exactly once. ClientA submits transfers to ClientB; a run ends once
+every transfer is committed locally and ClientB's chain holds all of them. batch size 0 is the
+unbatched path (one block and one broadcast per transfer).
+
+Usage: python -m benchmarks.bench_batch [transfers] [batch sizes...]   (default: 2000, 0 1 8 64 256)
+"""
+import sys
+import time
+from benchmarks.stats import percentile
+from config import settings
+
+BASE_PORT = 6420
+
+
+def run(transfers, batch_size, port):
+    from client.client import Client
+
+    settings.DATA_DIR = None
+    settings.BATCH_MODE = batch_size > 0
+    settings.BATCH_MAX_SIZE = max(batch_size, 1)
+    configs = [{"name": "ClientA", "ip": "127.0.0.1", "port": port},
+               {"name": "ClientB", "ip": "127.0.0.1", "port": port + 1}]
+    sender = Client("ClientA", "127.0.0.1", port, [configs[1]], False)
+    receiver = Client("ClientB", "127.0.0.1", port + 1, [], False)
+    clients = [receiver, sender]  # Receiver listening first, so the sender's handshake is answered
+    for client in clients:
+        client.start()
+    sender.balance_table.update_init_balance("ClientA", transfers)
+    receiver.balance_table.update_init_balance("ClientA", transfers)
+
+    latencies = []
+    start = time.perf_counter()
+    if batch_size:
+        futures = []
+        for _ in range(transfers):
+            submitted = time.perf_counter()
+            future = sender.handle_transaction(("ClientA", "ClientB", 1), True)
+            future.add_done_callback(lambda _, submitted=submitted: latencies.append(time.perf_counter() - submitted))
+            futures.append(future)
+        for future in futures:
+            future.result()
+    else:
+        for _ in range(transfers):
+            submitted = time.perf_counter()
+            sender.handle_transaction(("ClientA", "ClientB", 1), True)
+            latencies.append(time.perf_counter() - submitted)
+    while sum(len(block.operations) for block in receiver.blockchain.chain) < transfers:
+        time.sleep(0.001)
+    elapsed = time.perf_counter() - start
+
+    for client in clients:
+        if client.batcher:
+            client.batcher.stop()
+        client.network.shutdown()
+    return transfers / elapsed, percentile(latencies, 0.5), percentile(latencies, 0.99), len(receiver.blockchain.chain)
+
+
+def main():
+    transfers = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    batch_sizes = [int(arg) for arg in sys.argv[2:]] or [0, 1, 8, 64, 256]
+    results = []
+    for i, batch_size in enumerate(batch_sizes):
+        results.append((batch_size, run(transfers, batch_size, BASE_PORT + 2 * i)))
+    for batch_size, (throughput, p50, p99, blocks) in results:
+        label = "unbatched" if batch_size == 0 else f"batch {batch_size}"
+        print(f"{label:>10}: {throughput:>9,.0f} tx/s | commit p50 {p50 * 1e3:7.2f}ms p99 {p99 * 1e3:7.2f}ms | {blocks} blocks")
+
+
+if __name__ == "__main__":
+    main()
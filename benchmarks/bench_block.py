@@ -0,0 +1,54 @@
+"""Memory footprint and construction throughput of the compact Block against the original class.
+
+Usage: python -m benchmarks.bench_block [count]   (default: 200000)
+"""
+import hashlib
+import sys
+import time
+import tracemalloc
+from blockchain_module.block import Block, GENESIS_DIGEST
+
+
+class LegacyBlock:
+    """The Block class before the compact representation, kept here for comparison."""
+    def __init__(self, operation, prev_hash):
+        self.operation = operation
+        self.prev_hash = prev_hash
+        self.hash = self.compute_hash()
+
+    def compute_hash(self):
+        content = f"{self.operation[0]}{self.operation[1]}{self.operation[2]}{self.prev_hash}"
+        return hashlib.sha256(content.encode()).hexdigest()
+
+
+def build(count, block_class, genesis_prev, link):
+    chain = []
+    prev = genesis_prev
+    for i in range(count):
+        block = block_class((f"Client{i % 7}", f"Client{(i + 3) % 7}", i % 10 + 1), prev)
+        prev = link(block)
+        chain.append(block)
+    return chain
+
+
+def measure(name, count, block_class, genesis_prev, link):
+    start = time.perf_counter()
+    build(count, block_class, genesis_prev, link)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    chain = build(count, block_class, genesis_prev, link)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del chain
+    print(f"{name:>8}: {count / elapsed:>10,.0f} blocks/s | {current / count:7.1f} bytes/block")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    measure("legacy", count, LegacyBlock, "0", lambda block: block.hash)
+    measure("compact", count, Block, GENESIS_DIGEST, lambda block: block.digest)
+
+
+if __name__ == "__main__":
+    main()
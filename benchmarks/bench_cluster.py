@@ -0,0 +1,348 @@
+"""Cluster benchmark: N clients, each in its own process as main.py runs them, on loopback with
+generated configs, driven by a deterministic transaction workload at a target rate.
+
+Every node submits its share of the transfers from a plan generated up front from --seed, so two
+runs with the same arguments offer exactly the same load. Workloads:
+* uniform: Poisson arrivals, receivers picked uniformly among the other nodes
+* skewed: Poisson arrivals, receivers drawn from a Zipf distribution, so one hot account gets most
+  of the transfers
+* bursty: bursts of BURST_SIZE transfers submitted back to back, burst starts Poisson at the rate
+  that averages out to the target
+
+Each transfer from a node carries a unique amount (1, 2, 3, ...), which identifies it on every
+node without changing the wire format. INITIAL_BALANCE is raised so nothing is ever rejected.
+Recorded per transfer: submit time, local commit time and commit time on every other node (all
+time.monotonic(), which is system wide on Linux, so times from different processes compare).
+* committed tx/s: transfers committed on every node / (last such commit - first submit)
+* end-to-end commit latency: submit -> committed on the last node, percentiles in ms
+* per process: CPU time and peak RSS over the run, telemetry counters (messages received by
+  type, bytes sent per peer, transactions committed / rejected)
+
+Results are printed and written as JSON with --output. --baseline compares against an earlier
+JSON file and exits with status 1 if throughput dropped or p99 latency grew by more than
+--tolerance, for regression checks between versions.
+
+Usage: python -m benchmarks.bench_cluster [--nodes 4] [--workload uniform|skewed|bursty] [--rate 400]
+       [--duration 5] [--batch SIZE] [--mutex] [--broadcast flood|gossip] [--seed 1] [--output FILE] [--baseline FILE]
+"""
+import argparse
+import json
+import multiprocessing
+import platform
+import queue
+import resource
+import sys
+import threading
+import time
+from benchmarks.stats import percentile
+
+BASE_PORT = 6700
+HOST = "127.0.0.1"
+BURST_SIZE = 50
+ZIPF_EXPONENT = 1.2
+SETUP_TIMEOUT = 60  # Seconds for every node to start and connect
+DRAIN_TIMEOUT = 30  # Seconds after the last submission for every transfer to reach every node
+
+
+def uniform_plan(index, names, rate, duration, rng):
+    others = [name for position, name in enumerate(names) if position != index]
+    plan, offset = [], rng.expovariate(rate)
+    while offset < duration:
+        plan.append((offset, rng.choice(others)))
+        offset += rng.expovariate(rate)
+    return plan
+
+
+def skewed_plan(index, names, rate, duration, rng):
+    # Zipf weights over the node list: names[0] is the hot account
+    others = [name for position, name in enumerate(names) if position != index]
+    weights = [1 / (names.index(name) + 1) ** ZIPF_EXPONENT for name in others]
+    plan, offset = [], rng.expovariate(rate)
+    while offset < duration:
+        plan.append((offset, rng.choices(others, weights)[0]))
+        offset += rng.expovariate(rate)
+    return plan
+
+
+def bursty_plan(index, names, rate, duration, rng):
+    others = [name for position, name in enumerate(names) if position != index]
+    plan, offset = [], rng.expovariate(rate / BURST_SIZE)
+    while offset < duration:
+        plan.extend((offset, rng.choice(others)) for _ in range(BURST_SIZE))
+        offset += rng.expovariate(rate / BURST_SIZE)
+    return plan
+
+
+WORKLOADS = {"uniform": uniform_plan, "skewed": skewed_plan, "bursty": bursty_plan}
+
+
+def make_configs(nodes, base_port):
+    return [{"id": i + 1, "name": f"Client{i}", "ip": HOST, "port": base_port + i} for i in range(nodes)]
+
+
+def make_plans(names, workload, rate, duration, seed):
+    import random
+
+    per_node = rate / len(names)
+    return [WORKLOADS[workload](index, names, per_node, duration, random.Random(seed * 1000 + index))
+            for index in range(len(names))]
+
+
+def percentiles(values):
+    if not values:
+        return None
+    values = sorted(values)
+    pick = lambda fraction: percentile(values, fraction) * 1e3
+    return {"p50": pick(0.5), "p90": pick(0.9), "p99": pick(0.99), "max": values[-1] * 1e3,
+            "mean": sum(values) / len(values) * 1e3}
+
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime, usage.ru_stime
+
+
+def run_node(index, configs, plans, overrides, use_mutex, barrier, results):
+    """Body of one node process: start a client, submit its plan, wait until every other node's
+    transfers have been committed here, then report what was measured."""
+    from config import settings
+
+    for key, value in overrides.items():
+        setattr(settings, key, value)
+    from client.client import Client
+    from telemetry import configure_logging, metrics
+
+    configure_logging(settings.LOG_LEVEL)
+    names = [config["name"] for config in configs]
+    name, config = names[index], configs[index]
+    committed = {sender: {} for sender in names}  # sender -> {amount: monotonic commit time}
+    arrived = threading.Condition()
+
+    class BenchClient(Client):
+        def handle_msg(self, conn, addr, msg):
+            super().handle_msg(conn, addr, msg)
+            if msg and msg["type"] in ("transaction", "transaction_batch"):
+                operations = [msg["operation"]] if msg["type"] == "transaction" else msg["operations"]
+                now = time.monotonic()
+                with arrived:
+                    for sender, _, amount in operations:
+                        committed[sender].setdefault(amount, now)  # Gossip may deliver duplicates later
+                    arrived.notify_all()
+
+    client = BenchClient(name, HOST, config["port"], [peer for peer in configs if peer["name"] != name], False)
+    client.start()
+    try:
+        barrier.wait(SETUP_TIMEOUT)
+        cpu_start, start = cpu_seconds(), time.monotonic()
+        submitted, local, futures = {}, committed[name], []
+
+        def record_local(amount):
+            local[amount] = time.monotonic()
+
+        for amount, (offset, receiver) in enumerate(plans[index], 1):
+            delay = start + offset - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            submitted[amount] = time.monotonic()
+            if client.batcher:
+                future = client.handle_transaction((name, receiver, amount), True)
+                future.add_done_callback(lambda _, amount=amount: record_local(amount))
+                futures.append(future)
+                continue
+            if use_mutex:
+                client.request_mutex()
+            client.handle_transaction((name, receiver, amount), True)
+            record_local(amount)
+            if use_mutex:
+                client.release_mutex()
+        for future in futures:
+            future.result()
+
+        expected = {sender: len(plan) for sender, plan in zip(names, plans) if sender != name}
+        deadline = time.monotonic() + DRAIN_TIMEOUT
+        with arrived:
+            arrived.wait_for(lambda: all(len(committed[sender]) >= count for sender, count in expected.items()),
+                             max(0, deadline - time.monotonic()))
+        elapsed = time.monotonic() - start
+        cpu_end = cpu_seconds()
+        barrier.wait(DRAIN_TIMEOUT + SETUP_TIMEOUT)  # Nobody leaves while a peer still expects transfers
+        results.put({
+            "name": name,
+            "submitted": submitted,
+            "committed": committed,
+            "cpu_user_seconds": cpu_end[0] - cpu_start[0],
+            "cpu_system_seconds": cpu_end[1] - cpu_start[1],
+            "elapsed_seconds": elapsed,
+            "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            "counters": {metrics.series(key, label): value for (key, label), value in sorted(
+                metrics.counters.items(), key=lambda item: (item[0][0], str(item[0][1])))},
+        })
+    except threading.BrokenBarrierError:
+        results.put({"name": name, "error": "another node failed or timed out"})
+    finally:
+        if client.batcher:
+            client.batcher.stop()
+        if client.gossip:
+            client.gossip.stop()
+        client.network.shutdown()
+
+
+def summarize(reports, names):
+    """Merge the per-node reports into per-transfer latencies and cluster totals."""
+    by_name = {report["name"]: report for report in reports}
+    local_latencies, latencies, first_submit, last_commit, complete = [], [], None, None, 0
+    for sender in names:
+        for amount, submitted in by_name[sender]["submitted"].items():
+            first_submit = submitted if first_submit is None else min(first_submit, submitted)
+            commits = [by_name[node]["committed"][sender].get(amount) for node in names]
+            if commits[names.index(sender)] is not None:
+                local_latencies.append(commits[names.index(sender)] - submitted)
+            if None in commits:
+                continue  # Never reached some node before the drain timeout
+            complete += 1
+            latencies.append(max(commits) - submitted)
+            last_commit = max(commits) if last_commit is None else max(last_commit, max(commits))
+    submitted = sum(len(report["submitted"]) for report in reports)
+    window = (last_commit - first_submit) if complete else 0
+    processes = []
+    for name in names:
+        report = by_name[name]
+        counters = report["counters"]
+        processes.append({
+            "name": name,
+            "cpu_user_seconds": round(report["cpu_user_seconds"], 3),
+            "cpu_system_seconds": round(report["cpu_system_seconds"], 3),
+            "max_rss_kb": report["max_rss_kb"],
+            "messages_received": sum(value for key, value in counters.items() if key.startswith("messages_received")),
+            "bytes_sent": sum(value for key, value in counters.items() if key.startswith("bytes_sent")),
+            "counters": counters,
+        })
+    return {
+        "submitted": submitted,
+        "committed_everywhere": complete,
+        "committed_tx_per_second": complete / window if window else 0.0,
+        "local_commit_latency_ms": percentiles(local_latencies),
+        "commit_latency_ms": percentiles(latencies),
+        "messages_received": sum(process["messages_received"] for process in processes),
+        "bytes_sent": sum(process["bytes_sent"] for process in processes),
+        "processes": processes,
+    }
+
+
+def run(args):
+    from config import settings
+
+    configs = make_configs(args.nodes, args.base_port)
+    names = [config["name"] for config in configs]
+    plans = make_plans(names, args.workload, args.rate, args.duration, args.seed)
+    # Enough money that no transfer of the plan can overdraw, whatever order the nodes apply them in
+    largest = max(len(plan) for plan in plans)
+    overrides = {
+        "DATA_DIR": None,
+        "INITIAL_BALANCE": largest * (largest + 1) // 2 + 1,
+        "BATCH_MODE": args.batch > 0,
+        "BATCH_MAX_SIZE": max(args.batch, 1),
+        "METRICS_ENABLED": True,
+        "METRICS_PORT_OFFSET": None,
+        "METRICS_DUMP_INTERVAL": 0,
+        "LOG_LEVEL": args.log_level,
+        "BROADCAST_MODE": args.broadcast,
+    }
+    context = multiprocessing.get_context("spawn")  # Fresh interpreters, so RSS is each node's own
+    barrier, results = context.Barrier(args.nodes), context.Queue()
+    processes = [context.Process(target=run_node, args=(index, configs, plans, overrides, args.mutex, barrier, results),
+                                 name=name) for index, name in enumerate(names)]
+    for process in processes:
+        process.start()
+    reports = []
+    try:
+        for _ in processes:
+            reports.append(results.get(timeout=SETUP_TIMEOUT + DRAIN_TIMEOUT + args.duration * 2 + 30))
+    except queue.Empty:
+        raise SystemExit(f"bench_cluster: only {len(reports)} of {args.nodes} nodes reported")
+    finally:
+        for process in processes:
+            process.join(10)
+            if process.is_alive():
+                process.terminate()
+    errors = [f"{report['name']}: {report['error']}" for report in reports if "error" in report]
+    if errors:
+        raise SystemExit("bench_cluster: " + "; ".join(errors))
+    return {
+        "label": args.label,
+        "config": {"nodes": args.nodes, "workload": args.workload, "rate": args.rate, "duration": args.duration,
+                   "batch": args.batch, "mutex": args.mutex, "broadcast": args.broadcast, "seed": args.seed,
+                   "network_backend": settings.NETWORK_BACKEND, "wire_codec": settings.WIRE_CODEC,
+                   "mutex_algorithm": settings.MUTEX_ALGORITHM},
+        "platform": {"python": platform.python_version(), "machine": platform.machine(),
+                     "cpus": multiprocessing.cpu_count()},
+        "results": summarize(reports, names),
+    }
+
+
+def compare(result, baseline, tolerance):
+    """Lines describing the change against baseline, and whether it is a regression."""
+    now, before = result["results"], baseline["results"]
+    lines, regressed = [], False
+    if before["committed_tx_per_second"]:
+        change = now["committed_tx_per_second"] / before["committed_tx_per_second"] - 1
+        regressed |= change < -tolerance
+        lines.append(f"throughput {change:+.1%} vs baseline")
+    if before["commit_latency_ms"] and now["commit_latency_ms"]:
+        change = now["commit_latency_ms"]["p99"] / before["commit_latency_ms"]["p99"] - 1
+        regressed |= change > tolerance
+        lines.append(f"commit p99 {change:+.1%} vs baseline")
+    if now["committed_everywhere"] < now["submitted"]:
+        regressed = True
+        lines.append(f"{now['submitted'] - now['committed_everywhere']} transfers never reached every node")
+    return lines, regressed
+
+
+def main():
+    from config import settings
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--nodes", type=int, default=4)
+    parser.add_argument("--workload", choices=WORKLOADS, default="uniform")
+    parser.add_argument("--rate", type=float, default=400, help="target transfers per second, whole cluster")
+    parser.add_argument("--duration", type=float, default=5, help="seconds of load")
+    parser.add_argument("--batch", type=int, default=0, help="batch size (0: one block per transfer)")
+    parser.add_argument("--mutex", action="store_true", help="hold the distributed mutex around every transfer")
+    parser.add_argument("--broadcast", choices=("flood", "gossip"), default=settings.BROADCAST_MODE)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--base-port", type=int, default=BASE_PORT)
+    parser.add_argument("--label", default="", help="free text stored in the JSON, e.g. a version")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--output", help="write the JSON results to this file ('-' for stdout)")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="relative change counted as a regression")
+    args = parser.parse_args()
+
+    result = run(args)
+    summary = result["results"]
+    if args.output == "-":
+        json.dump(result, sys.stdout, indent=2)
+        print()
+    else:
+        latency = summary["commit_latency_ms"] or {"p50": 0, "p99": 0}
+        print(f"{args.nodes} nodes {args.workload} @ {args.rate:,.0f} tx/s: {summary['committed_tx_per_second']:,.0f} tx/s committed "
+              f"({summary['committed_everywhere']}/{summary['submitted']}) | commit p50 {latency['p50']:.2f}ms "
+              f"p99 {latency['p99']:.2f}ms | {summary['messages_received']} messages")
+        for process in summary["processes"]:
+            print(f"  {process['name']}: cpu {process['cpu_user_seconds'] + process['cpu_system_seconds']:.2f}s "
+                  f"rss {process['max_rss_kb'] / 1024:.1f}MB | {process['messages_received']} messages in, "
+                  f"{process['bytes_sent']:,} bytes out")
+        if args.output:
+            with open(args.output, "w") as file:
+                json.dump(result, file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as file:
+            lines, regressed = compare(result, json.load(file), args.tolerance)
+        for line in lines:
+            print(line, file=sys.stderr)
+        if regressed:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
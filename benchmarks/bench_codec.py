@@ -0,0 +1,74 @@
+"""Codec micro-benchmark: the original newline-JSON path against the binary framing.
+
+* newline-JSON: json.dumps(...).encode() + b"\\n" to encode; bytes += chunk, split(b"\\n", 1) and
+  json.loads per message to decode, as Network did before the binary protocol
+* binary: client.codec.encode_binary to encode, FrameBuffer to decode
+
+Both decoders are fed the encoded stream in 1024-byte chunks, like socket reads.
+
+Usage: python -m benchmarks.bench_codec [messages per type]   (default: 50000)
+"""
+import json
+import sys
+import time
+from client import codec as wire
+
+SAMPLES = {
+    "mutex_request": {"type": "mutex_request", "lamport_time": [1234, 29], "sender": "ClientA"},
+    "mutex_ack": {"type": "mutex_ack", "lamport_time": [1235, 30], "sender": "ClientB"},
+    "mutex_release": {"type": "mutex_release", "lamport_time": [1236, 29], "sender": "ClientA"},
+    "transaction": {"type": "transaction", "operation": ["ClientA", "ClientB", 5], "lamport_time": [1237, 29], "sender": "ClientA"},
+    "transaction_batch": {"type": "transaction_batch", "operations": [["ClientA", "ClientB", 1]] * 16,
+                          "lamport_time": [1238, 29], "sender": "ClientA"},
+}
+
+
+def chunks(stream, size=1024):
+    return [stream[i:i + size] for i in range(0, len(stream), size)]
+
+
+def decode_newline_json(stream_chunks):
+    buffer = b""
+    count = 0
+    for chunk in stream_chunks:
+        buffer += chunk
+        while b"\n" in buffer:
+            line, buffer = buffer.split(b"\n", 1)
+            json.loads(line.decode("utf-8"))
+            count += 1
+    return count
+
+
+def decode_binary(stream_chunks):
+    buffer = wire.FrameBuffer()
+    count = 0
+    for chunk in stream_chunks:
+        buffer.feed(chunk)
+        while buffer.next_message() is not None:
+            count += 1
+    return count
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    for name, message in SAMPLES.items():
+        messages = [message] * count
+        json_encode_time, json_frames = timed(lambda: [wire.encode_json(m) for m in messages])
+        binary_encode_time, binary_frames = timed(lambda: [wire.encode_binary(m) for m in messages])
+        json_decode_time, decoded = timed(decode_newline_json, chunks(b"".join(json_frames)))
+        assert decoded == count
+        binary_decode_time, decoded = timed(decode_binary, chunks(b"".join(binary_frames)))
+        assert decoded == count
+        print(f"{name:>17}: size {len(json_frames[0]):4d}B -> {len(binary_frames[0]):4d}B | "
+              f"encode {count / json_encode_time:>10,.0f} -> {count / binary_encode_time:>10,.0f} msg/s | "
+              f"decode {count / json_decode_time:>10,.0f} -> {count / binary_decode_time:>10,.0f} msg/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""Commit throughput and latency of Client.handle_transaction at each STORE_DURABILITY level, plus a
+crash-recovery check.
+
+* throughput: a client with an on-disk chain (in a temporary directory) and no peers (simulated
+  transport, so no sockets) commits local transfers from THREADS committer threads. Reported per
+  level and thread count: commits/s, commit latency p50 / p99 (until handle_transaction returns,
+  i.e. durable as far as the level promises) and commits per fsync.
+* crash: a child process commits transfers in a loop and reports every acknowledged height; it is
+  killed with SIGKILL mid-run and a torn half record is appended to its segment, as a write cut
+  short by the crash would leave. The restarted client must then have a valid chain holding every
+  acknowledged commit ("none" may lose the ones still in its write buffers) and the balances a replay
+  from genesis gives. (SIGKILL keeps the page cache, so this checks the recovery path, not what an
+  fsync protects against on power loss.)
+* restart: a client restarted on a persisted transfer receives another one the moment its server
+  starts; it must end with the balances a replay from genesis gives (counted once, on top of the
+  rebuilt ones).
+
+Usage: python -m benchmarks.bench_durability [--commits 2000] [--threads 1 8] [--levels none batch every] [--no-crash]
+"""
+import argparse
+import multiprocessing
+import os
+import signal
+import tempfile
+import threading
+import time
+from benchmarks.stats import percentile
+from blockchain_module.store import DURABILITY_LEVELS, RECORD_HEADER
+from client.balance_table import BalanceTable
+from client.sim_network import SimWorld
+from config import settings
+from telemetry import metrics
+
+CRASH_AFTER = 0.5  # Seconds the child commits before it is killed
+
+
+def make_client(directory, level, transport=None):
+    from client.client import Client
+
+    settings.DATA_DIR = directory
+    settings.STORE_DURABILITY = level
+    settings.INITIAL_BALANCE = 10 ** 12
+    client = Client("ClientA", "127.0.0.1", 7000, [], False, transport=transport or SimWorld().transport)
+    client.balance_table.update_init_balance("ClientB", settings.INITIAL_BALANCE)  # The receiver, never connected
+    return client
+
+
+def measure(level, commits, thread_count):
+    with tempfile.TemporaryDirectory() as directory:
+        client = make_client(directory, level)
+        client.start()
+        metrics.reset()
+        metrics.enable()
+        latencies = [[] for _ in range(thread_count)]
+
+        def committer(index):
+            for _ in range(commits // thread_count):
+                submitted = time.perf_counter()
+                client.handle_transaction(("ClientA", "ClientB", 1), True)
+                latencies[index].append(time.perf_counter() - submitted)
+
+        threads = [threading.Thread(target=committer, args=(index,)) for index in range(thread_count)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        fsyncs = metrics.histograms.get(("store_fsync_seconds", None))
+        fsync_count = fsyncs.count if fsyncs else 0
+        metrics.enable(False)
+        client.network.shutdown()
+        client.blockchain.close()
+    latencies = [latency for thread_latencies in latencies for latency in thread_latencies]
+    return len(latencies) / elapsed, percentile(latencies, 0.5), percentile(latencies, 0.99), len(latencies) / max(1, fsync_count)
+
+
+def replayed_table(chain):
+    # Balances from a replay of chain from genesis, what a restarted client must end up with
+    table = BalanceTable({"ClientA": settings.INITIAL_BALANCE, "ClientB": settings.INITIAL_BALANCE})
+    for block in chain:
+        table.apply_batch(list(block.operations))
+    return table.get_whole_table()
+
+
+def crash_child(directory, level, acknowledged):
+    client = make_client(directory, level)
+    client.start()
+    while True:
+        client.handle_transaction(("ClientA", "ClientB", 1), True)
+        acknowledged.value = len(client.blockchain.chain)
+
+
+def crash_check(level):
+    with tempfile.TemporaryDirectory() as directory:
+        acknowledged = multiprocessing.Value("q", 0, lock=False)
+        child = multiprocessing.get_context("spawn").Process(target=crash_child, args=(directory, level, acknowledged))
+        child.start()
+        time.sleep(CRASH_AFTER)
+        os.kill(child.pid, signal.SIGKILL)
+        child.join()
+        with open(os.path.join(directory, "ClientA", "chain.seg"), "ab") as segment:
+            segment.write(RECORD_HEADER.pack(1000, bytes(32), bytes(32))[:50])  # Torn record
+
+        client = make_client(directory, level)
+        client.replay_chain()
+        chain = client.blockchain.chain
+        errors = []
+        if not client.blockchain.is_valid_chain():
+            errors.append("invalid chain")
+        if level != "none" and len(chain) < acknowledged.value:
+            errors.append(f"{acknowledged.value} commits acknowledged, {len(chain)} recovered")
+        if client.balance_table.get_whole_table() != replayed_table(chain):
+            errors.append("balances differ from a replay of the chain")
+        client.network.shutdown()
+        client.blockchain.close()
+        return acknowledged.value, len(chain), errors
+
+
+def restart_check(level):
+    """A transfer that reaches a restarted client as soon as its server is up must be applied once, on
+    top of the rebuilt balances."""
+    with tempfile.TemporaryDirectory() as directory:
+        client = make_client(directory, level)
+        client.handle_transaction(("ClientB", "ClientA", 5))
+        client.network.shutdown()
+        client.blockchain.close()
+
+        world = SimWorld()
+        delivered = threading.Event()
+
+        def transport(*args, **kwargs):
+            # Delivers a transfer from ClientB the moment the server starts, ahead of the rest of Client.start
+            network = world.transport(*args, **kwargs)
+            start_server = network.start_server
+
+            def start_and_deliver(handler):
+                start_server(handler)
+                handler("ClientB", None, {"type": "transaction", "operation": ("ClientB", "ClientA", 1),
+                                          "lamport_time": (1, 1), "sender": "ClientB"})
+                delivered.set()
+            network.start_server = start_and_deliver
+            return network
+
+        client = make_client(directory, level, transport)
+        client.start()
+        delivered.wait(5.0)
+        errors = []
+        if client.balance_table.get_whole_table() != replayed_table(client.blockchain.chain):
+            errors.append(f"balances {client.balance_table.get_whole_table()} differ from a replay of the chain")
+        client.network.shutdown()
+        client.blockchain.close()
+        return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--commits", type=int, default=2000)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--levels", nargs="+", choices=DURABILITY_LEVELS, default=list(DURABILITY_LEVELS))
+    parser.add_argument("--no-crash", action="store_true")
+    args = parser.parse_args()
+    failures = []
+    for level in args.levels:
+        for thread_count in args.threads:
+            rate, p50, p99, per_fsync = measure(level, args.commits, thread_count)
+            print(f"{level:>5} x{thread_count:<3}: {rate:>9,.0f} commits/s | commit p50 {p50 * 1e3:7.3f}ms "
+                  f"p99 {p99 * 1e3:7.3f}ms | {per_fsync:7.1f} commits/fsync")
+        if not args.no_crash:
+            acknowledged, recovered, errors = crash_check(level)
+            failures += errors
+            print(f"{level:>5} crash: {acknowledged} acknowledged, {recovered} recovered {'FAILED: ' + ', '.join(errors) if errors else 'ok'}")
+            errors = restart_check(level)
+            failures += errors
+            print(f"{level:>5} restart: transfer received during startup {'FAILED: ' + ', '.join(errors) if errors else 'ok'}")
+    if failures:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Load test of the network engines: one hub broadcasting to N local peers.
+
+For each backend and peer count the hub broadcasts a stream of small transaction-like messages.
+Every peer records the delivery latency of each message (same process, same clock); the run reports
+delivered messages/sec across all peers and the p50/p99 latency.
+
+The hub is open loop: it enqueues the whole stream as fast as broadcast_message returns, without
+waiting for deliveries, so latency measures queueing as much as transport. The threaded engine
+writes each message to every socket before broadcast_message returns, which paces the hub to what
+the peers absorb. The asyncio engine only puts it on each peer's write queue and returns, so the
+whole stream is queued almost at once and drained by the hub's one event loop thread (one write per
+peer per message), competing for the GIL with every peer's loop. Later messages wait behind all the
+earlier ones: p50/p99 grow with peer count and stream length while throughput stays comparable or
+higher. A closed-loop sender (or a bounded queue) would see latencies like the threaded engine's.
+
+Usage: python -m benchmarks.bench_network [messages] [peer counts...]   (default: 2000, 3 10 25 50)
+"""
+import sys
+import threading
+import time
+from benchmarks.stats import percentile
+from client.async_network import AsyncNetwork
+from client.network import Network
+
+BACKENDS = {"threaded": Network, "asyncio": AsyncNetwork}
+BASE_PORT = 6100
+
+
+def run(backend, peer_count, messages, port):
+    network_class = BACKENDS[backend]
+    latencies = []
+    lock = threading.Lock()
+    done = threading.Event()
+    expected = peer_count * messages
+
+    def handler(conn, addr, msg):
+        latency = time.perf_counter() - msg["sent"]
+        with lock:
+            latencies.append(latency)
+            if len(latencies) == expected:
+                done.set()
+
+    peers = [network_class("127.0.0.1", port + 1 + i, name=f"Peer{i}") for i in range(peer_count)]
+    for peer in peers:
+        threading.Thread(target=peer.start_server, args=(handler,), daemon=True).start()
+    hub = network_class("127.0.0.1", port)
+    for i, peer in enumerate(peers):
+        hub.add_connection(f"Peer{i}", "127.0.0.1", peer.port)
+
+    start = time.perf_counter()
+    for seq in range(messages):
+        hub.broadcast_message({"type": "transaction", "operation": ["ClientA", "ClientB", 1],
+                               "lamport_time": [seq, 1], "sender": "Hub", "sent": time.perf_counter()})
+    done.wait(timeout=120)
+    elapsed = time.perf_counter() - start
+
+    for network in [hub] + peers:
+        network.shutdown()
+    return len(latencies) / elapsed, percentile(latencies, 0.5), percentile(latencies, 0.99), len(latencies) == expected
+
+
+def main():
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    peer_counts = [int(arg) for arg in sys.argv[2:]] or [3, 10, 25, 50]
+    port = BASE_PORT
+    for peer_count in peer_counts:
+        for backend in BACKENDS:
+            rate, p50, p99, complete = run(backend, peer_count, messages, port)
+            port += peer_count + 1
+            note = "" if complete else " (timed out, incomplete)"
+            print(f"{peer_count:>3} peers {backend:>8}: {rate:>10,.0f} msg/s | p50 {p50 * 1e3:8.2f}ms p99 {p99 * 1e3:8.2f}ms{note}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Rebuilding balances from a chain: the per-operation path (decode every block's operations, then
+BalanceTable.apply_batch) against client.replay (columnar load + vectorized replay, and the same
+columns replayed by a plain loop when NumPy is missing).
+
+The chain is a seeded random walk of valid transfers over --accounts accounts starting at
+INITIAL_BALANCE each, as a node's own chain holds only transfers it accepted, in blocks of
+--per-block operations (1: every block a single transfer, as without BATCH_MODE). --invalid mixes in
+that fraction of overdrawing transfers, which every path has to skip (the vectorized one falls back
+to the loop when they are dense). Every path must end with the same balances and skip count.
+
+Usage: python -m benchmarks.bench_replay [--per-block 1] [--accounts 1000] [--invalid 0.0] [sizes...]
+       (default sizes: 100000 1000000 10000000)
+"""
+import argparse
+import random
+import time
+from blockchain_module.block import Block, encode_batch, encode_operation
+from client import replay
+from client.balance_table import BalanceTable
+
+INITIAL_BALANCE = 1000
+MAX_AMOUNT = 100
+
+
+def make_payloads(operation_count, per_block, account_count, invalid, seed=1):
+    rng = random.Random(seed)
+    accounts = [f"Client{i:05d}" for i in range(account_count)]
+    balances = dict.fromkeys(accounts, INITIAL_BALANCE)
+    operations = []
+    while len(operations) < operation_count:
+        sender, receiver = rng.choice(accounts), rng.choice(accounts)
+        if rng.random() < invalid:
+            operations.append((sender, receiver, balances[sender] + 1))  # Overdraws, skipped on replay
+        elif balances[sender]:
+            amount = rng.randint(1, min(MAX_AMOUNT, balances[sender]))
+            balances[sender] -= amount
+            balances[receiver] += amount
+            operations.append((sender, receiver, amount))
+    payloads = [encode_operation(operations[start]) if per_block == 1 else encode_batch(operations[start:start + per_block])
+                for start in range(0, operation_count, per_block)]
+    return dict.fromkeys(accounts, INITIAL_BALANCE), payloads
+
+
+def per_operation(table, payloads):
+    start = time.perf_counter()
+    operations = [operation for payload in payloads for operation in Block.from_record(payload, bytes(32), bytes(32)).operations]
+    loaded = time.perf_counter()
+    balance_table = BalanceTable(dict(table))
+    _, rejected = balance_table.apply_batch(operations)
+    return balance_table.get_whole_table(), len(rejected), loaded - start, time.perf_counter() - loaded
+
+
+def columnar(table, payloads, vectorized):
+    start = time.perf_counter()
+    columns = replay.load_columns(payloads, list(table))
+    loaded = time.perf_counter()
+    balances = [table.get(name, 0) for name in columns.names]
+    touched = bytearray(b"\x01" * len(columns.names))
+    if vectorized:
+        rejected = replay.replay_vectorized(balances, touched, columns)
+    else:
+        rejected = replay.replay_loop(balances, touched, columns.senders, columns.receivers, columns.amounts)
+    result = {name: balances[index] for index, name in enumerate(columns.names) if touched[index]}
+    return result, rejected, loaded - start, time.perf_counter() - loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--per-block", type=int, default=1)
+    parser.add_argument("--accounts", type=int, default=1000)
+    parser.add_argument("--invalid", type=float, default=0.0)
+    parser.add_argument("sizes", type=int, nargs="*", default=[100_000, 1_000_000, 10_000_000])
+    args = parser.parse_args()
+    paths = [("per-operation", per_operation), ("columnar loop", lambda table, payloads: columnar(table, payloads, False))]
+    if replay.load_numpy():
+        paths.append(("vectorized", lambda table, payloads: columnar(table, payloads, True)))
+    else:
+        print("NumPy not installed, vectorized replay skipped")
+    for size in args.sizes:
+        table, payloads = make_payloads(size, args.per_block, args.accounts, args.invalid)
+        results = []
+        for label, path in paths:
+            balances, rejected, load, apply = path(table, payloads)
+            results.append((balances, rejected))
+            print(f"{size:>10,} ops: {label:>13} | load {load * 1e3:9.1f}ms apply {apply * 1e3:9.1f}ms | "
+                  f"total {(load + apply) * 1e3:9.1f}ms = {size / (load + apply):>11,.0f} ops/s | {rejected} skipped")
+        if any(result != results[0] for result in results):
+            raise SystemExit(f"{size} ops: the paths disagree on the final balances")
+        del payloads
+
+
+if __name__ == "__main__":
+    main()
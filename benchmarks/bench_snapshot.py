@@ -0,0 +1,62 @@
+"""Recovery time of the balance table against chain length, with and without snapshots.
+
+For each size a chain of single-transfer blocks is written to a BlockStore in a temporary directory,
+with a balance snapshot every SNAPSHOT_INTERVAL blocks as Client takes them. Recovery reopens the
+store (as after a restart) and rebuilds the balance table with client.snapshot.recover_balances,
+once replaying the whole chain and once starting from the newest snapshot.
+
+Usage: python -m benchmarks.bench_snapshot [sizes...]   (default: 10000 100000 500000)
+"""
+import os
+import sys
+import tempfile
+import time
+from blockchain_module.blockchain import Blockchain
+from client.balance_table import BalanceTable
+from client.snapshot import SnapshotStore, recover_balances
+from config import settings
+
+CLIENTS = [f"Client{i}" for i in range(7)]
+
+
+def build(directory, size, interval):
+    blockchain = Blockchain(os.path.join(directory, "chain"), sync_every=4096, sync_interval=0)
+    snapshots = SnapshotStore(os.path.join(directory, "snapshots"), interval, settings.SNAPSHOT_RETENTION)
+    table = {name: 10 for name in CLIENTS}
+    for i in range(size):
+        sender, receiver = CLIENTS[i % 7], CLIENTS[(i + 3) % 7]
+        amount = 1 if table[sender] else 0
+        table[sender] -= amount
+        table[receiver] += amount
+        block = blockchain.add_block((sender, receiver, amount))
+        snapshots.maybe_save(i + 1, block.digest, table)
+    blockchain.close()
+
+
+def recover(directory, use_snapshots):
+    start = time.perf_counter()
+    blockchain = Blockchain(os.path.join(directory, "chain"), sync_interval=0)
+    snapshots = SnapshotStore(os.path.join(directory, "snapshots")) if use_snapshots else None
+    balance_table = BalanceTable({name: 10 for name in CLIENTS})
+    replay_start = recover_balances(blockchain, balance_table, snapshots)
+    elapsed = time.perf_counter() - start
+    blockchain.close()
+    return elapsed, len(blockchain.chain) - replay_start, dict(balance_table.table)
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10_000, 100_000, 500_000]
+    interval = settings.SNAPSHOT_INTERVAL or 1000
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            build(directory, size, interval)
+            full_time, full_replayed, full_table = recover(directory, False)
+            snapshot_time, snapshot_replayed, snapshot_table = recover(directory, True)
+            assert full_table == snapshot_table
+        print(f"{size:>9,} blocks: full replay {full_time * 1e3:9.1f}ms ({full_replayed:,} blocks) | "
+              f"from snapshot {snapshot_time * 1e3:7.1f}ms ({snapshot_replayed:,} blocks) | "
+              f"{full_time / snapshot_time:6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Startup benchmark: how long main.py takes to bring up a cluster, per process start method.
+
+* imports: `python -X importtime -c "import client.client"` run RUNS times in fresh interpreters;
+  the slowest modules by cumulative import time (best of the runs, in ms) and the total
+* per start method (spawn, forkserver as main.get_context sets it up, fork): N client processes are
+  launched together as main.py does, and the parent polls every client's port. Reported per node is
+  the time from its Process.start() until its first accepted connection (the server is listening),
+  p50 / max in ms, and the time until the whole cluster is up. For forkserver the template process
+  is started (and its preload imported) before the clock starts, as it is once per launcher.
+
+Clients keep their chains in memory (DATA_DIR None), so no data/ directories are left behind.
+
+Usage: python -m benchmarks.bench_startup [--nodes 8] [--runs 5] [--top 15] [--methods spawn forkserver fork]
+"""
+import argparse
+import multiprocessing
+import socket
+import subprocess
+import sys
+import time
+from main import get_context
+
+BASE_PORT = 6900
+HOST = "127.0.0.1"
+TIMEOUT = 30.0  # s to wait for a client to accept a connection
+
+
+def import_times(runs):
+    """module -> (self, cumulative) import time in microseconds, the best of runs fresh interpreters."""
+    best = {}
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-X", "importtime", "-c", "import client.client"],
+                                capture_output=True, text=True, check=True).stderr
+        for line in output.splitlines():
+            if not line.startswith("import time:") or "|" not in line or "self [us]" in line:
+                continue
+            self_us, cumulative_us, module = line[len("import time:"):].split("|")
+            module = module.strip()
+            timing = (int(self_us), int(cumulative_us))
+            best[module] = min(best.get(module, timing), timing, key=lambda t: t[1])
+    return best
+
+
+def run_node(name, port, peers, overrides):
+    """Body of one client process: start a client and keep it up until the parent terminates it."""
+    from config import settings
+
+    for key, value in overrides.items():
+        setattr(settings, key, value)
+    from client.client import Client
+    from telemetry import configure_logging
+
+    configure_logging(settings.LOG_LEVEL)
+    Client(name, HOST, port, peers, False).start()
+    while True:
+        time.sleep(1)
+
+
+def accepts(port):
+    try:
+        with socket.create_connection((HOST, port), timeout=0.1):
+            return True
+    except OSError:
+        return False
+
+
+def measure(method, node_count, base_port):
+    """Start node_count clients with the given start method; seconds from start() to first accept per node."""
+    context = get_context(method)
+    if method == "forkserver":
+        from multiprocessing import forkserver
+        forkserver.ensure_running()  # Template up and preloaded before timing, as for a long-lived launcher
+    configs = [{"name": f"Node{i}", "ip": HOST, "port": base_port + i} for i in range(node_count)]
+    overrides = {"DATA_DIR": None, "LOG_LEVEL": "ERROR"}
+    processes, started = [], {}
+    for config in configs:
+        peers = [peer for peer in configs if peer["name"] != config["name"]]
+        processes.append(context.Process(target=run_node, args=(config["name"], config["port"], peers, overrides), daemon=True))
+    for process, config in zip(processes, configs):
+        started[config["port"]] = time.perf_counter()
+        process.start()
+    up = {}
+    try:
+        while len(up) < node_count and time.perf_counter() - min(started.values()) < TIMEOUT:
+            for port in started:
+                if port not in up and accepts(port):
+                    up[port] = time.perf_counter()
+            time.sleep(0.001)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+    if len(up) < node_count:
+        raise SystemExit(f"{method}: only {len(up)} of {node_count} clients accepted a connection within {TIMEOUT}s")
+    times = sorted(up[port] - started[port] for port in up)
+    return times, max(up.values()) - min(started.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--nodes", type=int, default=8)
+    parser.add_argument("--runs", type=int, default=5, help="importtime runs, the best one is reported")
+    parser.add_argument("--top", type=int, default=15, help="slowest modules listed")
+    parser.add_argument("--methods", nargs="+", default=["spawn", "forkserver", "fork"])
+    parser.add_argument("--base-port", type=int, default=BASE_PORT)
+    args = parser.parse_args()
+
+    timings = import_times(args.runs)
+    print(f"import client.client: {timings['client.client'][1] / 1000:7.1f}ms (best of {args.runs})")
+    slowest = sorted(timings.items(), key=lambda item: item[1][1], reverse=True)[1:args.top + 1]
+    for module, (self_us, cumulative_us) in slowest:
+        print(f"  {module:<40} self {self_us / 1000:6.1f}ms  cumulative {cumulative_us / 1000:6.1f}ms")
+
+    for offset, method in enumerate(args.methods):
+        if method not in multiprocessing.get_all_start_methods():
+            print(f"{method:>10}: not available on this platform")
+            continue
+        times, cluster = measure(method, args.nodes, args.base_port + offset * args.nodes)
+        print(f"{method:>10}: {args.nodes} clients | first accept p50 {times[len(times) // 2] * 1000:7.1f}ms "
+              f"max {times[-1] * 1000:7.1f}ms | cluster up in {cluster * 1000:7.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
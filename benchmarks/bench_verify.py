@@ -0,0 +1,62 @@
+"""Compare chain validation strategies.
+* link-only loop: the original is_valid_chain, prev_hash links only, no re-hashing
+* full sequential: ChainVerifier with the process pool disabled, cold
+* full parallel: ChainVerifier cold audit across a process pool
+* incremental: ChainVerifier re-run after appending one block to an already verified chain
+
+Usage: python -m benchmarks.bench_verify [sizes...]   (default: 10000 100000 1000000)
+"""
+import sys
+import time
+from blockchain_module.blockchain import Blockchain
+from blockchain_module.verify import ChainVerifier
+
+
+def link_only_loop(chain):
+    for i in range(1, len(chain)):
+        if chain[i].prev_hash != chain[i - 1].hash:
+            return False
+    return True
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def run(size):
+    blockchain = Blockchain()
+    for i in range(size):
+        blockchain.add_block((f"Client{i % 7}", f"Client{(i + 3) % 7}", i % 10 + 1))
+    chain = blockchain.chain
+
+    link_time, _ = timed(link_only_loop, chain)
+    sequential = ChainVerifier(workers=1)
+    sequential_time, bad = timed(sequential.first_invalid_height, chain)
+    assert bad is None
+    parallel = ChainVerifier(parallel_threshold=0)
+    parallel_time, bad = timed(parallel.first_invalid_height, chain)
+    assert bad is None
+
+    blockchain.add_block(("Client0", "Client1", 1))
+    incremental_time, bad = timed(sequential.first_invalid_height, chain)
+    assert bad is None
+
+    # Tamper with a block in the middle and make sure the cold audit finds exactly that height
+    chain[size // 2].operation = ("Client0", "Client1", 10_000)
+    _, bad = timed(ChainVerifier(parallel_threshold=0).first_invalid_height, chain)
+    assert bad == size // 2, bad
+
+    print(f"{size:>9} blocks | link-only {link_time:8.3f}s | full sequential {sequential_time:8.3f}s | "
+          f"full parallel ({parallel.workers} procs) {parallel_time:8.3f}s | incremental +1 {incremental_time * 1e6:8.1f}us")
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10_000, 100_000, 1_000_000]
+    for size in sizes:
+        run(size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""Simulated cluster: N real Clients in one process on a client.sim_network.SimWorld instead of
+sockets, so large clusters run in seconds and the protocol code can be profiled without I/O.
+
+Scenarios (virtual time, seeded, reproducible):
+* broadcast: --transactions transfers from random nodes at random times over PUBLISH_WINDOW, sent
+  with the client's broadcast (flood or --broadcast gossip, whose anti-entropy rounds run on the
+  virtual clock). Checks that every node committed every transfer and ended with the same balances.
+  Reports propagation (publish -> committed on the last node) p50 / p99 in virtual ms.
+* mutex: --requesters random nodes each enter the critical section --entries times with the
+  client's mutex strategy (--mutex). Checks that no two nodes are ever inside at once and that every
+  request is granted. Reports acquisition latency p50 / p99 in virtual ms and messages per entry.
+
+Both report the messages delivered, the wall time of the setup (constructing, linking and starting
+the clients; every chain starts empty, so the world skips their start-up sync tips, see
+SimWorld skip_empty_tips) and of the scenario itself, events simulated per second and the trace
+digest of the run. --check-determinism runs the scenario twice and exits with status 1 if the digests differ.
+--profile prints the top functions by cumulative time (cProfile) instead of timing the run alone.
+
+Usage: python -m benchmarks.sim_cluster [--scenario broadcast|mutex] [--nodes 1000] [--transactions 200]
+       [--broadcast flood|gossip] [--mutex lamport|ricart_agrawala|maekawa] [--requesters 20] [--entries 2]
+       [--latency 0.5 2.0] [--bandwidth BYTES_PER_S] [--drop 0.0] [--reorder 0.0] [--seed 1]
+       [--check-determinism] [--profile]
+"""
+import argparse
+import cProfile
+import pstats
+import random
+import sys
+import time
+from benchmarks.stats import percentile
+from client.client import Client
+from client.mutex import MUTEX_STRATEGIES
+from client.sim_network import SimWorld
+from config import settings
+from telemetry import configure_logging
+
+BASE_PORT = 10000  # Process ids are port % 1000, unique for up to 1000 nodes
+HOST = "127.0.0.1"
+PUBLISH_WINDOW = 1.0  # Virtual seconds over which the transfers are published
+DRAIN = 5.0  # Virtual seconds simulated after the last publish / request
+HOLD = 0.001  # Virtual seconds a node stays in the critical section
+
+
+class SimClient(Client):
+    """Client that records the virtual time at which it commits each broadcast transfer."""
+    def __init__(self, *args, committed=None, world=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.committed = committed
+        self.world = world
+
+    def apply_transaction_message(self, msg):
+        super().apply_transaction_message(msg)
+        sender, _, amount = msg["operation"]
+        self.committed.setdefault((sender, amount), []).append(self.world.now)
+
+
+def build(args):
+    settings.DATA_DIR = None
+    settings.INITIAL_BALANCE = 10 ** 12  # Nothing is ever rejected, whatever order the transfers arrive in
+    settings.BROADCAST_MODE = args.broadcast
+    settings.MUTEX_ALGORITHM = args.mutex
+    world = SimWorld(args.seed, tuple(ms / 1000 for ms in args.latency), args.bandwidth, args.drop, args.reorder,
+                     skip_empty_tips=True)
+    configs = [{"name": f"Node{i:04d}", "ip": HOST, "port": BASE_PORT + i} for i in range(args.nodes)]
+    committed = {}  # (sender, amount) -> virtual commit times on the other nodes
+    clients = [SimClient(config["name"], HOST, config["port"], [peer for peer in configs if peer is not config], False,
+                         transport=world.transport, committed=committed, world=world) for config in configs]
+    rng = random.Random(args.seed)
+    for client in clients:
+        client.start()
+    world.run()  # Waits for every start_server; anything the clients sent at startup
+    for client in clients:
+        if client.gossip:
+            # Anti-entropy on the virtual clock instead of the real-time thread started by Client.start
+            client.gossip.stop()
+            client.gossip.rng = random.Random(rng.random())
+            world.every(settings.GOSSIP_ANTI_ENTROPY_INTERVAL, client.gossip.anti_entropy,
+                        start=world.now + rng.uniform(0, settings.GOSSIP_ANTI_ENTROPY_INTERVAL))
+    return world, clients, committed, rng
+
+
+def broadcast_scenario(args, world, clients, committed, rng):
+    published = {}  # (sender, amount) -> virtual publish time
+
+    def publish(client, operation):
+        published[operation[0], operation[2]] = world.now
+        client.handle_transaction(operation, True)
+
+    for amount in range(1, args.transactions + 1):
+        client, receiver = rng.sample(clients, 2)
+        world.call_at(world.now + rng.uniform(0, PUBLISH_WINDOW), publish, client, (client.name, receiver.name, amount))
+    world.run(until=world.now + PUBLISH_WINDOW + DRAIN)
+
+    errors = []
+    complete = [times for key, times in committed.items() if len(times) == len(clients) - 1]
+    if len(complete) != args.transactions:
+        errors.append(f"only {len(complete)} of {args.transactions} transfers reached every node")
+    tables = {tuple(sorted(client.balance_table.get_whole_table().items())) for client in clients}
+    if len(tables) != 1:
+        errors.append(f"nodes ended with {len(tables)} different balance tables")
+    propagation = [max(committed[key]) - at for key, at in published.items() if len(committed.get(key, ())) == len(clients) - 1]
+    summary = f"propagation p50 {percentile(propagation, 0.5) * 1000:7.2f}ms p99 {percentile(propagation, 0.99) * 1000:7.2f}ms"
+    return summary, errors
+
+
+def mutex_scenario(args, world, clients, committed, rng):
+    requesters = rng.sample(clients, min(args.requesters, len(clients)))
+    remaining = {client.name: args.entries for client in requesters}
+    waiting = {}  # name -> (client, virtual request time)
+    latencies, errors = [], []
+    state = {"inside": None}
+
+    def want(client):
+        waiting[client.name] = (client, world.now)
+        client.mutex.begin_request()
+
+    def release(client):
+        state["inside"] = None
+        client.release_mutex()
+        remaining[client.name] -= 1
+        if remaining[client.name]:
+            world.call_later(rng.uniform(0, PUBLISH_WINDOW / 10), want, client)
+
+    def check():
+        # After every event: did it let a waiting node in?
+        for name, (client, requested_at) in list(waiting.items()):
+            if client.mutex.acquired.is_set():
+                if state["inside"] is not None:
+                    errors.append(f"{name} entered the critical section while {state['inside']} holds it")
+                    return True
+                state["inside"] = name
+                latencies.append(world.now - requested_at)
+                del waiting[name]
+                world.call_later(HOLD, release, client)
+        return False
+
+    for client in requesters:
+        world.call_later(rng.uniform(0, PUBLISH_WINDOW / 10), want, client)
+    world.run(until=world.now + PUBLISH_WINDOW + DRAIN * 10, check=check)
+    unfinished = sum(remaining.values())
+    if unfinished and not errors:
+        errors.append(f"{unfinished} critical section entries never granted")
+    messages = sum(client.mutex.messages_sent for client in clients)
+    summary = (f"acquire p50 {percentile(latencies, 0.5) * 1000:7.2f}ms p99 {percentile(latencies, 0.99) * 1000:7.2f}ms | "
+               f"{messages / max(1, len(latencies)):8.1f} msgs/entry")
+    return summary, errors
+
+
+SCENARIOS = {"broadcast": broadcast_scenario, "mutex": mutex_scenario}
+
+
+def run(args):
+    start = time.perf_counter()
+    world, clients, committed, rng = build(args)
+    setup, setup_events = time.perf_counter() - start, world.seq
+    start = time.perf_counter()
+    summary, errors = SCENARIOS[args.scenario](args, world, clients, committed, rng)
+    wall = time.perf_counter() - start
+    for network in list(world.networks.values()):
+        network.shutdown()
+    print(f"{args.scenario} N={args.nodes}: {summary} | {world.stats['delivered']} delivered "
+          f"{world.stats['dropped']} dropped | setup {setup:6.2f}s, scenario {wall:6.2f}s "
+          f"{(world.seq - setup_events) / wall:9,.0f} events/s | trace {world.trace_digest()}")
+    return world.trace_digest(), errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="broadcast")
+    parser.add_argument("--nodes", type=int, default=1000)
+    parser.add_argument("--transactions", type=int, default=200)
+    parser.add_argument("--broadcast", choices=("flood", "gossip"), default="flood")
+    parser.add_argument("--mutex", choices=sorted(MUTEX_STRATEGIES), default=settings.MUTEX_ALGORITHM)
+    parser.add_argument("--requesters", type=int, default=20)
+    parser.add_argument("--entries", type=int, default=2)
+    parser.add_argument("--latency", type=float, nargs=2, default=(0.5, 2.0), metavar=("LOW_MS", "HIGH_MS"))
+    parser.add_argument("--bandwidth", type=float, default=None, help="bytes per second per link direction")
+    parser.add_argument("--drop", type=float, default=0.0)
+    parser.add_argument("--reorder", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--check-determinism", action="store_true")
+    parser.add_argument("--profile", action="store_true")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+    if args.nodes > 1000:
+        parser.error("at most 1000 nodes (process ids are port % 1000)")
+    configure_logging(args.log_level)
+
+    if args.profile:
+        profiler = cProfile.Profile()
+        digest, errors = profiler.runcall(run, args)
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(25)
+    else:
+        digest, errors = run(args)
+    if args.check_determinism:
+        again, _ = run(args)
+        if again != digest:
+            errors.append(f"not reproducible: trace {digest} then {again}")
+    for error in errors:
+        print(error, file=sys.stderr)
+    if errors:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Discrete-event simulation of transaction dissemination: flooding over a full mesh against
+client.gossip over its overlay, for growing cluster sizes.
+
+Every node publishes MESSAGES_PER_NODE transactions at random (seeded) times. A send costs its
+sender SEND_COST of serialized work (encoding + socket write, so a flood of N-1 sends keeps the
+origin busy N-1 times as long) plus a random link latency, and each message is lost with
+probability --loss. Gossip runs the real client.gossip.Gossip instances, with anti-entropy rounds
+every ANTI_ENTROPY_INTERVAL; "epidemic" is the same run without anti-entropy.
+
+Reported, in virtual milliseconds:
+* links: connections each node keeps open
+* origin: sends the publishing node makes per transaction (its fan-out burst)
+* total: transaction sends per transaction over the whole cluster, repairs included
+* delivery: time from publish until a node has the transaction, p99 over (transaction, node) pairs
+* full propagation: time from publish until the last node has the transaction, p50 / p99 over the
+  transactions that reached every node
+* complete: transactions that reached every node; coverage: (transaction, node) pairs delivered
+
+Infect-and-die gossip misses about e^-fanout of the nodes for every transaction, so at larger N
+nearly every transaction leaves a node or two to anti-entropy, and its interval sets the time to
+full propagation; a larger --fanout trades sends for fewer repairs.
+
+Usage: python -m benchmarks.sim_gossip [--loss 0.01] [--fanout GOSSIP_FANOUT] [node counts...]   (default: 10 25 50 100 200)
+"""
+import argparse
+import heapq
+import random
+import time
+from benchmarks.stats import percentile
+from client.gossip import Gossip, overlay
+from config import settings
+
+MESSAGES_PER_NODE = 5
+PUBLISH_WINDOW = 500.0  # ms over which the transactions are published
+SEND_COST = 0.02  # ms of sender time per message sent
+LATENCY = (0.2, 1.0)  # ms, uniform
+ANTI_ENTROPY_INTERVAL = 50.0  # ms
+DRAIN = 1000.0  # ms simulated after the last publish
+
+
+def simulate(mode, node_count, loss, fanout, seed=1):
+    rng = random.Random(seed)
+    names = [f"Node{i:03d}" for i in range(node_count)]
+    events = []  # (time, seq, kind, node, message)
+    seq = 0
+    now = 0.0
+    busy = dict.fromkeys(names, 0.0)  # Time each node's outgoing sends are done
+    sends = dict.fromkeys(names, 0)
+    published = {}  # (origin, seq) -> publish time
+    origin_sends = 0
+    reached = {}  # (origin, seq) -> {node: delivery time}
+
+    def schedule(at, kind, node, message=None):
+        nonlocal seq
+        seq += 1
+        heapq.heappush(events, (at, seq, kind, node, message))
+
+    def sender_for(name):
+        def send(peer, message):
+            if message["type"] == "transaction":
+                sends[name] += 1
+            busy[name] = max(now, busy[name]) + SEND_COST
+            if rng.random() >= loss:
+                schedule(busy[name] + rng.uniform(*LATENCY), "deliver", peer, message)
+        return send
+
+    def record(name, message):
+        reached.setdefault((message["sender"], message["seq"]), {})[name] = now
+
+    gossips = {}
+    if mode != "flood":
+        gossips = {name: Gossip(name, overlay(names, name), sender_for(name), fanout, rng=random.Random(rng.random()))
+                   for name in names}
+    flood_sends = {name: sender_for(name) for name in names}
+    counters = dict.fromkeys(names, 0)
+    for name in names:
+        for _ in range(MESSAGES_PER_NODE):
+            schedule(rng.uniform(0, PUBLISH_WINDOW), "publish", name)
+        if mode == "gossip":
+            schedule(rng.uniform(0, ANTI_ENTROPY_INTERVAL), "anti_entropy", name)
+
+    while events:
+        now, _, kind, name, message = heapq.heappop(events)
+        if kind == "publish":
+            message = {"type": "transaction", "sender": name}
+            before = sends[name]
+            if gossips:
+                gossips[name].publish(message)
+            else:
+                counters[name] += 1
+                message["seq"] = counters[name]
+                for peer in names:
+                    if peer != name:
+                        flood_sends[name](peer, message)
+            published[(name, message["seq"])] = now
+            origin_sends += sends[name] - before
+            record(name, message)
+        elif kind == "deliver":
+            if message["type"] == "gossip_digest":
+                gossips[name].on_message(message)
+            elif not gossips or gossips[name].receive(message):
+                record(name, message)
+        elif kind == "anti_entropy" and now < PUBLISH_WINDOW + DRAIN:
+            gossips[name].anti_entropy()
+            schedule(now + ANTI_ENTROPY_INTERVAL, "anti_entropy", name)
+
+    propagation = [max(nodes.values()) - published[key] for key, nodes in reached.items() if len(nodes) == node_count]
+    deliveries = [at - published[key] for key, nodes in reached.items() for at in nodes.values()]
+    delivered = sum(len(nodes) for nodes in reached.values())
+    links = sum(len(gossip.peers) for gossip in gossips.values()) / node_count if gossips else node_count - 1
+    return (links, origin_sends / len(published), sum(sends.values()) / len(published), percentile(deliveries, 0.99),
+            percentile(propagation, 0.5), percentile(propagation, 0.99), len(propagation) / len(published),
+            delivered / (len(published) * node_count))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--loss", type=float, default=0.01, help="probability that a message is lost")
+    parser.add_argument("--fanout", type=int, default=settings.GOSSIP_FANOUT)
+    parser.add_argument("node_counts", type=int, nargs="*", default=[10, 25, 50, 100, 200])
+    args = parser.parse_args()
+    for node_count in args.node_counts:
+        for mode in ("flood", "epidemic", "gossip"):
+            start = time.perf_counter()
+            links, origin, total, delivery, p50, p99, complete, coverage = simulate(mode, node_count, args.loss, args.fanout)
+            print(f"N={node_count:>4} {mode:>8}: links {links:5.1f} | sends origin {origin:5.1f} total {total:6.1f} | delivery "
+                  f"p99 {delivery:7.2f}ms | full propagation p50 {p50:7.2f}ms p99 {p99:7.2f}ms | complete {complete:7.2%} "
+                  f"coverage {coverage:8.4%} | {time.perf_counter() - start:5.2f}s")
+
+
+if __name__ == "__main__":
+    main()
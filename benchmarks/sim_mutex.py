@@ -0,0 +1,89 @@
+"""Discrete-event simulation of the mutual exclusion strategies in client.mutex.
+
+N nodes each enter the critical section a few times. Messages take a random (seeded) latency but
+stay FIFO per link, as over TCP. The run checks that at most one node is ever inside the critical
+section and reports messages sent per entry and acquisition latency, in virtual milliseconds.
+
+Usage: python -m benchmarks.sim_mutex [entries per node] [node counts...]   (default: 5, 4 9 16 25 49 100)
+"""
+import heapq
+import random
+import sys
+import time
+from benchmarks.stats import percentile
+from client.lamport import LamportClock
+from client.mutex import MUTEX_STRATEGIES
+
+
+def simulate(strategy_class, node_count, entries, seed=1):
+    rng = random.Random(seed)
+    names = [f"Node{i:03d}" for i in range(node_count)]
+    events = []  # (time, seq, kind, node, message)
+    seq = 0
+    now = 0.0
+    link_clock = {}  # (sender, receiver) -> last delivery time, keeps every link FIFO
+
+    def schedule(at, kind, node, message=None):
+        nonlocal seq
+        seq += 1
+        heapq.heappush(events, (at, seq, kind, node, message))
+
+    def sender_for(name):
+        def send(peer, message):
+            link = (name, peer)
+            at = max(now + rng.uniform(0.5, 2.0), link_clock.get(link, 0.0))
+            link_clock[link] = at
+            schedule(at, "deliver", peer, message)
+        return send
+
+    nodes = {name: strategy_class(name, names, LamportClock(i), sender_for(name)) for i, name in enumerate(names)}
+    remaining = {name: entries for name in names}
+    requested_at = {}
+    in_cs = None
+    latencies = []
+    for name in names:
+        schedule(rng.uniform(0, 5), "want", name)
+
+    while events:
+        now, _, kind, name, message = heapq.heappop(events)
+        node = nodes[name]
+        if kind == "want":
+            requested_at[name] = now
+            node.begin_request()
+        elif kind == "deliver":
+            node.on_message(message)
+        elif kind == "release":
+            in_cs = None
+            node.release()
+            remaining[name] -= 1
+            if remaining[name]:
+                schedule(now + rng.uniform(0, 10), "want", name)
+        # Did this event let a node in? (local delivery can grant a node other than `name` only for itself)
+        if name in requested_at and node.acquired.is_set():
+            if in_cs is not None:
+                raise AssertionError(f"{name} entered the critical section while {in_cs} holds it")
+            in_cs = name
+            latencies.append(now - requested_at.pop(name))
+            schedule(now + 1.0, "release", name)
+
+    unfinished = sum(remaining.values())
+    if unfinished:
+        raise AssertionError(f"deadlock: {unfinished} critical section entries never granted")
+    messages = sum(node.messages_sent for node in nodes.values())
+    return messages / (node_count * entries), sum(latencies) / len(latencies), percentile(latencies, 0.99)
+
+
+def main():
+    entries = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    node_counts = [int(arg) for arg in sys.argv[2:]] or [4, 9, 16, 25, 49, 100]
+    for node_count in node_counts:
+        for name, strategy_class in MUTEX_STRATEGIES.items():
+            start = time.perf_counter()
+            per_entry, mean_latency, p99_latency = simulate(strategy_class, node_count, entries)
+            wall = time.perf_counter() - start
+            print(f"N={node_count:>4} {name:>16}: {per_entry:8.1f} msgs/entry | acquire mean {mean_latency:8.1f}ms "
+                  f"p99 {p99_latency:8.1f}ms | simulated in {wall:6.2f}s")
+
+
+if __name__ == "__main__":
+    main()
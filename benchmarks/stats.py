@@ -0,0 +1,7 @@
+"""Summary statistics shared by the benchmarks."""
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of values (fraction in [0, 1]), NaN when there are none."""
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else float("nan")
@@ -0,0 +1,26 @@
+"""Check of client.peers.Backoff over a long outage: a peer that stays down for thousands of redial
+attempts must keep getting delays within [cap * (1 - jitter), cap * (1 + jitter)] once capped,
+never an exception (which would end its supervisor and the redialing with it).
+
+Exits with status 1 if a delay is out of range.
+
+Usage: python -m benchmarks.stress_backoff [attempts]   (default: 5000)
+"""
+import sys
+from client.peers import Backoff
+
+
+def main():
+    attempts = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    backoff = Backoff()
+    delays = [backoff.next_delay() for _ in range(attempts)]
+    low, high = backoff.cap * (1 - backoff.jitter), backoff.cap * (1 + backoff.jitter)
+    bad = [(attempt, delay) for attempt, delay in enumerate(delays[100:], 100) if not low <= delay <= high]
+    print(f"{attempts} attempts: delays {min(delays):.3f}s .. {max(delays):.3f}s {'FAILED' if bad else 'ok'}")
+    if bad:
+        print(f"attempt {bad[0][0]}: delay {bad[0][1]} outside [{low}, {high}]", file=sys.stderr)
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""Stress test of client.request_queue.RequestQueue, client.lamport.LamportClock and the mutex
+strategies under many threads.
+
+* queue: THREADS threads interleave requests and removals for their own senders in one shared
+  queue, stamping every request from one shared LamportClock. Checks: every stamp is unique and
+  the clock ends at the number of ticks (no lost updates), the queue holds exactly the live
+  requests, and draining it yields them in strictly increasing (clock, process id) order.
+* removal: single-threaded add/remove throughput at several queue sizes, against the queue as it
+  was before (linear scan + heapify on every removal).
+* mutex: NODES strategy instances in one process, each with its own delivery thread (FIFO, as over
+  TCP), every node entering the critical section ENTRIES times. Checks: never two nodes inside at
+  once; for Lamport and Ricart-Agrawala, entries happen in request timestamp order.
+
+Exits with status 1 if an invariant is broken.
+
+Usage: python -m benchmarks.stress_request_queue [events per thread] [threads]   (default: 20000, 8)
+"""
+import heapq
+import queue
+import random
+import sys
+import threading
+import time
+from client.lamport import LamportClock
+from client.mutex import MUTEX_STRATEGIES
+from client.request_queue import RequestQueue
+
+SENDERS_PER_THREAD = 16
+NODES = 6
+ENTRIES = 200
+ORDERED_STRATEGIES = ("lamport", "ricart_agrawala")  # Grant in request timestamp order over FIFO links
+
+
+class LegacyRequestQueue:
+    """RequestQueue before the rewrite (clock only, linear removal), kept here for comparison."""
+    def __init__(self):
+        self.queue = []
+
+    def add_request(self, lamport_time, client_id):
+        heapq.heappush(self.queue, (lamport_time[0], client_id))
+
+    def remove_request(self, client_id):
+        for i, request in enumerate(self.queue):
+            if request[1] == client_id:
+                self.queue[i] = self.queue[-1]
+                self.queue.pop()
+                heapq.heapify(self.queue)
+                return request
+        return None
+
+
+def guarded(target, errors):
+    """target wrapped so that an exception in its thread is appended to errors instead of dying with it."""
+    def run(*args):
+        try:
+            target(*args)
+        except Exception as e:
+            errors.append(f"{threading.current_thread().name}: {e!r}")
+    return run
+
+
+def stress_queue(events, thread_count):
+    requests = RequestQueue()
+    errors = []
+    clock = LamportClock(0)
+    barrier = threading.Barrier(thread_count + 1)
+    stamps = [[] for _ in range(thread_count)]
+    models = [{} for _ in range(thread_count)]  # Per thread: sender -> its live request
+
+    def worker(index):
+        rng = random.Random(index)
+        senders = [f"T{index}-S{i}" for i in range(SENDERS_PER_THREAD)]
+        model = models[index]
+        barrier.wait()
+        for _ in range(events):
+            sender = rng.choice(senders)
+            if sender in model and rng.random() < 0.5:
+                # Raised rather than asserted, so the check also runs under python -O
+                removed, expected = requests.remove_request(sender), model.pop(sender)
+                if removed is None or removed[0] != expected:
+                    raise RuntimeError(f"wrong request removed for {sender}: {removed}, expected {expected}")
+            else:
+                stamp = clock.increment()
+                stamps[index].append(stamp)
+                requests.add_request(stamp, sender)  # Replaces the sender's previous request, if any
+                model[sender] = stamp
+
+    threads = [threading.Thread(target=guarded(worker, errors), args=(index,)) for index in range(thread_count)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    all_stamps = [stamp for thread_stamps in stamps for stamp in thread_stamps]
+    if len(set(all_stamps)) != len(all_stamps) or clock.get_time()[0] != len(all_stamps):
+        errors.append(f"clock lost updates: {len(all_stamps)} ticks, {len(set(all_stamps))} unique, clock at {clock.get_time()[0]}")
+    expected = sorted((stamp, sender) for model in models for sender, stamp in model.items())
+    drained = []
+    while (request := requests.get_next_request()) is not None:
+        drained.append(request)
+    if drained != expected:
+        errors.append(f"queue drained {len(drained)} requests out of order or wrong, expected {len(expected)}")
+    return events * thread_count / elapsed, errors
+
+
+def removal_throughput(queue_class, size, operations=20000):
+    # Keep size requests queued; every operation removes a random sender and queues it again
+    requests, clock, rng = queue_class(), LamportClock(0), random.Random(size)
+    senders = [f"S{i}" for i in range(size)]
+    for sender in senders:
+        requests.add_request(clock.increment(), sender)
+    start = time.perf_counter()
+    for _ in range(operations):
+        sender = rng.choice(senders)
+        requests.remove_request(sender)
+        requests.add_request(clock.increment(), sender)
+    return operations / (time.perf_counter() - start)
+
+
+def stress_mutex(strategy_name, node_count, entries):
+    names = [f"Node{i}" for i in range(node_count)]
+    inboxes = {name: queue.Queue() for name in names}
+    nodes = {name: MUTEX_STRATEGIES[strategy_name](name, names, LamportClock(i), lambda peer, msg: inboxes[peer].put(msg))
+             for i, name in enumerate(names)}
+    inside, entered, lock, errors = [], [], threading.Lock(), []
+
+    def deliver(name):
+        while (msg := inboxes[name].get()) is not None:
+            nodes[name].on_message(msg)
+
+    def request_time(node):
+        return node.queue.get_request(node.name) if strategy_name == "lamport" else node.request_time
+
+    def worker(name):
+        node, rng = nodes[name], random.Random(name)
+        for _ in range(entries):
+            node.request()
+            with lock:
+                inside.append(name)
+                if len(inside) > 1:
+                    errors.append(f"{strategy_name}: {inside} in the critical section together")
+                entered.append(request_time(node))
+            if rng.random() < 0.1:
+                time.sleep(0)
+            with lock:
+                inside.remove(name)
+            node.release()
+
+    deliverers = [threading.Thread(target=deliver, args=(name,), daemon=True) for name in names]
+    workers = [threading.Thread(target=guarded(worker, errors), args=(name,)) for name in names]
+    for thread in deliverers + workers:
+        thread.start()
+    start = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    for name in names:
+        inboxes[name].put(None)
+    if strategy_name in ORDERED_STRATEGIES and entered != sorted(entered):
+        errors.append(f"{strategy_name}: critical section entries not in request timestamp order")
+    messages = sum(node.messages_sent for node in nodes.values())
+    return node_count * entries / elapsed, messages, errors[:5]
+
+
+def main():
+    events = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    thread_count = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    failures = []
+
+    rate, errors = stress_queue(events, thread_count)
+    failures += errors
+    print(f"queue: {thread_count} threads x {events} events {rate:>10,.0f} events/s {'FAILED' if errors else 'ok'}")
+    for size in (16, 256, 4096):
+        legacy, indexed = removal_throughput(LegacyRequestQueue, size), removal_throughput(RequestQueue, size)
+        print(f"removal at {size:>5} queued: legacy {legacy:>10,.0f}/s | indexed {indexed:>10,.0f}/s")
+    for strategy_name in MUTEX_STRATEGIES:
+        rate, messages, errors = stress_mutex(strategy_name, NODES, ENTRIES)
+        failures += errors
+        print(f"mutex {strategy_name:>15}: {NODES * ENTRIES} entries {rate:>8,.0f}/s, {messages} messages {'FAILED' if errors else 'ok'}")
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    if failures:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,187 @@
-import socket
 import hashlib
-import threading
-import time
+import struct
+
+GENESIS_DIGEST = bytes(32)  # prev digest of the genesis block, shown as "0" like before
+BATCH_MARKER = b"\xff\xff"  # Payload prefix of multi-operation blocks, never a valid sender length
+BATCH_HEADER = struct.Struct(">2sI")  # marker, number of operations
+LENGTH = struct.Struct(">H")  # Name length prefix
+MAX_NAME_LENGTH = 0xfffe  # Longest encoded name: a sender length of 0xffff would read as BATCH_MARKER
+AMOUNT = struct.Struct(">q")
+
+
+def encode_operation(operation):
+    """Fixed binary layout of an operation: sender (u16 length + utf-8), receiver (u16 length + utf-8), amount (i64).
+    Raises ValueError for a name longer than MAX_NAME_LENGTH bytes."""
+    sender, receiver, amount = operation
+    sender, receiver = str(sender).encode("utf-8"), str(receiver).encode("utf-8")
+    if len(sender) > MAX_NAME_LENGTH or len(receiver) > MAX_NAME_LENGTH:
+        raise ValueError(f"account names are limited to {MAX_NAME_LENGTH} bytes")
+    # Precompiled structs and concatenation, not a struct format built for every operation
+    return LENGTH.pack(len(sender)) + sender + LENGTH.pack(len(receiver)) + receiver + AMOUNT.pack(amount)
+
+
+def decode_operation(payload):
+    (sender_len,) = LENGTH.unpack_from(payload, 0)
+    sender = bytes(payload[2:2 + sender_len]).decode("utf-8")
+    pos = 2 + sender_len
+    (receiver_len,) = LENGTH.unpack_from(payload, pos)
+    receiver = bytes(payload[pos + 2:pos + 2 + receiver_len]).decode("utf-8")
+    (amount,) = AMOUNT.unpack_from(payload, pos + 2 + receiver_len)
+    return (sender, receiver, amount)
+
+
+def encode_batch(operations):
+    """Payload of a multi-operation block: BATCH_HEADER followed by each operation's own layout."""
+    return BATCH_HEADER.pack(BATCH_MARKER, len(operations)) + b"".join(encode_operation(op) for op in operations)
+
+
+def operation_size(payload, pos):
+    # Byte length of the operation encoded at payload[pos:]
+    (sender_len,) = LENGTH.unpack_from(payload, pos)
+    (receiver_len,) = LENGTH.unpack_from(payload, pos + 2 + sender_len)
+    return 2 + sender_len + 2 + receiver_len + 8
+
+
+def split_payload(payload):
+    """Raw encoded operations of a block payload, one for a single-operation block."""
+    if payload[:2] != BATCH_MARKER:
+        return [payload]
+    _, count = BATCH_HEADER.unpack_from(payload, 0)
+    operations = []
+    pos = BATCH_HEADER.size
+    for _ in range(count):
+        size = operation_size(payload, pos)
+        operations.append(payload[pos:pos + size])
+        pos += size
+    return operations
+
+
+def merkle_root(leaves):
+    """Merkle root over encoded operations. Leaves and inner nodes are hashed with different
+    prefixes, and an odd node is promoted as is rather than paired with itself."""
+    level = [hashlib.sha256(b"\x00" + leaf).digest() for leaf in leaves]
+    while len(level) > 1:
+        paired = [hashlib.sha256(b"\x01" + level[i] + level[i + 1]).digest() for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            paired.append(level[-1])
+        level = paired
+    return level[0]
+
+
+def block_digest(payload, prev_digest):
+    """On+1.Hash for a block payload. Single-operation blocks hash SHA256(Operation||Hash),
+    multi-operation blocks hash SHA256(MerkleRoot(Operations)||Hash)."""
+    if payload[:2] == BATCH_MARKER:
+        return hashlib.sha256(merkle_root(split_payload(payload)) + prev_digest).digest()
+    return hashlib.sha256(payload + prev_digest).digest()
+
+
+def to_digest(block_hash):
+    # Accept a raw 32-byte digest, a 64-char hex string, or "0" for the genesis block
+    if type(block_hash) is bytes:
+        return block_hash
+    return GENESIS_DIGEST if block_hash == "0" else bytes.fromhex(block_hash)
+
+
+def to_hex(digest):
+    return "0" if digest == GENESIS_DIGEST else digest.hex()
+
 
 class Block:
     """Class made to represent a block in the blockchain.
-    * Each block contains only one transaction.
+    * Each block contains one transaction, or a sealed batch of them (see Block.batch).
     * operation: (<sender, receiver, amount>) and hash pointers.
     * prev_hash: This hash is a pair consisting of a pointer to previous block and the hash of the content of the previous block
-        On+1.Hash = SHA256(On.Operation||On.Hash)"""
-    def __init__(self, operation, prev_hash):
-        self.operation = operation # Tuple: (sender, receiver, amount) (REQUIREMENT)
-        self.prev_hash = prev_hash # On+1.Hash = SHA256(On.Operation||On.Hash) (REQUIREMENT)
-        self.hash = self.compute_hash()
+        On+1.Hash = SHA256(On.Operation||On.Hash)
+
+    Stored compactly: the operation is kept in its fixed binary layout (see encode_operation) and both
+    hashes as raw 32-byte digests. operation, hash and prev_hash are decoded / hex encoded on access,
+    which only display and the wire need.
+
+    Hash rule migration: the rule is still SHA256(Operation||Hash), but Operation is now the binary layout
+    and Hash the raw digest of the previous block, i.e.
+        digest = SHA256(encode_operation(operation) || prev_digest)
+    instead of SHA256(f"{sender}{receiver}{amount}{prev_hex}"). The genesis prev digest is 32 zero bytes
+    (still shown as "0"). Hashes produced by the old rule do not verify under the new one, so chains
+    persisted by an older version have to be rebuilt.
+
+    Batched blocks replace Operation with the Merkle root of their operations:
+        digest = SHA256(merkle_root(operations) || prev_digest)"""
+    __slots__ = ("payload", "prev_digest", "digest")
+
+    def __init__(self, operation, prev_hash, block_hash=None):
+        self.payload = encode_operation(operation) # Binary (sender, receiver, amount) (REQUIREMENT)
+        self.prev_digest = to_digest(prev_hash) # On+1.Hash = SHA256(On.Operation||On.Hash) (REQUIREMENT)
+        # block_hash is only passed when loading an already hashed block back from storage. Otherwise
+        # block_digest of a single-operation block, inlined: this is the commit hot path
+        self.digest = (to_digest(block_hash) if block_hash is not None
+                       else hashlib.sha256(self.payload + self.prev_digest).digest())
+
+    @classmethod
+    def from_record(cls, payload, prev_digest, digest):
+        # Rebuild a stored block straight from its binary fields, without re-encoding or re-hashing
+        block = cls.__new__(cls)
+        block.payload = bytes(payload)
+        block.prev_digest = prev_digest
+        block.digest = digest
+        return block
+
+    @classmethod
+    def batch(cls, operations, prev_hash):
+        """Seal several operations into one block. A batch of one is an ordinary single-operation block."""
+        if len(operations) == 1:
+            return cls(operations[0], prev_hash)
+        block = cls.__new__(cls)
+        block.payload = encode_batch(operations)
+        block.prev_digest = to_digest(prev_hash)
+        block.digest = block.compute_digest()
+        return block
+
+    def is_batch(self):
+        return self.payload[:2] == BATCH_MARKER
+
+    @property
+    def operations(self):
+        return [decode_operation(op) for op in split_payload(self.payload)]
+
+    @property
+    def merkle_root(self):
+        return merkle_root(split_payload(self.payload))
+
+    @property
+    def operation(self):
+        # Only meaningful for single-operation blocks, use operations for batches
+        if self.is_batch():
+            raise ValueError("batched block has several operations")
+        return decode_operation(self.payload)
+
+    @operation.setter
+    def operation(self, operation):
+        # Like assigning the old attribute: the stored hash is NOT recomputed
+        self.payload = encode_operation(operation)
+
+    @property
+    def hash(self):
+        return self.digest.hex()
+
+    @property
+    def prev_hash(self):
+        return to_hex(self.prev_digest)
+
+    @prev_hash.setter
+    def prev_hash(self, prev_hash):
+        self.prev_digest = to_digest(prev_hash)
+
+    def compute_digest(self):
+        return block_digest(self.payload, self.prev_digest)
 
     def compute_hash(self):
         # Combine operation details and previous hash for the current hash
-        content = f"{self.operation[0]}{self.operation[1]}{self.operation[2]}{self.prev_hash}"
-        return hashlib.sha256(content.encode()).hexdigest()
+        return self.compute_digest().hex()
 
     def __repr__(self):
+        if self.is_batch():
+            return f"Block(Operations={len(self.operations)}, Hash={self.hash})"
         sender, receiver, amount = self.operation
         return (f"Block(Sender={sender}, Receiver={receiver}, Amount={amount}, "
                 f"Hash={self.hash})")
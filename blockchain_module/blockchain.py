@@ -1,37 +1,134 @@
-import socket
-import hashlib
-import threading
-import time
-from .block import Block
+from .block import Block, GENESIS_DIGEST
+from .history import HistoryIndex
+from .store import BlockStore
+from .verify import ChainVerifier, verify_range
+from telemetry import metrics
 
 
 class Blockchain:
     """Class made to represent a blockchain, storing blocks in a linked list.
-    Supports adding blocks, validating the chain, and retrieving the last block."""
-    def __init__(self):
-        self.chain = []
+    Supports adding blocks, validating the chain, and retrieving the last block.
+    * store_path: optional directory for a BlockStore, so the chain survives a restart.
+      Without it the chain only lives in memory. durability is the BlockStore's (none / batch / every).
+    * history: HistoryIndex for transfer and historical balance queries. Appends keep it current once
+      it is; a chain loaded from disk is only indexed on the first query, so restarts stay fast."""
+    def __init__(self, store_path=None, sync_every=64, sync_interval=0.05, checkpoint_every=1000, durability="none"):
+        if store_path:
+            self.chain = BlockStore(store_path, sync_every, sync_interval, durability)
+        else:
+            self.chain = []
+        self.verifier = ChainVerifier()
+        self.history = HistoryIndex(checkpoint_every)
 
     def add_block(self, operation):
         prev_block = self.chain[-1] if self.chain else None
-        prev_hash = prev_block.hash if prev_block else "0"  # "0" for genesis block
-        new_block = Block(operation, prev_hash)
-        self.chain.append(new_block)
+        prev_digest = prev_block.digest if prev_block else GENESIS_DIGEST  # "0" for genesis block
+        with metrics.time("block_hash_seconds"):
+            new_block = Block(operation, prev_digest)
+        with metrics.time("block_append_seconds"):
+            self.chain.append(new_block)
+        self.index_appended(new_block)
         return new_block
 
+    def add_batch(self, operations):
+        # Seal several operations into a single block (Merkle root over the operations)
+        prev_block = self.chain[-1] if self.chain else None
+        prev_digest = prev_block.digest if prev_block else GENESIS_DIGEST
+        with metrics.time("block_hash_seconds"):
+            new_block = Block.batch(operations, prev_digest)
+        with metrics.time("block_append_seconds"):
+            self.chain.append(new_block)
+        self.index_appended(new_block)
+        return new_block
+
+    def index_appended(self, block):
+        # Keep the history index current, unless it is still waiting for its first (lazy) build or
+        # indexed blocks that are no longer in the chain (update starts over then)
+        with self.history.lock:
+            if self.history.height == len(self.chain) - 1 and block.prev_digest == self.history.tip:
+                self.history.add(self.history.height, block)
+
+    def get_height(self, block_hash):
+        # Height of the block with this hash (hex or raw digest), None if it is not in the chain
+        self.history.update(self.chain)
+        return self.history.height_of(block_hash)
+
+    def get_transfers(self, account, start=0, end=None):
+        # (height, (sender, receiver, amount)) of every transfer involving account in blocks [start, end)
+        self.history.update(self.chain)
+        return self.history.transfers(self.chain, account, start, end)
+
+    def get_balance_change(self, account, height):
+        # Net amount account received minus sent in blocks [0, height)
+        self.history.update(self.chain)
+        return self.history.balance_change(self.chain, account, height)
+
     def print_chain(self):
         for block in self.chain:
-            sender, receiver, amount = block.operation
-            print(f"Sender: {sender}, Receiver: {receiver}, Amount: {amount}, Hash: {block.hash}")
+            for sender, receiver, amount in block.operations:
+                print(f"Sender: {sender}, Receiver: {receiver}, Amount: {amount}, Hash: {block.hash}")
 
     def get_last_block(self):
         # Return the last block in the chain, or None if empty
         return self.chain[-1] if self.chain else None
 
+    def get_block(self, height):
+        # Random access by height (0 is the genesis block), None if out of range
+        if 0 <= height < len(self.chain):
+            return self.chain[height]
+        return None
+
+    def records(self, start, end):
+        # Raw (payload, prev_digest, digest) of the blocks in [start, end), as shipped by chain sync
+        return [(block.payload, block.prev_digest, block.digest) for block in self.chain[start:end]]
+
+    def payloads(self, start=0, end=None):
+        # Raw payloads of the blocks in [start, end), for bulk replay (client.replay)
+        if isinstance(self.chain, BlockStore):
+            return self.chain.payloads(start, end)
+        return (block.payload for block in self.chain[start:end])
+
+    def extend_records(self, records, verified=False):
+        """Append blocks received from a peer, given as raw (payload, prev_digest, digest) records.
+        The first one must link to the current tip and every hash is recomputed before anything is
+        appended (unless the caller already ran verify_range over them, verified=True); raises
+        ValueError with the height of the first bad block otherwise."""
+        start = len(self.chain)
+        expected_prev = self.chain[-1].digest if self.chain else GENESIS_DIGEST
+        if records and records[0][1] != expected_prev:
+            raise ValueError(f"block {start} does not link to the chain tip")
+        bad_height = None if verified else verify_range(start, records)
+        if bad_height is not None:
+            raise ValueError(f"block {bad_height} failed verification")
+        blocks = [Block.from_record(payload, prev_digest, digest) for payload, prev_digest, digest in records]
+        self.chain.extend(blocks)  # One write (and at most one fsync) for the whole range
+        for block in blocks:
+            self.index_appended(block)
+        # The range is verified already, move the checkpoint along if it was at the old tip
+        if blocks and self.verifier.verified_height == start:
+            self.verifier.verified_height = len(self.chain)
+            self.verifier.verified_digest = blocks[-1].digest
+        return blocks
+
+    def flush(self):
+        # Force the pending group commit to disk (no-op for an in-memory chain)
+        if isinstance(self.chain, BlockStore):
+            self.chain.sync()
+
+    def wait_durable(self, height):
+        # Block until the first height blocks are on disk, as far as the store's durability level promises
+        if isinstance(self.chain, BlockStore):
+            self.chain.wait_durable(height)
+
+    def close(self):
+        if isinstance(self.chain, BlockStore):
+            self.chain.close()
+
     def is_valid_chain(self):
-        # Validate the integrity of the blockchain
-        for i in range(1, len(self.chain)):
-            current = self.chain[i]
-            previous = self.chain[i - 1]
-            if current.prev_hash != previous.hash:
-                return False
-        return True
+        # Validate the integrity of the blockchain: every hash is recomputed and every link checked,
+        # but blocks already verified by an earlier call are skipped
+        return self.first_invalid_height() is None
+
+    def first_invalid_height(self):
+        # Height of the first tampered or mislinked block, or None if the chain is valid
+        return self.verifier.first_invalid_height(self.chain)
@@ -0,0 +1,87 @@
+import threading
+from bisect import bisect_left
+from .block import GENESIS_DIGEST, to_digest
+
+
+class HistoryIndex:
+    """Secondary indexes over a chain, for history queries that do not scan every block.
+    * postings: account -> ascending heights of the blocks with a transfer involving it
+    * heights: block digest -> height
+    * checkpoints: every checkpoint_every blocks, the net balance change of every account since
+      genesis. A historical balance is the checkpoint at or below the height plus the account's own
+      blocks after it, so it costs O(log n + checkpoint_every) instead of a scan from genesis.
+    Balances here are changes relative to the start of the chain; callers add the initial balances.
+    update(chain) indexes the blocks appended since the last call, so the index can be kept current
+    on every append or brought up to date lazily before a query. It starts over when the chain no
+    longer ends in the indexed tip (truncated by crash recovery, possibly re-extended since)."""
+    def __init__(self, checkpoint_every=1000):
+        self.checkpoint_every = checkpoint_every
+        self.lock = threading.RLock()
+        self.postings = {}
+        self.heights = {}
+        self.checkpoints = [{}]  # checkpoints[i]: net changes over blocks [0, i * checkpoint_every)
+        self.running = {}  # Net changes over blocks [0, height)
+        self.height = 0  # Number of blocks indexed
+        self.tip = GENESIS_DIGEST  # Digest of block height - 1, the genesis prev digest when empty
+
+    def update(self, chain):
+        with self.lock:
+            if self.height > len(chain) or (self.height and chain[self.height - 1].digest != self.tip):
+                self.reset()  # The chain was truncated (crash recovery), start over
+            for height in range(self.height, len(chain)):
+                self.add(height, chain[height])
+
+    def reset(self):
+        self.postings.clear()
+        self.heights.clear()
+        self.checkpoints = [{}]
+        self.running = {}
+        self.height = 0
+        self.tip = GENESIS_DIGEST
+
+    def add(self, height, block):
+        for sender, receiver, amount in block.operations:
+            for account in (sender, receiver):
+                posting = self.postings.setdefault(account, [])
+                if not posting or posting[-1] != height:
+                    posting.append(height)
+            self.running[sender] = self.running.get(sender, 0) - amount
+            self.running[receiver] = self.running.get(receiver, 0) + amount
+        self.heights[block.digest] = height
+        self.height = height + 1
+        self.tip = block.digest
+        if self.height % self.checkpoint_every == 0:
+            self.checkpoints.append(dict(self.running))
+
+    def height_of(self, block_hash):
+        # Height of the block with this digest (raw or hex), or None
+        with self.lock:
+            return self.heights.get(to_digest(block_hash))
+
+    def blocks_of(self, account, start=0, end=None):
+        """Heights in [start, end) of the blocks with a transfer involving account."""
+        with self.lock:
+            posting = self.postings.get(account, [])
+            end = self.height if end is None else min(end, self.height)
+            return posting[bisect_left(posting, start):bisect_left(posting, end)]
+
+    def transfers(self, chain, account, start=0, end=None):
+        """(height, operation) of every transfer involving account in blocks [start, end)."""
+        return [(height, operation) for height in self.blocks_of(account, start, end)
+                for operation in chain[height].operations if account in operation[:2]]
+
+    def balance_change(self, chain, account, height):
+        """Net balance change of account over blocks [0, height)."""
+        with self.lock:
+            height = min(height, self.height)
+            base = height // self.checkpoint_every * self.checkpoint_every
+            change = self.checkpoints[base // self.checkpoint_every].get(account, 0)
+        for _, (sender, receiver, amount) in self.transfers(chain, account, base, height):
+            if sender == account:
+                change -= amount
+            if receiver == account:
+                change += amount
+        return change
+
+    def __repr__(self):
+        return f"HistoryIndex(blocks={self.height}, accounts={len(self.postings)}, checkpoint_every={self.checkpoint_every})"
@@ -0,0 +1,267 @@
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from .block import Block
+from telemetry import metrics
+
+log = logging.getLogger(__name__)
+
+# Segment file layout: magic (4 bytes) and format version (u16), then the block records back to back
+# Record layout inside the segment file:
+#   header  -> payload length (u32), prev digest (32 bytes), block digest (32 bytes)
+#   payload -> the block's operation in the layout of block.encode_operation
+SEGMENT_MAGIC = b"BCS1"
+SEGMENT_VERSION = 1
+SEGMENT_HEADER = struct.Struct(">4sH")
+RECORD_HEADER = struct.Struct(">I32s32s")
+INDEX_ENTRY = struct.Struct(">Q")  # byte offset of each record in the segment file
+DURABILITY_LEVELS = ("none", "batch", "every")
+
+
+class BlockStore:
+    """Append-only, on-disk storage for the blocks of a Blockchain.
+    * chain.seg holds the block records back to back, chain.idx holds one fixed-size offset per block.
+    * Appends are group committed: one fsync covers every block written since the last sync,
+      either once sync_every blocks are pending or sync_interval seconds have passed.
+    * durability says when an appended block is on disk:
+      "none"  -> only by that background group commit; a crash may lose the last few blocks
+      "batch" -> once wait_durable(height) returns. Callers waiting at the same time share one fsync,
+                 and blocks keep being appended while it runs
+      "every" -> before append returns (one fsync per block, extend syncs once for all its blocks)
+    * The store is the write-ahead log of a client: a record is the intent and its commit at once,
+      recover() drops a torn one, and everything else (balances, snapshots) is rebuilt from it.
+    * Reads go through memory maps, so a restarted node only decodes the blocks it actually asks for.
+    * chain.seg starts with a magic and format version; opening a file without them (or with another
+      version) raises ValueError instead of reading it as blocks.
+    Behaves like a list of Block objects, so Blockchain can use it in place of self.chain."""
+    def __init__(self, directory, sync_every=64, sync_interval=0.05, durability="none"):
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError(f"durability must be one of {DURABILITY_LEVELS}, not {durability!r}")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.durability = durability
+        self.lock = threading.RLock()  # Guards the files and counters, held for writes but not for fsync
+        self.sync_lock = threading.Lock()  # One fsync at a time; a caller that waited for it may find its block synced
+        self.segment_path = os.path.join(directory, "chain.seg")
+        self.index_path = os.path.join(directory, "chain.idx")
+        self.segment = open(self.segment_path, "a+b")
+        self.index = open(self.index_path, "a+b")
+        self.segment_map = None
+        self.index_map = None
+        self.mapped_count = 0  # Number of blocks currently visible through the memory maps
+        self.pending = 0  # Blocks written but not yet fsynced
+        self.synced_count = 0  # Blocks known to be on disk
+        self.last_sync = time.monotonic()
+        self.last_block = None
+        self.closed = False
+        self.check_header()
+        self.count = self.synced_count = self.recover()
+        self.segment_end = self.segment.seek(0, os.SEEK_END)
+        self.remap()
+        if self.count:
+            self.last_block = self.read_block(self.count - 1)
+        self.sync_thread = None
+        if sync_interval:
+            self.sync_thread = threading.Thread(target=self.sync_loop, daemon=True)
+            self.sync_thread.start()
+
+    def check_header(self):
+        """Write the segment header into a new store, reject a segment that is not one of ours."""
+        segment_size = os.path.getsize(self.segment_path)
+        if segment_size < SEGMENT_HEADER.size and not os.path.getsize(self.index_path):
+            # New store, or one whose header write was torn before any block was appended
+            self.segment.truncate(0)
+            self.segment.write(SEGMENT_HEADER.pack(SEGMENT_MAGIC, SEGMENT_VERSION))
+            self.segment.flush()
+            os.fsync(self.segment.fileno())
+            return
+        self.segment.seek(0)
+        header = self.segment.read(SEGMENT_HEADER.size)
+        if len(header) < SEGMENT_HEADER.size or header[:4] != SEGMENT_MAGIC:
+            self.close_files()
+            raise ValueError(f"{self.segment_path} is not a block store segment")
+        (version,) = struct.unpack_from(">H", header, 4)
+        if version != SEGMENT_VERSION:
+            self.close_files()
+            raise ValueError(f"{self.segment_path} has format version {version}, expected {SEGMENT_VERSION}")
+
+    def close_files(self):
+        self.segment.close()
+        self.index.close()
+
+    def recover(self):
+        """Bring chain.seg and chain.idx back in step after a crash.
+        Only the tail is inspected on the normal path: index entries pointing past the end of the
+        segment are dropped, complete records that never made it into the index are re-indexed,
+        and a torn record at the end of the segment is truncated away."""
+        segment_size = os.path.getsize(self.segment_path)
+        index_size = os.path.getsize(self.index_path)
+        count = index_size // INDEX_ENTRY.size
+        end = SEGMENT_HEADER.size
+        with open(self.index_path, "rb") as index, open(self.segment_path, "rb") as segment:
+            # Walk back from the last index entry until one points at a complete record
+            while count:
+                index.seek((count - 1) * INDEX_ENTRY.size)
+                (offset,) = INDEX_ENTRY.unpack(index.read(INDEX_ENTRY.size))
+                record_end = self.record_end(segment, offset, segment_size)
+                if record_end is not None:
+                    end = record_end
+                    break
+                count -= 1
+
+            # Re-index records that were written to the segment after the last index flush
+            missing = []
+            while True:
+                record_end = self.record_end(segment, end, segment_size)
+                if record_end is None:
+                    break
+                missing.append(end)
+                end = record_end
+
+        if count * INDEX_ENTRY.size != index_size:
+            self.index.truncate(count * INDEX_ENTRY.size)
+        if missing:
+            self.index.write(b"".join(INDEX_ENTRY.pack(offset) for offset in missing))
+        if end != segment_size:
+            log.warning("BlockStore: truncating %d torn bytes from %s", segment_size - end, self.segment_path)
+            self.segment.truncate(end)
+        self.segment.flush()
+        self.index.flush()
+        os.fsync(self.segment.fileno())
+        os.fsync(self.index.fileno())
+        return count + len(missing)
+
+    @staticmethod
+    def record_end(segment, offset, segment_size):
+        # End offset of the record starting at offset, or None if it is not completely on disk
+        if offset + RECORD_HEADER.size > segment_size:
+            return None
+        segment.seek(offset)
+        payload_len, _, _ = RECORD_HEADER.unpack(segment.read(RECORD_HEADER.size))
+        record_end = offset + RECORD_HEADER.size + payload_len
+        return record_end if record_end <= segment_size else None
+
+    def remap(self):
+        """(Re)create the read-only memory maps so they cover every block appended so far."""
+        self.segment.flush()
+        self.index.flush()
+        if self.segment_map is not None:
+            self.segment_map.close()
+            self.index_map.close()
+            self.segment_map = self.index_map = None
+        if self.count:
+            self.segment_map = mmap.mmap(self.segment.fileno(), 0, access=mmap.ACCESS_READ)
+            self.index_map = mmap.mmap(self.index.fileno(), 0, access=mmap.ACCESS_READ)
+        self.mapped_count = self.count
+
+    def append(self, block):
+        self.extend([block])
+
+    def extend(self, blocks):
+        with self.lock:
+            for block in blocks:
+                record = RECORD_HEADER.pack(len(block.payload), block.prev_digest, block.digest) + block.payload
+                self.segment.write(record)
+                self.index.write(INDEX_ENTRY.pack(self.segment_end))
+                self.segment_end += len(record)
+                # last_block before count: __getitem__ reads both without the lock, the new height
+                # must never be paired with the previous block
+                self.last_block = block
+                self.count += 1
+                self.pending += 1
+            due = self.durability == "every" or self.pending >= self.sync_every
+        if due:
+            self.sync()
+
+    def sync(self, count=None):
+        """Group commit: a single fsync per file makes every block written so far durable.
+        With count, returns at once if the first count blocks already are."""
+        with self.sync_lock:
+            with self.lock:
+                if self.closed or self.synced_count >= (self.count if count is None else count):
+                    return
+                self.segment.flush()
+                self.index.flush()
+                target, started = self.count, time.perf_counter()
+            # Outside the lock, so appends go on while the disk works; they are left for the next sync.
+            # Segment first, so a durable index entry never points at missing data
+            os.fsync(self.segment.fileno())
+            os.fsync(self.index.fileno())
+            with self.lock:
+                metrics.observe("store_fsync_seconds", time.perf_counter() - started)
+                metrics.inc("store_fsync_blocks", target - self.synced_count)
+                self.synced_count = target
+                self.pending = self.count - target
+                self.last_sync = time.monotonic()
+
+    def wait_durable(self, count):
+        """Block until the first count blocks are on disk ("batch" durability; no-op for the others)."""
+        if self.durability == "batch" and self.synced_count < count:
+            self.sync(count)
+
+    def sync_loop(self):
+        while not self.closed:
+            time.sleep(self.sync_interval)
+            if self.pending and time.monotonic() - self.last_sync >= self.sync_interval:
+                self.sync()
+
+    def read_block(self, height):
+        with self.lock:
+            if height >= self.mapped_count:
+                self.remap()
+            (offset,) = INDEX_ENTRY.unpack_from(self.index_map, height * INDEX_ENTRY.size)
+            payload_len, prev_digest, digest = RECORD_HEADER.unpack_from(self.segment_map, offset)
+            start = offset + RECORD_HEADER.size
+            return Block.from_record(self.segment_map[start:start + payload_len], prev_digest, digest)
+
+    def payloads(self, start=0, end=None):
+        """Payloads of the blocks in [start, end) straight from the memory map, without building Blocks."""
+        with self.lock:
+            end = self.count if end is None else min(end, self.count)
+            if end > self.mapped_count:
+                self.remap()
+            index_map, segment_map = self.index_map, self.segment_map
+        for height in range(start, end):
+            (offset,) = INDEX_ENTRY.unpack_from(index_map, height * INDEX_ENTRY.size)
+            (payload_len,) = struct.unpack_from(">I", segment_map, offset)
+            yield segment_map[offset + RECORD_HEADER.size:offset + RECORD_HEADER.size + payload_len]
+
+    def __len__(self):
+        return self.count
+
+    def __bool__(self):
+        return self.count > 0
+
+    def __getitem__(self, height):
+        if isinstance(height, slice):
+            return [self[i] for i in range(*height.indices(self.count))]
+        if height < 0:
+            height += self.count
+        if not 0 <= height < self.count:
+            raise IndexError("block height out of range")
+        if height == self.count - 1:
+            return self.last_block
+        return self.read_block(height)
+
+    def __iter__(self):
+        for height in range(self.count):
+            yield self[height]
+
+    def close(self):
+        self.sync()
+        with self.sync_lock, self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            if self.segment_map is not None:
+                self.segment_map.close()
+                self.index_map.close()
+            self.close_files()
+
+    def __repr__(self):
+        return f"BlockStore(directory={self.directory!r}, blocks={self.count}, durability={self.durability})"
@@ -0,0 +1,97 @@
+import os
+from .block import GENESIS_DIGEST, block_digest
+
+
+def verify_range(start, records):
+    """Recompute the hash of every block in records and check each prev_hash link.
+    * start: height of records[0]. Its own prev_hash link is checked by the caller.
+    * records: list of (payload, prev_digest, digest) tuples, the raw fields of each Block.
+    Returns the height of the first bad block, or None if the whole range is valid.
+    Kept at module level so a process pool can run it."""
+    prev_digest = None
+    for offset, (payload, block_prev_digest, digest) in enumerate(records):
+        if prev_digest is not None and block_prev_digest != prev_digest:
+            return start + offset
+        if block_digest(payload, block_prev_digest) != digest:
+            return start + offset
+        prev_digest = digest
+    return None
+
+
+class ChainVerifier:
+    """Verification engine behind Blockchain.is_valid_chain.
+    * Remembers how far the chain has already been verified (verified_height plus the digest at that
+      point), so repeated calls only hash the blocks appended since.
+    * A cold audit of a long chain is split into ranges of chunk_size blocks and checked on a process
+      pool; ranges after the first bad block are cancelled.
+    * Reports the height of the first bad block instead of a plain True/False."""
+    def __init__(self, workers=None, chunk_size=50_000, parallel_threshold=200_000):
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.parallel_threshold = parallel_threshold  # Below this many unverified blocks, stay in-process
+        self.verified_height = 0  # Blocks [0, verified_height) are known good
+        self.verified_digest = None  # Digest of block verified_height - 1
+
+    def reset(self):
+        self.verified_height = 0
+        self.verified_digest = None
+
+    def first_invalid_height(self, chain):
+        """Return the height of the first block that fails verification, or None if the chain is valid."""
+        # The checkpoint is only trusted if the chain still ends the verified prefix with the same block
+        if self.verified_height > len(chain) or (
+                self.verified_height and chain[self.verified_height - 1].digest != self.verified_digest):
+            self.reset()
+
+        start = self.verified_height
+        if start == len(chain):
+            return None
+
+        # The first unverified block must link to the checkpoint (or be a genesis block)
+        expected_prev = self.verified_digest if start else GENESIS_DIGEST
+        if chain[start].prev_digest != expected_prev:
+            return start
+
+        records = [(block.payload, block.prev_digest, block.digest) for block in chain[start:]]
+        if len(records) >= self.parallel_threshold and self.workers > 1:
+            bad_height = self.audit_parallel(start, records)
+        else:
+            bad_height = verify_range(start, records)
+
+        if bad_height is None:
+            self.verified_height = len(chain)
+            self.verified_digest = records[-1][2]
+        elif bad_height > start:
+            # Everything before the bad block is still good, keep it as the new checkpoint
+            self.verified_height = bad_height
+            self.verified_digest = records[bad_height - start - 1][2]
+        return bad_height
+
+    def audit_parallel(self, start, records):
+        """Check records in chunk_size ranges across a process pool, stopping at the first bad block."""
+        from concurrent.futures import ProcessPoolExecutor, as_completed  # Slow to import, only needed for large audits
+        bad_height = None
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            futures = {}
+            for offset in range(0, len(records), self.chunk_size):
+                chunk = records[offset:offset + self.chunk_size]
+                # Link across the range boundary: the first block of each range must point at the
+                # stored digest of the last block of the previous range, which that range re-hashes
+                if offset and chunk[0][1] != records[offset - 1][2]:
+                    bad_height = start + offset if bad_height is None else min(bad_height, start + offset)
+                    break
+                futures[pool.submit(verify_range, start + offset, chunk)] = start + offset
+            for future in as_completed(futures):
+                if future.cancelled():
+                    continue
+                result = future.result()
+                if result is not None and (bad_height is None or result < bad_height):
+                    bad_height = result
+                    # Later ranges can no longer produce an earlier failure
+                    for other, range_start in futures.items():
+                        if range_start > bad_height:
+                            other.cancel()
+        return bad_height
+
+    def __repr__(self):
+        return f"ChainVerifier(verified_height={self.verified_height}, workers={self.workers})"
@@ -0,0 +1,356 @@
+import asyncio
+import collections
+import logging
+import socket
+import threading
+from client import codec as wire
+from client import peers as peer_links
+from client.dispatch import Dispatcher
+from telemetry import metrics
+
+log = logging.getLogger(__name__)
+
+
+class Peer:
+    """One connection of an AsyncNetwork: the asyncio streams plus a bounded queue of encoded
+    messages waiting to be written. The queue bound is the backpressure: senders block once a
+    slow peer has write_queue_size messages outstanding. Messages that find the queue full wait in
+    backlog, in order, and everything after them queues up behind them (see AsyncNetwork.push)."""
+    def __init__(self, name, reader, writer, addr, write_queue_size):
+        self.name = name
+        self.reader = reader
+        self.writer = writer
+        self.addr = addr
+        self.queue = asyncio.Queue(maxsize=write_queue_size)
+        self.backlog = collections.deque()  # Encoded messages waiting for room in queue, oldest first
+        self.backlog_task = None  # Moves the backlog into the queue while there is one
+        self.writer_task = None
+        self.buffer = wire.FrameBuffer()
+        self.binary = False  # Whether the peer accepted the binary protocol
+        self.closed = asyncio.Event()  # Set once the link is dropped, wakes its supervisor
+
+    def __repr__(self):
+        return f"Peer(name={self.name}, addr={self.addr})"
+
+
+class AsyncNetwork:
+    """Drop-in replacement for Network built on asyncio.
+    * A single event loop thread runs every connection: no thread per accepted socket.
+    * Same wire formats, hello/hello_ack handshake and link supervision as Network (see client.codec
+      and client.peers); incoming bytes are read in chunks into the peer's FrameBuffer.
+    * Each peer has a writer task draining a bounded write queue, so broadcast_message enqueues to
+      all peers concurrently instead of doing one blocking sendall after another.
+    * handler_function(conn, addr, msg) keeps the Network contract; it runs on the worker pool of a
+      client.dispatch.Dispatcher (handlers may block). At most one job per connection drains that
+      connection's lane, which keeps messages in order and costs one thread hop per burst, not per
+      message. Reading from a connection pauses while its lane is full."""
+    def __init__(self, host, port, write_queue_size=1024, handler_threads=8, codec="binary", name=None, pid=None,
+                 dispatcher=None):
+        self.host = host
+        self.port = port
+        self.id = port % 1000
+        self.name = name or f"Client-{port}"
+        self.pid = self.id if pid is None else pid
+        self.write_queue_size = write_queue_size
+        self.codec = codec
+        # Bind right away, like Network, so a port clash fails in the constructor
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((self.host, self.port))
+        self.socket.listen(128)
+        self.connections = {}  # Keep track of active connections {client_name: Peer}
+        self.links_changed = threading.Condition()  # Notified whenever a link comes or goes (wait_for_peers)
+        self.dispatcher = dispatcher or Dispatcher(handler_threads, write_queue_size, name=self.name)
+        self.handler_function = None
+        self.server = None
+        self.server_ready = threading.Event()
+        self.supervisors = []
+        self.stopped = threading.Event()
+        self.loop = asyncio.new_event_loop()
+        self.loop_thread = threading.Thread(target=self.loop.run_forever, daemon=True, name=f"network-{self.id}")
+        self.loop_thread.start()
+        metrics.gauge("write_queue_depth", lambda: sum(peer.queue.qsize() for peer in list(self.connections.values())), self.name)
+
+    def run(self, coroutine):
+        # Run a coroutine on the network loop from any other thread and wait for its result
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def add_connection(self, client_name, host, port):
+        """Establish a connection to a peer (one attempt, see connect_peers for a supervised link)."""
+        try:
+            peer = self.run(self.open_connection(client_name, host, port))
+            log.info("Connected to %s:%d using %s messages", host, port, "binary" if peer.binary else "JSON")
+        except Exception as e:
+            log.warning("Failed to connect to %s:%d - %s", host, port, e)
+
+    async def open_connection(self, client_name, host, port):
+        """Connect, run the handshake, register the link and start reading from it (links are full duplex)."""
+        reader, writer = await asyncio.open_connection(host, port)
+        peer_links.configure_socket(writer.get_extra_info("socket"))
+        peer = Peer(client_name, reader, writer, (host, port), self.write_queue_size)
+        try:
+            name = await self.handshake(peer)
+        except (OSError, ConnectionError):
+            writer.close()
+            raise
+        self.register(peer, name)
+        asyncio.ensure_future(self.read_loop(peer))
+        return peer
+
+    async def handshake(self, peer):
+        """Send our hello and wait briefly for the hello_ack. Returns the name to register the link under:
+        the one the peer reports, or the dialed name for peers that never answer (JSON-only, no handshake)."""
+        peer.writer.write(wire.encode_json(peer_links.hello_message(self.name, self.pid, self.codec)))
+        await peer.writer.drain()
+
+        async def wait_for_ack():
+            while True:
+                reply = peer.buffer.next_message()
+                if reply is not None:
+                    return reply
+                chunk = await peer.reader.read(65536)
+                if not chunk:
+                    raise ConnectionError("closed during handshake")
+                peer.buffer.feed(chunk)
+
+        try:
+            reply = await asyncio.wait_for(wait_for_ack(), peer_links.HELLO_TIMEOUT)
+        except asyncio.TimeoutError:
+            log.info("No hello_ack from %s, staying on JSON", peer.addr)
+            return peer.name
+        if reply.get("type") != "hello_ack":
+            return peer.name
+        peer.binary = reply.get("codec") == wire.BINARY_CODEC
+        if reply.get("name") != peer.name:
+            log.warning("Dialed %s but %s answered", peer.name, reply.get("name"))
+        return reply.get("name", peer.name)
+
+    def register(self, peer, client_name):
+        """Make peer THE link to client_name (runs on the loop). A newer link replaces an older one, so
+        there is never more than one link per peer."""
+        peer.name = client_name
+        if peer.writer_task is None:
+            peer.writer_task = asyncio.ensure_future(self.write_loop(peer))
+        old = self.connections.get(client_name)
+        with self.links_changed:
+            self.connections[client_name] = peer
+            self.links_changed.notify_all()
+        if old is not None and old is not peer:
+            log.info("Replacing older link to %s", client_name)
+            self.drop(old)
+
+    def connect_peers(self, peers):
+        """Keep a link to every configured peer: dial (and keep redialing) the peers with a higher process
+        id, wait for the others to dial us."""
+        for peer in peers:
+            if peer_links.should_dial(self.pid, peer_links.peer_pid(peer)):
+                self.supervisors.append(asyncio.run_coroutine_threadsafe(self.supervise(peer), self.loop))
+
+    async def supervise(self, config):
+        """Dial a peer, wait for the link to drop, redial with exponential backoff and jitter."""
+        backoff = peer_links.Backoff()
+        while not self.server_ready.is_set():
+            await asyncio.sleep(0.01)
+        while not self.stopped.is_set():
+            try:
+                peer = await self.open_connection(config["name"], config["ip"], config["port"])
+            except (OSError, ConnectionError) as e:
+                delay = backoff.next_delay()
+                log.info("Failed to connect to %s (%s), retrying in %.2fs", config["name"], e, delay)
+                await asyncio.sleep(delay)
+                continue
+            log.info("Connected to %s at %s:%d", config["name"], config["ip"], config["port"])
+            backoff.reset()
+            await peer.closed.wait()
+
+    def wait_for_peers(self, names, timeout):
+        """Block until there is a link to each of names, or timeout. Returns the names still missing."""
+        with self.links_changed:
+            self.links_changed.wait_for(lambda: all(name in self.connections for name in names), timeout)
+            return [name for name in names if name not in self.connections]
+
+    def start_server(self, handler_function):
+        """Start the server to handle incoming connections. Blocks until shutdown(), like Network."""
+        log.info("Server started on %s:%d", self.host, self.port)
+        self.handler_function = handler_function
+
+        async def on_accept(reader, writer):
+            addr = writer.get_extra_info("peername")
+            log.info("New connection from %s", addr)
+            peer_links.configure_socket(writer.get_extra_info("socket"))
+            # Registered under the peer's name once its hello arrives (see read_loop)
+            peer = Peer(None, reader, writer, addr, self.write_queue_size)
+            peer.writer_task = asyncio.ensure_future(self.write_loop(peer))
+            await self.read_loop(peer)
+
+        async def serve():
+            self.server = await asyncio.start_server(on_accept, sock=self.socket)
+
+        self.run(serve())
+        self.server_ready.set()
+        self.stopped.wait()
+
+    async def read_loop(self, peer):
+        """Handles communication with a specific client, in either direction of the link."""
+        try:
+            while True:
+                chunk = await peer.reader.read(65536)
+                if not chunk:
+                    break
+                peer.buffer.feed(chunk)
+                while True:
+                    msg = peer.buffer.next_message()
+                    if msg is None:
+                        break
+                    if msg.get("type") in peer_links.HANDSHAKE_TYPES:
+                        await self.answer_handshake(peer, msg)
+                        continue
+                    if peer.name is None:
+                        # A peer without the hello handshake, register it like before
+                        self.register(peer, f"Client-{peer.addr[1]}")
+                    await self.dispatch(peer, msg)
+        except ConnectionError:
+            pass
+        log.info("Connection from %s closed", peer.addr)
+        self.drop(peer)
+
+    async def answer_handshake(self, peer, msg):
+        """Handshake messages are answered here, the handler never sees them."""
+        if msg["type"] == "hello":
+            reply = peer_links.hello_reply(msg, self.name, self.pid, self.codec)
+        elif msg["type"] == "codec_hello":
+            # Codec-only handshake of older peers
+            reply = wire.hello_reply(msg, self.codec)
+        else:
+            return  # A late hello_ack / codec_ack, nothing to do
+        peer.binary = reply["codec"] == wire.BINARY_CODEC
+        self.push(peer, wire.encode_json(reply))
+        if msg["type"] == "hello":
+            self.register(peer, msg["name"])
+
+    async def dispatch(self, peer, msg):
+        # Inbound backpressure: while the handler is far behind, stop reading until there is room,
+        # unless the message is one the dispatcher sheds anyway
+        if msg.get("type") not in self.dispatcher.shed_types:
+            while True:
+                room = self.loop.create_future()
+
+                def wake(room=room):
+                    self.loop.call_soon_threadsafe(lambda: room.done() or room.set_result(None))
+                if not self.dispatcher.when_room(peer, wake):
+                    break
+                await room
+        self.dispatcher.submit(peer, self.handler_function, peer, peer.addr, msg, block=False)
+
+    async def write_loop(self, peer):
+        try:
+            while True:
+                data = await peer.queue.get()
+                peer.writer.write(data)
+                # Coalesce: only wait for the socket once nothing else is queued for this peer
+                if peer.queue.empty():
+                    await peer.writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+
+    def drop(self, peer):
+        if self.connections.get(peer.name) is peer:
+            with self.links_changed:
+                del self.connections[peer.name]
+                self.links_changed.notify_all()
+        peer.closed.set()
+        self.dispatcher.close(peer)
+        for task in (peer.writer_task, peer.backlog_task):
+            if task:
+                task.cancel()
+        peer.writer.close()
+
+    def send_message(self, client_name, message):
+        """Send a message to a specific client identified by client_name."""
+        peer = self.connections.get(client_name)
+        if peer is None:
+            log.warning("No active connection to %s (live connections: %s)", client_name, list(self.connections))
+            return
+        data = wire.encode_binary(message) if peer.binary else wire.encode_json(message)
+        self.enqueue([peer], data)
+        metrics.inc("bytes_sent", len(data), client_name)
+        log.debug("Message %s sent to %s at %s", message, client_name, peer.addr)
+
+    def broadcast_message(self, message):
+        """Sends a message to all active connections, enqueueing to every peer concurrently."""
+        log.debug("Broadcasting message from %s", message["sender"])
+        peers = list(self.connections.values())
+        # Encode once per wire format, not once per peer
+        binary_peers = [peer for peer in peers if peer.binary]
+        json_peers = [peer for peer in peers if not peer.binary]
+        for group, encode in ((binary_peers, wire.encode_binary), (json_peers, wire.encode_json)):
+            if group:
+                data = encode(message)
+                self.enqueue(group, data)
+                if metrics.enabled:
+                    for peer in group:
+                        metrics.inc("bytes_sent", len(data), peer.name)
+        log.debug("Message broadcast to %d peers", len(peers))
+
+    def enqueue(self, peers, data):
+        """Queue data for every peer in one hop to the loop. The caller only blocks (backpressure)
+        when one of the peers already has a full write queue or a backlog, until their backlogs
+        are written to the queue."""
+        if any(peer.queue.full() or peer.backlog for peer in peers):
+            async def push_and_wait():
+                for peer in peers:
+                    self.push(peer, data)
+                backlogs = [peer.backlog_task for peer in peers if peer.backlog_task]
+                await asyncio.gather(*backlogs, return_exceptions=True)  # A dropped peer's is cancelled
+            self.run(push_and_wait())
+            return
+
+        def push_all():
+            for peer in peers:
+                self.push(peer, data)
+        self.loop.call_soon_threadsafe(push_all)
+
+    def push(self, peer, data):
+        """Queue data for peer without blocking the loop (runs on it). Per-peer order is kept: once
+        a message finds the queue full, it and every later one wait in the peer's backlog."""
+        if not peer.backlog and not peer.queue.full():
+            peer.queue.put_nowait(data)
+            return
+        peer.backlog.append(data)
+        if peer.backlog_task is None:
+            peer.backlog_task = asyncio.ensure_future(self.flush_backlog(peer))
+
+    async def flush_backlog(self, peer):
+        try:
+            while peer.backlog:
+                await peer.queue.put(peer.backlog[0])
+                peer.backlog.popleft()  # Only now, so that push keeps appending behind it meanwhile
+        finally:
+            peer.backlog_task = None
+
+    def close_connection(self, client_name):
+        """Closes a specific connection to a client."""
+        peer = self.connections.get(client_name)
+        if peer is not None:
+            self.loop.call_soon_threadsafe(self.drop, peer)
+            log.info("Connection to %s at %s closed", client_name, peer.addr)
+
+    def shutdown(self):
+        """Closes all active connections and shuts down the server."""
+        log.info("Shutting down %d network...", self.id)
+        self.stopped.set()  # Supervisors stop redialing
+        metrics.remove_gauge("write_queue_depth", self.name)
+
+        async def close_all():
+            for supervisor in self.supervisors:
+                supervisor.cancel()
+            if self.server is not None:
+                self.server.close()
+            for peer in list(self.connections.values()):
+                self.drop(peer)
+
+        self.run(close_all())
+        self.socket.close()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.dispatcher.shutdown()
+        log.info("%d network shut down", self.id)
@@ -1,18 +1,126 @@
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+
+class StripeLocks:
+    """Context manager holding a set of stripe locks, acquired in the given (ascending) order."""
+    __slots__ = ("locks",)
+
+    def __init__(self, locks):
+        self.locks = locks
+
+    def __enter__(self):
+        for lock in self.locks:
+            lock.acquire()
+
+    def __exit__(self, *exc_info):
+        for lock in reversed(self.locks):
+            lock.release()
+
+
 class BalanceTable:
     """Class made to Manage a dictionary of balances for each client.
-    Verifies and updates balances during transactions."""
-    def __init__(self, initial_balances):
+    Verifies and updates balances during transactions.
+    * Thread-safe: accounts are spread over `stripes` locks. A transfer only takes the stripes of its
+      two accounts, always in ascending stripe order, so concurrent transfers between unrelated accounts
+      do not wait on each other and overlapping ones cannot deadlock.
+    * Validation is optimistic: a transfer that clearly overdraws is rejected from an unlocked read,
+      and every transfer is checked again under its locks before anything is written.
+    * apply_atomic / rollback apply a group of transfers all-or-nothing and undo them, for callers that
+      have to back out when a later step (e.g. appending the block) fails."""
+    def __init__(self, initial_balances, stripes=64):
         self.table = initial_balances  # Dictionary: {client_name: balance} (REQUIREMENT)
+        self.stripes = [threading.Lock() for _ in range(stripes)]
+
+    def stripe(self, account):
+        return hash(account) % len(self.stripes)
+
+    def locked(self, accounts):
+        """Hold the stripe locks of every account in accounts, taken in ascending stripe order."""
+        return StripeLocks([self.stripes[index] for index in sorted({self.stripe(account) for account in accounts})])
+
+    def locked_pair(self, sender, receiver):
+        # locked([sender, receiver]) without the set and sort, for the single transfer path
+        first, second = self.stripe(sender), self.stripe(receiver)
+        if first == second:
+            return self.stripes[first]
+        if first > second:
+            first, second = second, first
+        return StripeLocks((self.stripes[first], self.stripes[second]))
+
+    def locked_all(self):
+        return StripeLocks(self.stripes)
+
     def get_balance(self, client):
         return self.table.get(client, 0)
+
     def get_whole_table(self):
-        return self.table
+        # Consistent copy: no transfer is half applied while it is taken
+        with self.locked_all():
+            return dict(self.table)
+
     def update_init_balance(self, client, amount):
-        self.table[client] = amount
+        with self.locked([client]):
+            self.table[client] = amount
+
+    def replace(self, table):
+        # Swap in a whole new set of balances (e.g. loaded from a snapshot)
+        with self.locked_all():
+            self.table.clear()
+            self.table.update(table)
+
     def update_balance(self, sender, receiver, amount):
-        print(self.table)
-        if self.table[sender] < amount:
-            raise ValueError("Insufficient funds")
-        self.table[sender] -= amount
-        self.table[receiver] = self.get_balance(receiver) + amount
-        print(f"Balance updated in {sender}'s account. {sender}'s new Balance Table : {self.table}")
+        if self.get_balance(sender) < amount:
+            raise ValueError("Insufficient funds")  # Optimistic check, no lock taken
+        with self.locked_pair(sender, receiver):
+            sender_balance = self.get_balance(sender) - amount
+            if sender_balance < 0:
+                raise ValueError("Insufficient funds")
+            self.table[sender] = sender_balance
+            self.table[receiver] = self.get_balance(receiver) + amount
+        log.debug("Balance updated in %s's account. %s's new balance: %d", sender, sender, sender_balance)
+
+    def apply_batch(self, operations):
+        """Validate and apply a batch of (sender, receiver, amount) operations in order.
+        Each operation is checked against the balances left by the ones before it; operations that
+        would overdraw are skipped. Returns (accepted operations, [(rejected operation, reason)])."""
+        accepted, rejected = [], []
+        accounts = {account for sender, receiver, _ in operations for account in (sender, receiver)}
+        with self.locked(accounts):
+            for operation in operations:
+                sender, receiver, amount = operation
+                if self.get_balance(sender) < amount:
+                    rejected.append((operation, "Insufficient funds"))
+                    continue
+                self.table[sender] = self.get_balance(sender) - amount  # The sender may have no entry yet (amount <= 0)
+                self.table[receiver] = self.get_balance(receiver) + amount
+                accepted.append(operation)
+        log.debug("Batch applied: %d accepted, %d rejected", len(accepted), len(rejected))
+        return accepted, rejected
+
+    def apply_atomic(self, operations):
+        """Apply every operation or none of them: raises ValueError (and changes nothing) if any
+        operation would overdraw, given the ones before it. Undo with rollback(operations)."""
+        accounts = {account for sender, receiver, _ in operations for account in (sender, receiver)}
+        with self.locked(accounts):
+            pending = {}  # Balances as they will be once the operations so far are applied
+            for sender, receiver, amount in operations:
+                balance = pending.get(sender, self.get_balance(sender))
+                if balance < amount:
+                    raise ValueError(f"Insufficient funds: {sender} cannot send {amount}")
+                pending[sender] = balance - amount
+                pending[receiver] = pending.get(receiver, self.get_balance(receiver)) + amount
+            self.table.update(pending)
+
+    def rollback(self, operations):
+        """Undo operations applied by apply_atomic (in reverse order)."""
+        accounts = {account for sender, receiver, _ in operations for account in (sender, receiver)}
+        with self.locked(accounts):
+            for sender, receiver, amount in reversed(operations):
+                self.table[receiver] -= amount
+                self.table[sender] = self.get_balance(sender) + amount
+
+    def __repr__(self):
+        return f"BalanceTable(accounts={len(self.table)}, stripes={len(self.stripes)})"
@@ -0,0 +1,81 @@
+import threading
+import time
+from concurrent.futures import Future
+
+
+class TransactionBatcher:
+    """Collects locally submitted transfers and hands them to commit_function in batches.
+    * A batch is sealed once max_size transfers are pending or the oldest one has waited max_delay seconds.
+    * commit_function(operations) returns (accepted, rejected) like BalanceTable.apply_batch.
+    * submit() returns a Future per transfer: result True once committed, ValueError if rejected."""
+    def __init__(self, commit_function, max_size=64, max_delay=0.01):
+        self.commit_function = commit_function
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.pending = []  # [(operation, future, submit time)]
+        self.condition = threading.Condition()
+        self.seal_lock = threading.Lock()  # Keeps batches committed in the order they were taken
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, operation):
+        future = Future()
+        with self.condition:
+            self.pending.append((tuple(operation), future, time.monotonic()))
+            if len(self.pending) >= self.max_size:
+                self.condition.notify()
+            elif len(self.pending) == 1:
+                self.condition.notify()  # Start the max_delay timer for a new batch
+        return future
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and not self.pending:
+                    self.condition.wait()
+                if not self.running and not self.pending:
+                    return
+                # Wait until the batch is full or its oldest transfer is due
+                deadline = self.pending[0][2] + self.max_delay
+                while self.running and len(self.pending) < self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+            with self.seal_lock:
+                with self.condition:
+                    batch, self.pending = self.pending[:self.max_size], self.pending[self.max_size:]
+                if batch:
+                    self.seal(batch)
+
+    def seal(self, batch):
+        try:
+            accepted, rejected = self.commit_function([operation for operation, _, _ in batch])
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        # accepted and rejected are both in submission order, so walk them alongside the batch
+        accepted_pos = rejected_pos = 0
+        for operation, future, _ in batch:
+            if accepted_pos < len(accepted) and tuple(accepted[accepted_pos]) == operation:
+                accepted_pos += 1
+                future.set_result(True)
+            else:
+                future.set_exception(ValueError(rejected[rejected_pos][1]))
+                rejected_pos += 1
+
+    def flush(self):
+        """Seal whatever is pending right away."""
+        with self.seal_lock:
+            with self.condition:
+                batch, self.pending = self.pending, []
+            if batch:
+                self.seal(batch)
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.thread.join()
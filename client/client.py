@@ -1,11 +1,26 @@
 from client.network import Network
 from blockchain_module.blockchain import Blockchain
 from client.balance_table import BalanceTable
+from client.batcher import TransactionBatcher
 from client.lamport import LamportClock
-from client.request_queue import RequestQueue
+from client.mutex import MUTEX_STRATEGIES
+from client.sync import ChainSync, SYNC_TYPES
+from client.gossip import Gossip, GOSSIP_TYPES, overlay
+from client.dispatch import Dispatcher
+from blockchain_module.verify import verify_range
+from client.replay import replay
+from client.snapshot import SnapshotStore, recover_balances
+from config import settings
+from telemetry import configure_logging, metrics
+from concurrent.futures import Future
+import itertools
+import logging
+import os
 import threading
 import time
 
+log = logging.getLogger(__name__)
+
 def run_client(name, host, port, peers, first):
         """
         This function runs in its own process. It creates a single Client instance,
@@ -13,6 +28,7 @@ def run_client(name, host, port, peers, first):
         """
         from client.client import Client  # or an absolute import
 
+        configure_logging(settings.LOG_LEVEL)
         client = Client(name, host, port, peers, first)
         client.start()  # This starts the client's network server thread, etc.
 
@@ -30,106 +46,286 @@ def run_client(name, host, port, peers, first):
 class Client:
     """Class to represent a client in the blockchain network.
     * Each client has a name, host, port, blockchain, network, lamport logical clock, and balance table.
+    * transport: factory for the network, called like the Network constructor. Defaults to the backend named
+      by settings.NETWORK_BACKEND; client.sim_network.SimWorld.transport runs the client on a simulated network.
     """
-    def __init__(self, name, host, port, peers, first):
+    def __init__(self, name, host, port, peers, first, transport=None):
         self.name = name 
         self.host = host
         self.port = port
         self.first = first
         self.peers = peers  # List of other clients' configurations
-        self.blockchain = Blockchain()
-        self.network = Network(host, port)
+        store_path = os.path.join(settings.DATA_DIR, name) if settings.DATA_DIR else None
+        self.blockchain = Blockchain(store_path, settings.STORE_SYNC_EVERY, settings.STORE_SYNC_INTERVAL,
+                                     settings.HISTORY_CHECKPOINT_EVERY, settings.STORE_DURABILITY)
+        # Balance table snapshots next to the block store, so a restart only replays the newest blocks
+        self.snapshots = None
+        if store_path and settings.SNAPSHOT_INTERVAL:
+            self.snapshots = SnapshotStore(os.path.join(store_path, "snapshots"), settings.SNAPSHOT_INTERVAL,
+                                           settings.SNAPSHOT_RETENTION)
         self.id = port % 1000
         self.lamport_clock = LamportClock(port % 1000) #port % 1000 is the client_id
-        self.request_queue = RequestQueue()  # Priority queue for Lamport mutex requests
-        self.mutex_held = False  # Whether this client holds the mutex
-        self.mutex_request_handler = threading.Lock()  # New mutex to handle incoming mutex requests
-        self.acks_count = 0  # Number of acknowledgements received from other client peers, as we maintain a connection to all
-        self.real_connection_count = 0
-        self.balance_table = BalanceTable({name: 10}) #starting out with a balance of 10$ (REQUIREMENT)
-        self.ack_event = threading.Event()
-        self.mutex_release_event = threading.Event()
+        # Received messages reach handle_msg through a Dispatcher (worker pool, bounded per-link queues)
+        dispatcher = Dispatcher(settings.DISPATCH_WORKERS, settings.DISPATCH_QUEUE_LIMIT, settings.DISPATCH_SHED_TYPES,
+                                settings.DISPATCH_PROCESS_WORKERS, name=name)
+        if transport is None and settings.NETWORK_BACKEND == "asyncio":
+            from client.async_network import AsyncNetwork as transport  # asyncio takes longer to import than the rest of the client
+        transport = transport or Network
+        self.network = transport(host, port, codec=settings.WIRE_CODEC, name=name, pid=self.id, dispatcher=dispatcher)
+        # Mutual exclusion algorithm (settings.MUTEX_ALGORITHM), see client.mutex
+        peer_names = [peer["name"] for peer in peers]
+        self.mutex = MUTEX_STRATEGIES[settings.MUTEX_ALGORITHM](name, peer_names, self.lamport_clock, self.network.send_message)
+        self.initial_balances = {name: settings.INITIAL_BALANCE}  # Balances before the first block, for history queries
+        self.balance_table = BalanceTable(dict(self.initial_balances)) #starting out with a balance of 10$ (REQUIREMENT)
+        self.query_ids = itertools.count()
+        self.pending_queries = {}  # query id -> Future of a history / balance_at request sent to a peer
+        self.commit_lock = threading.Lock()  # Serializes balance table + blockchain updates
+        # Catch-up of blocks missed while offline, see client.sync
+        self.sync = ChainSync(name, self.blockchain, self.network.send_message, self.apply_synced_blocks,
+                              self.replay_held, settings.SYNC_CHUNK_SIZE, settings.SYNC_WINDOW,
+                              snapshots=self.snapshots, restore=self.apply_unsynced_blocks)
+        # Gossip dissemination over a sparse overlay instead of a full mesh (settings.BROADCAST_MODE)
+        self.gossip = None
+        if settings.BROADCAST_MODE == "gossip":
+            self.gossip = Gossip(name, overlay(peer_names, name), self.network.send_message, settings.GOSSIP_FANOUT,
+                                 settings.GOSSIP_CACHE_SIZE, on_gap=lambda peer: self.network.send_message(peer, self.sync.tip()))
+        self.batcher = None
+        if settings.BATCH_MODE:
+            self.batcher = TransactionBatcher(self.commit_batch, settings.BATCH_MAX_SIZE, settings.BATCH_MAX_DELAY)
 
     def request_mutex(self):
-        """Request access to the critical section (mutex)."""
-        print(f"{self.name} is requesting the mutex")
-        self.lamport_clock.increment()
-        self.mutex_held = False
-        # add my request to the queue that I HOLD
-        self.request_queue.add_request(self.lamport_clock.get_time(), self.name)
-        request_message = {
-            "type": "mutex_request",
-            "lamport_time": self.lamport_clock.get_time(),
-            "sender": self.name,
-        }
-        self.network.broadcast_message(request_message)
-        self.ack_event.wait()
-        self.mutex_held = True
-        print(f"{self.name} has acquired the mutex")
+        """Request access to the critical section (mutex). Blocks until it is granted."""
+        log.debug("%s is requesting the mutex", self.name)
+        with metrics.time("mutex_acquire_seconds"):
+            self.mutex.request()
+        log.debug("%s has acquired the mutex", self.name)
 
     def release_mutex(self):
         """Release access to the critical section and notify peers."""
-        self.mutex_held = False
-        print(f"{self.name} is releasing the mutex")
-        self.lamport_clock.increment()
-
-        # Remove own request from the queue
-        self.request_queue.get_next_request()
-
-        release_message = {"type": "mutex_release", "lamport_time": self.lamport_clock.get_time(), "sender": self.name}
-        self.network.broadcast_message(release_message)
+        log.debug("%s is releasing the mutex", self.name)
+        self.mutex.release()
 
     def handle_transaction(self, operation, first_request=False):
-        """Handles a transaction request."""
-        print(f"client name: {self.name} received operation: {operation}") 
+        """Handles a transaction request.
+        In batching mode, local transfers (first_request) are queued for the next batch instead, and
+        the returned Future tells when the transfer is committed."""
+        if first_request and self.batcher:
+            return self.batcher.submit(operation)
+        log.debug("client name: %s received operation: %s", self.name, operation)
         try:
             # Request mutex before accessing the critical section
             # print(f"{self.name} is requesting the mutex to handle transaction {operation}")
             sender, receiver, amount = operation
 
             # self.request_mutex()
-            print(f"{self.name} has acquired the mutex to handle transaction {operation}")
             # Critical section: Validate and execute the transaction
-            self.balance_table.update_balance(sender, receiver, amount)
-            self.blockchain.add_block(operation)
-            print(f"Transaction SUCCESS: {sender} sent ${amount} to {receiver}")
+            with self.commit_lock:
+                self.balance_table.apply_atomic([operation])
+                try:
+                    self.blockchain.add_block(operation)
+                except Exception:
+                    # The block never made it to the chain, so neither may the transfer
+                    self.balance_table.rollback([operation])
+                    raise
+                self.take_snapshot()
+                height = len(self.blockchain.chain)
+            if first_request:
+                # Durable (per settings.STORE_DURABILITY) before anyone else hears of it; outside the
+                # commit lock, so concurrent commits share the fsync
+                self.blockchain.wait_durable(height)
+            metrics.inc("transactions_committed")
+            log.debug("Transaction SUCCESS: %s sent $%d to %s", sender, amount, receiver)
 
-            self.lamport_clock.increment()
+            lamport_time = self.lamport_clock.increment()
+            if first_request:
+                self.sync.record(self.name, lamport_time, height)
 
             # Broadcast the transaction to peers
-            message = {"type": "transaction", "operation": operation, "lamport_time": self.lamport_clock.get_time(), "sender": self.name}
+            message = {"type": "transaction", "operation": operation, "lamport_time": lamport_time, "sender": self.name}
             # Release the mutex after the transaction is complete
             # self.release_mutex()
             if first_request:
-                self.network.broadcast_message(message)
+                self.broadcast(message)
         except ValueError as e:
-            print(f"Transaction FAILED: {e}")
+            metrics.inc("transactions_rejected")
+            log.info("Transaction FAILED: %s", e)
+
+    def commit_batch(self, operations, broadcast=True):
+        """Validates a batch of transfers together, seals the accepted ones into a single block
+        and broadcasts them to the peers as one message. Returns (accepted, rejected)."""
+        with self.commit_lock:
+            accepted, rejected = self.balance_table.apply_batch(operations)
+            if accepted:
+                self.blockchain.add_batch(accepted)
+                self.take_snapshot()
+            height = len(self.blockchain.chain)
+        if accepted and broadcast:
+            self.blockchain.wait_durable(height)  # Futures of the batch resolve once it is durable
+        metrics.inc("transactions_committed", len(accepted))
+        metrics.inc("transactions_rejected", len(rejected))
+        for operation, reason in rejected:
+            log.info("Transaction FAILED: %s: %s", operation, reason)
+        if accepted and broadcast:
+            lamport_time = self.lamport_clock.increment()
+            self.sync.record(self.name, lamport_time, height)
+            message = {"type": "transaction_batch", "operations": accepted, "lamport_time": lamport_time, "sender": self.name}
+            self.broadcast(message)
+        log.debug("Batch SUCCESS: %d transfers sealed into one block", len(accepted))
+        return accepted, rejected
+
+    def broadcast(self, message):
+        """Send a local transaction to every client: directly to each peer, or through the gossip overlay."""
+        if self.gossip:
+            self.gossip.publish(message)
+        else:
+            self.network.broadcast_message(message)
 
     def start(self):
-        # self.connect_to_peers()
-        threading.Thread(target=self.network.start_server, args=(self.handle_msg,)).start()
+        self.start_metrics()
+        # Balances are only kept in memory, rebuild them from the blocks persisted before a restart.
+        # Before the server starts: a transfer received earlier would be checked against balances not
+        # rebuilt yet, and counted twice (in the table the replay starts from, and in its block)
+        self.init_peer_balances()
+        self.replay_chain()
+        threading.Thread(target=self.network.start_server, args=(self.handle_msg,), daemon=True).start()
         # Connect to peers
         self.connect_to_peers()
+        # Tell the peers how long our chain is; whoever is behind fetches the missing blocks
+        self.network.broadcast_message(self.sync.tip())
+        if self.gossip:
+            self.gossip.start(settings.GOSSIP_ANTI_ENTROPY_INTERVAL)
 
-    def connect_to_peers(self):
-        """Connect to all peer clients."""
+    def start_metrics(self):
+        """Turn on the telemetry.metrics registry if settings.METRICS_ENABLED, serve it over HTTP on
+        port + METRICS_PORT_OFFSET and/or log it every METRICS_DUMP_INTERVAL seconds."""
+        if not settings.METRICS_ENABLED:
+            return
+        metrics.enable()
+        metrics.gauge("chain_height", lambda: len(self.blockchain.chain), self.name)
+        metrics.gauge("held_messages", lambda: len(self.sync.held), self.name)
+        if self.batcher:
+            metrics.gauge("batch_queue_depth", lambda: len(self.batcher.pending), self.name)
+        if settings.METRICS_PORT_OFFSET is not None:
+            metrics.serve(self.host, self.port + settings.METRICS_PORT_OFFSET)
+        if settings.METRICS_DUMP_INTERVAL:
+            metrics.start_dump(settings.METRICS_DUMP_INTERVAL)
+
+    def replay_chain(self):
+        """Rebuild the balance table from the blockchain, starting at the newest valid snapshot."""
+        if not self.blockchain.chain:
+            return
+        with self.commit_lock:
+            start = recover_balances(self.blockchain, self.balance_table, self.snapshots)
+        log.info("%s replayed %d persisted blocks (snapshot at height %d)", self.name, len(self.blockchain.chain) - start, start)
+
+    def take_snapshot(self):
+        # Called under commit_lock after every commit, SnapshotStore decides whether it is time
+        if self.snapshots:
+            self.snapshots.maybe_save(len(self.blockchain.chain), self.blockchain.get_last_block().digest,
+                                      self.balance_table.get_whole_table())
+
+    def apply_synced_blocks(self, records, snapshot=None):
+        """Append a verified range of blocks fetched by ChainSync and apply its operations.
+        With a (height, table) snapshot, the operations up to height are skipped and the balances are
+        taken from the snapshot once the chain reaches it."""
+        # Hash the chunk before taking the commit lock, on the process pool if there is one
+        bad_height = self.network.dispatcher.offload(verify_range, len(self.blockchain.chain), records)
+        if bad_height is not None:
+            raise ValueError(f"block {bad_height} failed verification")
+        with self.commit_lock:
+            start = len(self.blockchain.chain)
+            blocks = self.blockchain.extend_records(records, verified=True)
+            if snapshot and snapshot[0] > start + len(blocks):
+                return  # Balances come from the snapshot once a later chunk reaches it
+            if snapshot:
+                height, table = snapshot
+                self.balance_table.replace(table)
+                blocks = blocks[height - start:]
+            operations = [operation for block in blocks for operation in block.operations]
+            if operations:
+                self.balance_table.apply_batch(operations)
+            self.take_snapshot()
+
+    def apply_unsynced_blocks(self, start):
+        """Apply the operations of blocks [start, height), appended by a sync that ended before the
+        snapshot they were skipped for could be installed."""
+        with self.commit_lock:
+            table, rejected = replay(self.balance_table.get_whole_table(), self.blockchain.payloads(start))
+            self.balance_table.replace(table)
+            self.take_snapshot()
+        log.info("%s applied %d blocks left by an unfinished sync", self.name, len(self.blockchain.chain) - start)
+
+    def replay_held(self, messages):
+        """Process the live transactions that arrived while a sync was running."""
+        for msg in messages:
+            self.apply_transaction_message(msg)
+
+    def init_peer_balances(self):
+        """Every peer starts out with INITIAL_BALANCE, before the first block."""
         for peer in self.peers:
-            addr = (peer["ip"], peer["port"])
-            # Prevent self-connection
-            if addr == (self.host, self.port):  # Prevent self-connection
-                print(f"{self.name} skipping connection to self.")
-                continue
-            # Prevent redundant connections
-            if addr in self.network.connections:
-                print(f"{self.name} already connected to {peer['name']}")
-                continue
-            try:
-                print(f"{self.name} connecting to {peer['name']} at {peer['ip']}:{peer['port']}")
-                self.network.add_connection(peer['name'], peer["ip"], peer["port"])
-                self.balance_table.update_init_balance(peer['name'], 10)
-                self.real_connection_count += 1
-            except Exception as e:
-                print(f"{self.name} failed to connect to {peer['name']}: {e}")
+            if peer["name"] != self.name:
+                self.initial_balances[peer["name"]] = settings.INITIAL_BALANCE
+                self.balance_table.update_init_balance(peer["name"], settings.INITIAL_BALANCE)
+
+    def connect_to_peers(self):
+        """Open the links to all peer clients (see client.peers): this client dials the peers with a higher
+        process id and keeps redialing them, the others dial us. Waits up to PEER_CONNECT_TIMEOUT seconds
+        for every link; missing ones keep being retried in the background. In gossip mode only the overlay
+        neighbors are linked."""
+        peers = [peer for peer in self.peers if peer["name"] != self.name]  # Prevent self-connection
+        if self.gossip:
+            peers = [peer for peer in peers if peer["name"] in self.gossip.peers]
+        self.network.connect_peers(peers)
+        missing = self.network.wait_for_peers([peer["name"] for peer in peers], settings.PEER_CONNECT_TIMEOUT)
+        if missing:
+            log.warning("%s not connected to %s yet, still retrying", self.name, ", ".join(missing))
+
+    def get_history(self, account, start=0, end=None):
+        """Every transfer involving account in blocks [start, end), as (height, (sender, receiver, amount))."""
+        return self.blockchain.get_transfers(account, start, end)
+
+    def get_balance_at(self, account, height):
+        """Balance of account once the first height blocks are applied (height 0: the initial balance)."""
+        return self.initial_balances.get(account, 0) + self.blockchain.get_balance_change(account, height)
+
+    def request_history(self, peer, account, start=0, end=None):
+        """Ask a peer for get_history(account, start, end). Returns a Future of the list of transfers."""
+        return self.send_query(peer, {"type": "history_request", "account": account, "start": start, "end": end})
+
+    def request_balance_at(self, peer, account, height):
+        """Ask a peer for get_balance_at(account, height). Returns a Future of the balance."""
+        return self.send_query(peer, {"type": "balance_at_request", "account": account, "height": height})
+
+    def send_query(self, peer, message):
+        # The Future fails at once without a link to peer, and after QUERY_TIMEOUT if no answer comes
+        future = Future()
+        if peer not in self.network.connections:
+            future.set_exception(ConnectionError(f"not connected to {peer}"))
+            return future
+        query_id = next(self.query_ids)
+        self.pending_queries[query_id] = future
+        timer = threading.Timer(settings.QUERY_TIMEOUT, self.expire_query, (query_id, peer))
+        timer.daemon = True
+        timer.start()
+        future.add_done_callback(lambda _: timer.cancel())
+        message.update({"query_id": query_id, "sender": self.name})
+        self.network.send_message(peer, message)
+        return future
+
+    def expire_query(self, query_id, peer):
+        future = self.pending_queries.pop(query_id, None)
+        if future is not None:
+            future.set_exception(TimeoutError(f"no answer from {peer} within {settings.QUERY_TIMEOUT}s"))
+
+    def answer_query(self, msg):
+        """history_request / balance_at_request from a peer."""
+        if msg["type"] == "history_request":
+            history = self.get_history(msg["account"], msg["start"], msg["end"])
+            response = {"type": "history_response", "result": [[height, *operation] for height, operation in history]}
+        else:
+            response = {"type": "balance_at_response", "result": self.get_balance_at(msg["account"], msg["height"])}
+        response.update({"query_id": msg["query_id"], "sender": self.name})
+        self.network.send_message(msg["sender"], response)
 
     def print_balances(self):
         print(self.balance_table.get_balance(self.name))
@@ -137,66 +333,54 @@ class Client:
     def print_whole_table(self):
         print(self.balance_table.get_whole_table())
 
+    def apply_transaction_message(self, msg):
+        """Commit a transaction or transaction_batch broadcast by a peer."""
+        if msg["type"] == "transaction":
+            sender, receiver, amount = msg["operation"]
+            received_clock, sender_id = msg["lamport_time"]
+            self.lamport_clock.sync(received_clock, sender_id)
+            self.handle_transaction(msg["operation"])
+            # else:
+            #     self.balance_table.update_balance(sender, receiver, amount)
+            #     print(f"{self.name} received ${amount} from {sender}")
+        else:
+            log.debug("%s received a batch of %d transactions", self.name, len(msg["operations"]))
+            received_clock, sender_id = msg["lamport_time"]
+            self.lamport_clock.sync(received_clock, sender_id)
+            self.commit_batch([tuple(operation) for operation in msg["operations"]], broadcast=False)
+        # Height read after the commit, so at worst later than its block (see ChainSync)
+        self.sync.record(msg["sender"], msg["lamport_time"], len(self.blockchain.chain))
+
     def handle_msg(self, conn, addr, msg):
         """Handles incoming messages from the network. If balance request, sends balance response.
         If transaction, processes the transaction by calling handle_transaction."""
-        print("print in handle_msg: ", threading.current_thread().name, conn,  flush=True) 
+        log.debug("handle_msg on %s: %s", threading.current_thread().name, msg)
         if msg:
-            if msg["type"] == "transaction":
-                print(f"{self.name} received transaction message")
-                sender, receiver, amount = msg["operation"]
-                received_clock, sender_id = msg["lamport_time"]
-                self.lamport_clock.sync(received_clock, sender_id)
-                self.handle_transaction(msg["operation"])
-                # else:
-                #     self.balance_table.update_balance(sender, receiver, amount)
-                #     print(f"{self.name} received ${amount} from {sender}")
-            elif msg["type"] == "mutex_request":
-                # Add request to the queue and send ACK
-                print(f"{self.name} received mutex request")
-                # Acquire the mutex_request_handler to ensure we handle one request at a time
-                sender = msg["sender"]
-                print(f"{self.name}: The mutex is currently held: {self.mutex_held}")
-                if not self.mutex_held:
-                    # Add request to the queue
-                    self.request_queue.add_request(self.lamport_clock.get_time(), sender)
-                    received_clock, sender_id = msg["lamport_time"]
-                    self.lamport_clock.sync(received_clock, sender_id)
-                    time.sleep(1)
-                    
-                    # Only send an ACK if it's the first request in the queue
-                    first_request = self.request_queue.peek_next_request()
-                    print(f"This is {self.name} and this is the first request in the queue: {first_request}, and this is the whole queue: {self.request_queue.queue}")
-                    if first_request and first_request[1] == sender:
-                        print(f"{self.name} sending ACK to {sender}")
-                        self.request_queue.get_next_request()
-                        self.lamport_clock
-                        ack_message = {"type": "mutex_ack", "lamport_time": self.lamport_clock.get_time(), "sender": self.name}
-                        self.network.send_message(sender, ack_message)
-                        print("ACK sent by ", self.name)
-                        time.sleep(5)
-                        # self.mutex_release_event.wait()
-                    else:
-                        print(f"{self.name} skipping ACK for {sender}, request is not first in the queue.")
+            if msg["type"] in ("transaction", "transaction_batch"):
+                if self.gossip and "seq" in msg and not self.gossip.receive(msg):
+                    log.debug("%s dropped duplicate %s %s/%d", self.name, msg["type"], msg["sender"], msg["seq"])
+                elif self.sync.hold(msg):
+                    # Catching up: applied once the missing blocks are in, so the chain stays in order
+                    log.debug("%s holding %s from %s until the sync is done", self.name, msg["type"], msg["sender"])
                 else:
-                    print(f"{self.name} is holding the mutex. Skipping ACK for {msg['sender']}.")
-
-            elif msg["type"] == "mutex_ack":
-                # Decrement pending ACK count
-                self.acks_count += 1
-                print(f"{self.name} received ACK from {msg['sender']}. ACKs count: {self.acks_count} out of {self.real_connection_count}")
-                if self.acks_count == self.real_connection_count:
-                    # If all ACKs received, release the mutex
-                    self.ack_event.set()
-
-            elif msg["type"] == "mutex_release":
-                # Remove the releasing client's request from the queue
-                print(f"{self.name} received mutex release")
-                self.mutex_held = False
-                released_request = self.request_queue.get_next_request()
-                self.mutex_release_event.set()
-                print(f"Request {released_request} has been processed")
+                    self.apply_transaction_message(msg)
+            elif msg["type"] in SYNC_TYPES:
+                self.sync.on_message(msg)
+            elif msg["type"] in GOSSIP_TYPES and self.gossip:
+                self.gossip.on_message(msg)
+            elif msg["type"] in self.mutex.MESSAGE_TYPES:
+                # Mutual exclusion traffic, handled without blocking this receive thread
+                self.mutex.on_message(msg)
 
+            elif msg["type"] in ("history_request", "balance_at_request"):
+                self.answer_query(msg)
+            elif msg["type"] in ("history_response", "balance_at_response"):
+                future = self.pending_queries.pop(msg["query_id"], None)
+                if future is not None:
+                    result = msg["result"]
+                    if msg["type"] == "history_response":
+                        result = [(height, (sender, receiver, amount)) for height, sender, receiver, amount in result]
+                    future.set_result(result)
             elif msg["type"] == "balance_request":
                 sender = msg["sender"]
                 balance = self.balance_table.get_balance(self.name)
@@ -0,0 +1,212 @@
+import json
+import logging
+import struct
+import time
+from telemetry import metrics
+
+try:
+    import msgpack  # Optional: compact fallback payloads for message types without a struct layout
+except ImportError:
+    msgpack = None
+
+# Binary framing, version 1. Every frame starts with MAGIC, which can never start a JSON line
+# (those start with "{" or whitespace), so both formats can share one connection:
+#   magic/version (u8) | message type (u8) | payload length (u32) | payload
+MAGIC = 0xB1
+FRAME_HEADER = struct.Struct(">BBI")
+BINARY_CODEC = "binary/1"
+
+TYPE_JSON = 0  # Generic fallback, payload is UTF-8 JSON
+TYPE_MSGPACK = 1  # Generic fallback, payload is msgpack (only sent when msgpack is installed)
+TYPE_MUTEX_REQUEST = 2
+TYPE_MUTEX_ACK = 3
+TYPE_MUTEX_RELEASE = 4
+TYPE_TRANSACTION = 5
+TYPE_GOSSIP_TRANSACTION = 6  # transaction + the origin's sequence number (u64), see client.gossip
+
+LAMPORT = struct.Struct(">QI")  # clock, process id
+AMOUNT = struct.Struct(">q")
+SEQ = struct.Struct(">Q")
+MUTEX_TYPES = {"mutex_request": TYPE_MUTEX_REQUEST, "mutex_ack": TYPE_MUTEX_ACK, "mutex_release": TYPE_MUTEX_RELEASE}
+MUTEX_NAMES = {code: name for name, code in MUTEX_TYPES.items()}
+MUTEX_KEYS = {"type", "lamport_time", "sender"}
+TRANSACTION_KEYS = {"type", "operation", "lamport_time", "sender"}
+GOSSIP_TRANSACTION_KEYS = TRANSACTION_KEYS | {"seq"}
+
+log = logging.getLogger(__name__)
+
+
+def encode_json(message):
+    """The original newline-delimited JSON wire format."""
+    if metrics.enabled:
+        start = time.perf_counter()
+        data = json.dumps(message).encode("utf-8") + b"\n"
+        metrics.observe("encode_seconds", time.perf_counter() - start, "json")
+        return data
+    return json.dumps(message).encode("utf-8") + b"\n"
+
+
+def pack_str(value):
+    data = value.encode("utf-8")
+    if len(data) > 255:
+        raise ValueError("string too long for a struct-packed field")
+    return bytes((len(data),)) + data
+
+
+def unpack_str(view, pos):
+    length = view[pos]
+    return str(view[pos + 1:pos + 1 + length], "utf-8"), pos + 1 + length
+
+
+def pack_lamport(lamport_time):
+    clock, process_id = lamport_time
+    return LAMPORT.pack(clock, process_id)
+
+
+def encode_payload(message):
+    """Pick the struct layout for the hot message types, the generic codec for everything else."""
+    msg_type = message.get("type")
+    keys = message.keys()
+    try:
+        if msg_type in MUTEX_TYPES and keys == MUTEX_KEYS:
+            return MUTEX_TYPES[msg_type], pack_lamport(message["lamport_time"]) + pack_str(message["sender"])
+        if msg_type == "transaction" and (keys == TRANSACTION_KEYS or keys == GOSSIP_TRANSACTION_KEYS):
+            sender, receiver, amount = message["operation"]
+            if isinstance(amount, int):
+                payload = (pack_lamport(message["lamport_time"]) + pack_str(message["sender"])
+                           + pack_str(sender) + pack_str(receiver) + AMOUNT.pack(amount))
+                if "seq" in message:
+                    return TYPE_GOSSIP_TRANSACTION, payload + SEQ.pack(message["seq"])
+                return TYPE_TRANSACTION, payload
+    except (ValueError, TypeError, struct.error):
+        pass  # Does not fit the fixed layout, use the generic codec
+    if msgpack is not None:
+        return TYPE_MSGPACK, msgpack.packb(message, use_bin_type=True)
+    return TYPE_JSON, json.dumps(message).encode("utf-8")
+
+
+def encode_binary(message):
+    start = time.perf_counter() if metrics.enabled else None
+    msg_type, payload = encode_payload(message)
+    data = FRAME_HEADER.pack(MAGIC, msg_type, len(payload)) + payload
+    if start is not None:
+        metrics.observe("encode_seconds", time.perf_counter() - start, "binary")
+    return data
+
+
+def decode_payload(msg_type, view):
+    """Decode a frame payload straight from the receive buffer (view is a memoryview)."""
+    if msg_type in MUTEX_NAMES or msg_type == TYPE_TRANSACTION or msg_type == TYPE_GOSSIP_TRANSACTION:
+        clock, process_id = LAMPORT.unpack_from(view, 0)
+        sender, pos = unpack_str(view, LAMPORT.size)
+        message = {"type": MUTEX_NAMES.get(msg_type, "transaction"), "lamport_time": [clock, process_id], "sender": sender}
+        if msg_type != TYPE_TRANSACTION and msg_type != TYPE_GOSSIP_TRANSACTION:
+            return message
+        op_sender, pos = unpack_str(view, pos)
+        op_receiver, pos = unpack_str(view, pos)
+        (amount,) = AMOUNT.unpack_from(view, pos)
+        message["operation"] = [op_sender, op_receiver, amount]
+        if msg_type == TYPE_GOSSIP_TRANSACTION:
+            (message["seq"],) = SEQ.unpack_from(view, pos + AMOUNT.size)
+        return message
+    if msg_type == TYPE_MSGPACK:
+        if msgpack is None:
+            raise ValueError("received a msgpack frame but msgpack is not installed")
+        return msgpack.unpackb(view, raw=False)
+    if msg_type == TYPE_JSON:
+        return json.loads(bytes(view))
+    raise ValueError(f"unknown frame type {msg_type}")
+
+
+class FrameBuffer:
+    """Reusable receive buffer for one connection that understands both wire formats.
+    Bytes are received straight into a preallocated bytearray (recv_into) and frames are decoded
+    through a memoryview of it, so there is no bytes concatenation or re-splitting per message.
+    The buffer is only compacted (or grown) when it runs out of room at the end."""
+    def __init__(self, size=65536):
+        self.data = bytearray(size)
+        self.view = memoryview(self.data)
+        self.start = 0  # First unparsed byte
+        self.end = 0  # One past the last received byte
+
+    def reserve(self, extra):
+        """Make sure at least extra bytes are free after the received data, moving the unparsed
+        tail to the front, or growing the buffer when a single message does not fit."""
+        if len(self.data) - self.end >= extra:
+            return
+        pending = self.end - self.start
+        if self.start and len(self.data) - pending >= extra:
+            self.view[:pending] = self.view[self.start:self.end]
+        else:
+            data = bytearray(max(len(self.data) * 2, pending + extra))
+            data[:pending] = self.view[self.start:self.end]
+            self.data, self.view = data, memoryview(data)
+        self.start, self.end = 0, pending
+
+    def fill_from(self, conn):
+        """Receive whatever the socket has into the buffer. Returns the byte count, 0 once closed."""
+        self.reserve(4096)
+        received = conn.recv_into(self.view[self.end:])
+        self.end += received
+        return received
+
+    def feed(self, chunk):
+        """Append bytes read elsewhere (e.g. by an asyncio StreamReader)."""
+        self.reserve(len(chunk))
+        self.view[self.end:self.end + len(chunk)] = chunk
+        self.end += len(chunk)
+
+    def next_message(self):
+        """Decode the next complete message in the buffer, or return None if more bytes are needed."""
+        start = time.perf_counter() if metrics.enabled else None
+        while self.start < self.end:
+            if self.data[self.start] == MAGIC:
+                if self.end - self.start < FRAME_HEADER.size:
+                    return None
+                _, msg_type, length = FRAME_HEADER.unpack_from(self.data, self.start)
+                frame_end = self.start + FRAME_HEADER.size + length
+                if frame_end > self.end:
+                    return None
+                try:
+                    message = decode_payload(msg_type, self.view[self.start + FRAME_HEADER.size:frame_end])
+                except (ValueError, struct.error) as e:
+                    log.warning("Dropping undecodable frame: %s", e)
+                    message = None
+                self.consume(frame_end)
+            else:
+                newline = self.data.find(b"\n", self.start, self.end)
+                if newline < 0:
+                    return None
+                line = bytes(self.view[self.start:newline]).strip()
+                self.consume(newline + 1)
+                if not line:
+                    continue
+                try:
+                    message = json.loads(line)
+                except json.JSONDecodeError:
+                    log.warning("Dropping malformed message: %r", line[:80])
+                    message = None
+            if message is not None:
+                if start is not None:
+                    metrics.observe("decode_seconds", time.perf_counter() - start)
+                    metrics.inc("messages_received", 1, message.get("type"))
+                return message
+        return None
+
+    def consume(self, position):
+        self.start = position
+        if self.start == self.end:
+            self.start = self.end = 0
+
+
+def hello_message(codec):
+    """Sent as plain JSON right after connecting. Peers that only speak JSON pass it to their handler,
+    which ignores the unknown type, and never answer, so the dialer stays on JSON."""
+    codecs = [BINARY_CODEC] if codec == "binary" else []
+    return {"type": "codec_hello", "codecs": codecs}
+
+
+def hello_reply(message, codec):
+    """codec_ack for a received codec_hello: binary only if both sides offer it."""
+    chosen = BINARY_CODEC if codec == "binary" and BINARY_CODEC in message.get("codecs", []) else "json"
+    return {"type": "codec_ack", "codec": chosen}
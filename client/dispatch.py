@@ -0,0 +1,127 @@
+import collections
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from telemetry import metrics
+
+log = logging.getLogger(__name__)
+
+
+class Lane:
+    """Messages of one link waiting for the handler, in arrival order."""
+    __slots__ = ("queue", "handling", "closed", "waiters")
+
+    def __init__(self):
+        self.queue = collections.deque()  # (handler, args) jobs
+        self.handling = False  # Whether a worker is draining this lane right now
+        self.closed = False  # The link is gone, drop the lane once it is drained
+        self.waiters = []  # Callbacks to run once the lane has room again (see Dispatcher.when_room)
+
+
+class Dispatcher:
+    """Stage between the network receive loops and Client.handle_msg.
+    * The receive stage only decodes and calls submit(link, handler, *args); a pool of `workers` threads
+      runs the handlers. Each link has its own FIFO lane and at most one worker drains it at a time, so
+      messages from one sender are handled in order while different senders proceed in parallel, and a
+      slow handler never stops the reader of its link from taking data off the socket.
+    * A lane holds at most queue_limit messages. Past that, messages whose type is in shed_types
+      (requests a peer can simply repeat) are dropped and counted (dispatch_shed); any other message
+      waits for room, which pushes back on that one link through TCP flow control. The asyncio backend
+      cannot block its loop, so it pauses reading until a when_room(link, callback) callback fires and
+      then submits with block=False.
+    * offload(function, *args) runs CPU-heavy work (e.g. verify_range over a synced chunk) on a pool
+      of process_workers processes, or inline when process_workers is 0. Called from a handler, it
+      keeps the GIL free for the other lanes while the hashing runs."""
+    def __init__(self, workers=8, queue_limit=1024, shed_types=(), process_workers=0, name=None):
+        self.queue_limit = queue_limit
+        self.shed_types = frozenset(shed_types)
+        self.process_workers = process_workers
+        self.name = name
+        self.lanes = {}  # link -> Lane
+        self.lock = threading.Condition()  # Guards the lanes, notified whenever a message leaves one
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"dispatch-{name}")
+        self.process_pool = None  # Started on the first offload
+        metrics.gauge("dispatch_queue_depth", lambda: sum(len(lane.queue) for lane in list(self.lanes.values())), name)
+
+    def submit(self, link, handler, conn, addr, msg, block=True):
+        """Queue handler(conn, addr, msg) on link's lane. Returns False if the message was shed."""
+        with self.lock:
+            lane = self.lanes.get(link)
+            if lane is None:
+                lane = self.lanes[link] = Lane()
+            if len(lane.queue) >= self.queue_limit:
+                if msg.get("type") in self.shed_types:
+                    metrics.inc("dispatch_shed", 1, msg.get("type"))
+                    log.debug("Dispatch queue full, shedding %s from %s", msg.get("type"), addr)
+                    return False
+                if block:
+                    self.lock.wait_for(lambda: len(lane.queue) < self.queue_limit)
+            lane.queue.append((handler, (conn, addr, msg)))
+            start_job = not lane.handling
+            lane.handling = True
+        if start_job:
+            self.executor.submit(self.drain, link, lane)
+        return True
+
+    def when_room(self, link, callback):
+        """Arrange for callback() once link's lane has room, and return True; return False instead if
+        it has room already. The callback runs on a worker thread, without the lock held."""
+        with self.lock:
+            lane = self.lanes.get(link)
+            if lane is None or len(lane.queue) < self.queue_limit:
+                return False
+            lane.waiters.append(callback)
+            return True
+
+    def drain(self, link, lane):
+        # Runs on the worker pool: hands the lane's messages to their handler in order
+        while True:
+            with self.lock:
+                if not lane.queue:
+                    lane.handling = False
+                    if lane.closed:
+                        self.lanes.pop(link, None)
+                    return
+                handler, args = lane.queue.popleft()
+                self.lock.notify_all()
+                waiters, lane.waiters = lane.waiters, []
+            for waiter in waiters:
+                try:
+                    waiter()
+                except Exception as e:
+                    log.exception("Room callback failed for %s: %s", link, e)
+            try:
+                handler(*args)
+            except Exception as e:
+                log.exception("Handler failed on message from %s: %s", args[1], e)
+
+    def close(self, link):
+        """The link is gone: forget its lane once the messages already queued are handled."""
+        with self.lock:
+            lane = self.lanes.get(link)
+            if lane is None:
+                return
+            if lane.queue or lane.handling:
+                lane.closed = True
+            else:
+                del self.lanes[link]
+
+    def offload(self, function, *args):
+        """function(*args) on the process pool (function and args must pickle), inline without one."""
+        if not self.process_workers:
+            return function(*args)
+        if self.process_pool is None:
+            with self.lock:
+                if self.process_pool is None:
+                    from concurrent.futures import ProcessPoolExecutor  # Only loaded by clients that use it
+                    self.process_pool = ProcessPoolExecutor(max_workers=self.process_workers)
+        return self.process_pool.submit(function, *args).result()
+
+    def shutdown(self):
+        metrics.remove_gauge("dispatch_queue_depth", self.name)
+        self.executor.shutdown(wait=False)
+        if self.process_pool is not None:
+            self.process_pool.shutdown(wait=False)
+
+    def __repr__(self):
+        return f"Dispatcher(lanes={len(self.lanes)}, queue_limit={self.queue_limit}, process_workers={self.process_workers})"
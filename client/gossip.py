@@ -0,0 +1,153 @@
+import logging
+import random
+import threading
+from collections import OrderedDict
+from telemetry import metrics
+
+# Gossip messages (all carry "sender"):
+#   transaction / transaction_batch  + seq        the origin's sequence number, "sender" stays the origin
+#   gossip_digest {delivered, ahead, reply}       per origin: highest contiguous seq delivered and the seqs
+#                                                 delivered above it (anti-entropy)
+log = logging.getLogger(__name__)
+
+GOSSIP_TYPES = ("gossip_digest",)
+
+
+def overlay(names, name):
+    """Neighbors of name in the gossip overlay: the nodes at a power-of-two distance around the ring
+    of sorted names, in either direction. Symmetric (if B is a neighbor of A, A is one of B), about
+    2*log2(N) links per node, and any node reaches any other in at most log2(N) hops."""
+    ring = sorted(set(names) | {name})
+    position, size = ring.index(name), len(ring)
+    neighbors, distance = set(), 1
+    while distance < size:
+        neighbors.add(ring[(position + distance) % size])
+        neighbors.add(ring[(position - distance) % size])
+        distance *= 2
+    neighbors.discard(name)
+    return sorted(neighbors)
+
+
+class Gossip:
+    """Epidemic dissemination of transactions, instead of sending every one to every peer.
+    * publish(message) stamps a local message with the next sequence number and sends it to fanout
+      random peers; receive(message) returns whether it is new and, if so, relays it to fanout random
+      peers other than its origin (infect and die: every node relays a message once).
+    * Duplicates are detected from (origin, seq) with a per-origin watermark (every seq up to it was
+      delivered) plus the set of seqs delivered ahead of it, so memory does not grow with the number
+      of messages, only with the gaps still open.
+    * The last cache_size messages are kept in a bounded cache for anti-entropy: every interval
+      seconds a node sends its watermarks to a random peer, which pushes back the cached messages the
+      node is missing and, if it is behind itself, asks for the same in return (push-pull).
+      A gap older than the cache is handed to on_gap(peer), which falls back to the chain sync.
+    * send(peer, message) delivers one message; peers are the nodes this one has links to."""
+    def __init__(self, name, peers, send, fanout=4, cache_size=10000, on_gap=None, rng=None):
+        self.name = name
+        self.peers = [peer for peer in peers if peer != name]
+        self.send = send
+        self.fanout = fanout
+        self.cache_size = cache_size
+        self.on_gap = on_gap
+        self.rng = rng or random.Random()
+        self.lock = threading.Lock()
+        self.seq = 0
+        self.delivered = {}  # origin -> watermark
+        self.ahead = {}  # origin -> seqs delivered above the watermark
+        self.cache = OrderedDict()  # (origin, seq) -> message, oldest first
+        self.messages_sent = 0
+        self.stopped = threading.Event()
+
+    def publish(self, message):
+        with self.lock:
+            self.seq += 1
+            message["seq"] = self.seq
+            self.deliver(message)
+        self.relay(message)
+
+    def receive(self, message):
+        """Handle a gossiped message. Returns True the first time it is seen, False for duplicates."""
+        with self.lock:
+            origin, seq = message["sender"], message["seq"]
+            if seq <= self.delivered.get(origin, 0) or seq in self.ahead.get(origin, ()):
+                metrics.inc("gossip_duplicates")
+                return False
+            self.deliver(message)
+        self.relay(message)
+        return True
+
+    def deliver(self, message):
+        # Called with the lock held
+        origin, seq = message["sender"], message["seq"]
+        watermark = self.delivered.get(origin, 0)
+        if seq == watermark + 1:
+            ahead = self.ahead.get(origin)
+            watermark = seq
+            while ahead and watermark + 1 in ahead:
+                watermark += 1
+                ahead.remove(watermark)
+            self.delivered[origin] = watermark
+        else:
+            self.ahead.setdefault(origin, set()).add(seq)
+        self.cache[(origin, seq)] = message
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def relay(self, message):
+        candidates = [peer for peer in self.peers if peer != message["sender"]]
+        for peer in self.rng.sample(candidates, min(self.fanout, len(candidates))):
+            self.messages_sent += 1
+            self.send(peer, message)
+
+    # Anti-entropy
+    def digest(self, reply=False):
+        with self.lock:
+            ahead = {origin: sorted(seqs) for origin, seqs in self.ahead.items() if seqs}
+            return {"type": "gossip_digest", "delivered": dict(self.delivered), "ahead": ahead, "reply": reply,
+                    "sender": self.name}
+
+    def anti_entropy(self):
+        """One round: send our watermarks and out-of-order seqs to a random peer."""
+        if self.peers:
+            peer = self.rng.choice(self.peers)
+            self.messages_sent += 1
+            self.send(peer, self.digest())
+
+    def on_message(self, msg):
+        theirs, peer = msg["delivered"], msg["sender"]
+        ahead = {origin: set(seqs) for origin, seqs in msg["ahead"].items()}
+        with self.lock:
+            missing = [message for (origin, seq), message in self.cache.items()
+                       if seq > theirs.get(origin, 0) and seq not in ahead.get(origin, ())]
+            oldest = {}
+            for origin, seq in self.cache:
+                oldest.setdefault(origin, seq)
+            gap = any(theirs.get(origin, 0) < watermark and oldest.get(origin, watermark + 1) > theirs.get(origin, 0) + 1
+                      for origin, watermark in self.delivered.items())
+            behind = any(seq > self.delivered.get(origin, 0) for origin, seq in theirs.items()) or any(
+                seqs - self.ahead.get(origin, set()) for origin, seqs in ahead.items())
+        for message in missing:
+            self.messages_sent += 1
+            self.send(peer, message)
+        if missing:
+            metrics.inc("gossip_repaired", len(missing))
+            log.debug("%s: pushed %d missed messages to %s", self.name, len(missing), peer)
+        if gap and self.on_gap:
+            self.on_gap(peer)
+        if behind and not msg["reply"]:
+            self.messages_sent += 1
+            self.send(peer, self.digest(reply=True))
+
+    def start(self, interval):
+        def loop():
+            while not self.stopped.wait(interval):
+                try:
+                    self.anti_entropy()
+                except Exception as e:  # A send racing a shutdown, try again next round
+                    log.debug("%s: anti-entropy round failed: %s", self.name, e)
+        threading.Thread(target=loop, daemon=True, name=f"gossip-{self.name}").start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def __repr__(self):
+        return f"Gossip(name={self.name}, peers={len(self.peers)}, fanout={self.fanout}, cached={len(self.cache)})"
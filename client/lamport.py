@@ -1,3 +1,6 @@
+import threading
+
+
 class LamportClock:
     """Class to implement Lamport clock logic to handle distributed event ordering.
     Also synchronizes clocks between clients during communication.
@@ -7,13 +10,21 @@ class LamportClock:
         we should use the Totally-Ordered Lamport Clock, i.e.
         ⟨Lamportclock, Processid⟩, to break ties, and each client should maintain
         its request queue/blockchain"
+
+    The clock is shared by the network handler threads, the mutex and the transaction path, so every
+    operation is atomic. increment() and sync() return the timestamp they produced: stamp a message
+    with that value rather than calling get_time() afterwards, when another thread may have ticked.
         """
     def __init__(self, client_id):
         self.clock = 0
         self.process_id = client_id
+        self.lock = threading.Lock()
 
     def increment(self):
-        self.clock += 1
+        """Local event: tick and return the new (clock, process_id)."""
+        with self.lock:
+            self.clock += 1
+            return (self.clock, self.process_id)
 
     def sync(self, received_clock, sender_id):
         """
@@ -21,17 +32,19 @@ class LamportClock:
         Args:
             received_clock (int): The logical clock received from another process.
             sender_id (int): The process ID of the sender.
+        Returns the new (clock, process_id).
         """
         # Update the clock with the maximum value, and increment by 1.
-        if (received_clock, sender_id) > (self.clock, self.process_id):
-            self.clock = received_clock
-        self.clock += 1
+        with self.lock:
+            self.clock = max(self.clock, received_clock) + 1
+            return (self.clock, self.process_id)
 
     def get_time(self):
-        return (self.clock, self.process_id)
+        with self.lock:
+            return (self.clock, self.process_id)
+
     def __repr__(self):
         """
         Represent the LamportClock object for debugging purposes.
         """
         return f"LamportClock(clock={self.clock}, process_id={self.process_id})"
-    
@@ -0,0 +1,309 @@
+import math
+import threading
+import time
+from client.request_queue import RequestQueue
+from telemetry import metrics
+
+
+class MutexStrategy:
+    """Interface of a distributed mutual exclusion algorithm used by Client.
+    * send(peer_name, message) delivers one message to a peer, it must not block for long.
+    * begin_request() starts asking for the critical section and returns right away; acquired is set
+      once it is granted. request() is the blocking version used by Client.request_mutex.
+    * on_message(msg) handles one of MESSAGE_TYPES. It never sleeps or waits, so it is safe to run on
+      the network's receive thread."""
+    MESSAGE_TYPES = ("mutex_request", "mutex_ack", "mutex_release")
+
+    def __init__(self, name, peers, clock, send):
+        self.name = name
+        self.peers = sorted(peer for peer in peers if peer != name)
+        self.clock = clock
+        self.send = send
+        self.lock = threading.RLock()
+        self.acquired = threading.Event()
+        self.messages_sent = 0
+        self.requested_at = None  # perf_counter() of the last request, for the ack round trip metric
+
+    def message(self, msg_type, lamport_time=None):
+        # Stamped with lamport_time, the value the clock returned for this event, when there is one
+        return {"type": msg_type, "lamport_time": lamport_time or self.clock.get_time(), "sender": self.name}
+
+    def deliver(self, peer, msg):
+        self.messages_sent += 1
+        self.send(peer, msg)
+
+    def record_request(self):
+        if metrics.enabled:
+            self.requested_at = time.perf_counter()
+
+    def record_ack(self):
+        # Time from our request to this ack, one observation per acking peer
+        if metrics.enabled and self.requested_at is not None:
+            metrics.observe("mutex_ack_rtt_seconds", time.perf_counter() - self.requested_at)
+
+    def request(self):
+        self.begin_request()
+        self.acquired.wait()
+
+    def begin_request(self):
+        raise NotImplementedError
+
+    def release(self):
+        raise NotImplementedError
+
+    def on_message(self, msg):
+        raise NotImplementedError
+
+    def __repr__(self):
+        return f"{type(self).__name__}(name={self.name}, held={self.acquired.is_set()})"
+
+
+class LamportMutex(MutexStrategy):
+    """Lamport's algorithm: request, ack and release to every peer, 3(N-1) messages per critical section.
+    Enter once the own request heads the queue and every peer has acked it."""
+    def __init__(self, name, peers, clock, send):
+        super().__init__(name, peers, clock, send)
+        self.queue = RequestQueue()
+        self.acks = set()
+        self.requesting = False
+
+    def begin_request(self):
+        with self.lock:
+            request_time = self.clock.increment()
+            self.requesting = True
+            self.acks.clear()
+            self.acquired.clear()
+            self.record_request()
+            self.queue.add_request(request_time, self.name)
+            request = self.message("mutex_request", request_time)
+            for peer in self.peers:
+                self.deliver(peer, request)
+            self.check_acquired()
+
+    def release(self):
+        with self.lock:
+            self.requesting = False
+            self.acquired.clear()
+            self.queue.remove_request(self.name)
+            release = self.message("mutex_release", self.clock.increment())
+            for peer in self.peers:
+                self.deliver(peer, release)
+
+    def on_message(self, msg):
+        with self.lock:
+            received_clock, sender_id = msg["lamport_time"]
+            self.clock.sync(received_clock, sender_id)
+            sender = msg["sender"]
+            if msg["type"] == "mutex_request":
+                self.queue.add_request(msg["lamport_time"], sender)
+                self.deliver(sender, self.message("mutex_ack"))
+            elif msg["type"] == "mutex_ack":
+                self.record_ack()
+                self.acks.add(sender)
+            elif msg["type"] == "mutex_release":
+                self.queue.remove_request(sender)
+            self.check_acquired()
+
+    def check_acquired(self):
+        head = self.queue.peek_next_request()
+        if self.requesting and head and head[1] == self.name and self.acks.issuperset(self.peers):
+            self.acquired.set()
+
+
+class RicartAgrawalaMutex(MutexStrategy):
+    """Ricart-Agrawala: 2(N-1) messages per critical section. A peer answers a request right away
+    unless it is in the critical section or has an older request of its own; then the reply is
+    deferred until it releases, which doubles as the release message."""
+    def __init__(self, name, peers, clock, send):
+        super().__init__(name, peers, clock, send)
+        self.requesting = False
+        self.request_time = None
+        self.replies = set()
+        self.deferred = []
+
+    def begin_request(self):
+        with self.lock:
+            self.request_time = self.clock.increment()
+            self.requesting = True
+            self.replies.clear()
+            self.acquired.clear()
+            self.record_request()
+            request = self.message("mutex_request", self.request_time)
+            for peer in self.peers:
+                self.deliver(peer, request)
+            self.check_acquired()
+
+    def release(self):
+        with self.lock:
+            self.requesting = False
+            self.acquired.clear()
+            release_time = self.clock.increment()
+            deferred, self.deferred = self.deferred, []
+            for peer in deferred:
+                self.deliver(peer, self.message("mutex_ack", release_time))
+
+    def on_message(self, msg):
+        with self.lock:
+            received_clock, sender_id = msg["lamport_time"]
+            self.clock.sync(received_clock, sender_id)
+            sender = msg["sender"]
+            if msg["type"] == "mutex_request":
+                # Our own request wins if it is older (Lamport time, then process id)
+                if self.requesting and self.request_time < (received_clock, sender_id):
+                    self.deferred.append(sender)
+                else:
+                    self.deliver(sender, self.message("mutex_ack"))
+            elif msg["type"] == "mutex_ack":
+                self.record_ack()
+                self.replies.add(sender)
+                self.check_acquired()
+
+    def check_acquired(self):
+        if self.requesting and self.replies.issuperset(self.peers):
+            self.acquired.set()
+
+
+class MaekawaMutex(MutexStrategy):
+    """Maekawa's quorum algorithm with the inquire/failed/relinquish extension against deadlocks.
+    Nodes sit on a ceil(sqrt(N)) x ceil(sqrt(N)) grid (wrapping around to fill it) and a node's quorum is
+    its row plus its column, so any two quorums overlap. Each node votes for one requester at a time;
+    entering needs the vote of the whole quorum, about 2*sqrt(N) nodes instead of all N."""
+    MESSAGE_TYPES = ("mutex_request", "mutex_ack", "mutex_release",
+                     "mutex_inquire", "mutex_failed", "mutex_relinquish")
+
+    def __init__(self, name, peers, clock, send):
+        super().__init__(name, peers, clock, send)
+        self.quorum = self.build_quorum(sorted(self.peers + [name]), name)
+        self.requesting = False
+        self.request_time = None
+        self.votes = set()  # Quorum members currently voting for us
+        self.failed = False  # Some member told us an older request has priority
+        self.inquiries = set()  # Members asking for their vote back
+        # Voter state
+        self.voted_for = None  # (lamport time, name) of the request we voted for
+        self.inquired = False  # Whether we already asked voted_for to give the vote back
+        self.waiting = RequestQueue()  # Requests waiting for our vote, oldest first
+
+    @staticmethod
+    def build_quorum(nodes, name):
+        side = math.ceil(math.sqrt(len(nodes)))
+        position = nodes.index(name)
+        row, column = divmod(position, side)
+        members = {nodes[(row * side + c) % len(nodes)] for c in range(side)}
+        members |= {nodes[(r * side + column) % len(nodes)] for r in range(side)}
+        return sorted(members)
+
+    def deliver(self, peer, msg):
+        # The node is usually part of its own quorum: handle those messages locally
+        if peer == self.name:
+            self.on_message(msg)
+        else:
+            super().deliver(peer, msg)
+
+    def begin_request(self):
+        with self.lock:
+            self.request_time = self.clock.increment()
+            self.requesting = True
+            self.votes.clear()
+            self.inquiries.clear()
+            self.failed = False
+            self.acquired.clear()
+            self.record_request()
+            request = {"type": "mutex_request", "lamport_time": list(self.request_time), "sender": self.name}
+            for member in self.quorum:
+                self.deliver(member, request)
+
+    def release(self):
+        with self.lock:
+            self.requesting = False
+            self.acquired.clear()
+            self.votes.clear()
+            self.inquiries.clear()
+            release = self.message("mutex_release", self.clock.increment())
+            for member in self.quorum:
+                self.deliver(member, release)
+
+    def on_message(self, msg):
+        with self.lock:
+            received_clock, sender_id = msg["lamport_time"]
+            if msg["sender"] != self.name:
+                self.clock.sync(received_clock, sender_id)
+            handler = getattr(self, "on_" + msg["type"][len("mutex_"):])
+            handler(msg["sender"], (received_clock, sender_id))
+
+    # Voter side
+    def on_request(self, sender, request_time):
+        if self.voted_for is None:
+            self.vote(request_time, sender)
+            return
+        previous_head = self.waiting.peek_next_request()
+        request = (tuple(request_time), sender)
+        self.waiting.add_request(*request)
+        if request < self.voted_for and self.waiting.peek_next_request() == request:
+            # Older than every other request we know of: try to get the vote back
+            if previous_head is not None:
+                self.deliver(previous_head[1], self.message("mutex_failed"))
+            if not self.inquired:
+                self.inquired = True
+                self.deliver(self.voted_for[1], self.message("mutex_inquire"))
+        else:
+            self.deliver(sender, self.message("mutex_failed"))
+
+    def on_relinquish(self, sender, _):
+        if self.voted_for and self.voted_for[1] == sender:
+            self.waiting.add_request(*self.voted_for)
+            self.voted_for = None
+            self.vote_next()
+
+    def on_release(self, sender, _):
+        self.waiting.remove_request(sender)
+        if self.voted_for and self.voted_for[1] == sender:
+            self.voted_for = None
+            self.vote_next()
+
+    def vote(self, request_time, sender):
+        self.voted_for = (tuple(request_time), sender)
+        self.inquired = False
+        self.deliver(sender, self.message("mutex_ack"))
+
+    def vote_next(self):
+        request = self.waiting.get_next_request()
+        if request:
+            self.vote(*request)
+
+    # Requester side
+    def on_ack(self, sender, _):
+        if not self.requesting:
+            return
+        if sender != self.name:
+            self.record_ack()
+        self.votes.add(sender)
+        self.inquiries.discard(sender)
+        if self.votes.issuperset(self.quorum):
+            self.acquired.set()
+            self.inquiries.clear()
+
+    def on_failed(self, sender, _):
+        if self.requesting and not self.acquired.is_set():
+            self.failed = True
+            self.relinquish_inquired()
+
+    def on_inquire(self, sender, _):
+        if not self.requesting or self.acquired.is_set() or sender not in self.votes:
+            return  # Already in the critical section (the release answers it) or the vote moved on
+        self.inquiries.add(sender)
+        if self.failed:
+            self.relinquish_inquired()
+
+    def relinquish_inquired(self):
+        for member in sorted(self.inquiries):
+            self.votes.discard(member)
+            self.deliver(member, self.message("mutex_relinquish"))
+        self.inquiries.clear()
+
+
+MUTEX_STRATEGIES = {
+    "lamport": LamportMutex,
+    "ricart_agrawala": RicartAgrawalaMutex,
+    "maekawa": MaekawaMutex,
+}
@@ -1,143 +1,302 @@
+import logging
 import socket
 import threading
-import json
+from client import codec as wire
+from client import peers as peer_links
+from client.dispatch import Dispatcher
+from telemetry import metrics
+
+log = logging.getLogger(__name__)
 
 class Network:
-    def __init__(self, host, port):
+    """TCP transport, one thread per connection.
+    * codec: "binary" offers the length-prefixed binary protocol (client.codec) to every peer and
+      falls back to newline-delimited JSON for peers that do not answer the handshake;
+      "json" only ever sends JSON. Both formats are always accepted on receive.
+    * Peer links (client.peers): every connection starts with a hello/hello_ack handshake that
+      registers it under the peer's real name and process id. Only the side with the lower process id
+      dials, so each pair shares one full-duplex link; connect_peers() keeps those links up, redialing
+      with exponential backoff and jitter whenever one drops.
+    * Each connection's thread only receives and decodes; messages are handed to handler_function by a
+      client.dispatch.Dispatcher (per-link order, bounded queues, a worker pool), so a slow handler
+      does not stop the link from being read."""
+    def __init__(self, host, port, codec="binary", name=None, pid=None, dispatcher=None):
         self.host = host
         self.port = port
         self.id = port % 1000
+        self.name = name or f"Client-{port}"
+        self.pid = self.id if pid is None else pid
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # Allow quick restarts on the same port
         self.socket.bind((self.host, self.port))
-        self.socket.listen(5)  # Allows up to 4 connections, one more than needed to be safe
+        self.socket.listen(16)
         self.connections = {}  # Keep track of active connections {client_name: (conn, addr)}
-        self.buffers = {} # Buffer for each client to store incoming messages
-    
+        self.conn_names = {}  # conn -> name it is registered under
+        self.send_locks = {}  # conn -> lock, so concurrent senders never interleave bytes on a link
+        self.link_closed = {}  # name -> Event set when that link goes down (wakes its supervisor)
+        self.lock = threading.Condition()  # Guards the dicts above, notified whenever a link comes or goes
+        self.buffers = {} # FrameBuffer for each client to store incoming messages
+        self.codec = codec
+        self.binary_conns = set()  # Connections whose peer accepted the binary protocol
+        self.handler_function = None
+        self.dispatcher = dispatcher or Dispatcher(name=self.name)
+        self.server_ready = threading.Event()
+        self.stopping = threading.Event()
+
     def add_connection(self, client_name, host, port):
-        """Establish a connection to a peer."""
-        addr = (host, port)
+        """Establish a connection to a peer (one attempt, see connect_peers for a supervised link)."""
         try:
-            if port > 7000:
-                print(f"Skipping connection to {host}:{port}")
-                return
-            conn = socket.create_connection((host, port))
-            self.connections[client_name] = (conn, addr) 
-            print(f"Connected to {host}:{port}")
+            _, conn = self.dial(client_name, host, port)
+            log.info("Connected to %s:%d using %s messages", host, port, "binary" if conn in self.binary_conns else "JSON")
         except Exception as e:
-            print(f"Failed to connect to {host}:{port} - {e}")
+            log.warning("Failed to connect to %s:%d - %s", host, port, e)
+
+    def dial(self, client_name, host, port):
+        """Connect, run the handshake, register the link and start reading from it.
+        Returns (name the link is registered under, conn): the peer may answer to another name than client_name."""
+        addr = (host, port)
+        conn = socket.create_connection(addr)
+        peer_links.configure_socket(conn)
+        try:
+            name = self.handshake(conn, client_name)
+        except OSError:
+            conn.close()
+            raise
+        self.register(name, conn, addr)
+        threading.Thread(target=self.handle_client, args=(conn, addr, None), daemon=True).start()
+        return name, conn
+
+    def handshake(self, conn, client_name):
+        """Send our hello and wait briefly for the hello_ack. Returns the name to register the link under:
+        the one the peer reports, or client_name for peers that never answer (JSON-only, no handshake)."""
+        conn.sendall(wire.encode_json(peer_links.hello_message(self.name, self.pid, self.codec)))
+        buffer = self.buffers.setdefault(conn, wire.FrameBuffer())
+        conn.settimeout(peer_links.HELLO_TIMEOUT)
+        try:
+            while True:
+                reply = buffer.next_message()
+                if reply is not None:
+                    break
+                if not buffer.fill_from(conn):
+                    raise ConnectionError("closed during handshake")
+        except socket.timeout:
+            log.info("No hello_ack from %s, staying on JSON", conn.getpeername())
+            return client_name
+        finally:
+            conn.settimeout(None)
+        if reply.get("type") != "hello_ack":
+            return client_name
+        if reply.get("codec") == wire.BINARY_CODEC:
+            self.binary_conns.add(conn)
+        if reply.get("name") != client_name:
+            log.warning("Dialed %s but %s answered", client_name, reply.get("name"))
+        return reply.get("name", client_name)
+
+    def register(self, client_name, conn, addr):
+        """Make conn THE link to client_name. A newer link replaces an older one (a restarted peer redials
+        before the old socket is noticed as dead), so there is never more than one link per peer."""
+        with self.lock:
+            old = self.connections.get(client_name)
+            self.connections[client_name] = (conn, addr)
+            self.conn_names[conn] = client_name
+            self.send_locks.setdefault(conn, threading.Lock())
+            self.link_closed[client_name] = threading.Event()
+            self.lock.notify_all()
+        if old and old[0] is not conn:
+            log.info("Replacing older link to %s", client_name)
+            self.close_socket(old[0])
+
+    def unregister(self, conn):
+        with self.lock:
+            client_name = self.conn_names.pop(conn, None)
+            self.send_locks.pop(conn, None)
+            if client_name and self.connections.get(client_name, (None,))[0] is conn:
+                del self.connections[client_name]
+                self.link_closed[client_name].set()
+            self.lock.notify_all()
+        self.buffers.pop(conn, None)
+        self.binary_conns.discard(conn)
+
+    def connect_peers(self, peers):
+        """Keep a link to every configured peer: dial (and keep redialing) the peers with a higher process
+        id, wait for the others to dial us."""
+        for peer in peers:
+            if peer_links.should_dial(self.pid, peer_links.peer_pid(peer)):
+                threading.Thread(target=self.supervise, args=(peer,), daemon=True).start()
+
+    def supervise(self, peer):
+        """Dial peer, wait for the link to drop, redial with exponential backoff and jitter."""
+        backoff = peer_links.Backoff()
+        self.server_ready.wait()
+        while not self.stopping.is_set():
+            try:
+                name, _ = self.dial(peer["name"], peer["ip"], peer["port"])
+            except OSError as e:
+                delay = backoff.next_delay()
+                log.info("Failed to connect to %s (%s), retrying in %.2fs", peer["name"], e, delay)
+                self.stopping.wait(delay)
+                continue
+            log.info("Connected to %s at %s:%d", peer["name"], peer["ip"], peer["port"])
+            backoff.reset()
+            with self.lock:
+                closed = self.link_closed[name]  # The name dial registered, which the peer chose
+            while not closed.wait(0.5) and not self.stopping.is_set():
+                pass
+
+    def wait_for_peers(self, names, timeout):
+        """Block until there is a link to each of names, or timeout. Returns the names still missing."""
+        with self.lock:
+            self.lock.wait_for(lambda: all(name in self.connections for name in names), timeout)
+            return [name for name in names if name not in self.connections]
+
+    def encode(self, conn, message):
+        if conn in self.binary_conns:
+            return wire.encode_binary(message)
+        return wire.encode_json(message)
+
+    def send_raw(self, conn, data):
+        lock = self.send_locks.get(conn)
+        if lock is None:
+            raise ConnectionError("link is closed")
+        with lock:
+            conn.sendall(data)
 
     def start_server(self, handler_function):
         """Start the server to handle incoming connections."""
-        print(f"Server started on {self.host}:{self.port}")
+        log.info("Server started on %s:%d", self.host, self.port)
+        self.handler_function = handler_function
+        self.server_ready.set()
         while True:
-            conn, addr = self.socket.accept()
-            print(f"New connection from {addr}")
-            # You can use the `addr` or map it to a specific client name here
-            # For simplicity, we're associating it with a unique client name or ID
-            client_name = f"Client-{addr[1]}"  # Just an example, you can use an actual mapping
-            self.connections[client_name] = (conn, addr)
-            threading.Thread(target=self.handle_client, args=(conn, addr, handler_function)).start()
+            try:
+                conn, addr = self.socket.accept()
+            except OSError:
+                # Listening socket closed by shutdown()
+                break
+            log.info("New connection from %s", addr)
+            # The link is registered under the peer's name once its hello arrives (see receive_message)
+            peer_links.configure_socket(conn)
+            threading.Thread(target=self.handle_client, args=(conn, addr, handler_function), daemon=True).start()
 
     def send_message(self, client_name, message):
         """Send a message to a specific client identified by client_name."""
         if client_name not in self.connections:
-            print("current live connections: ", self.connections)
-            print(f"No active connection to {client_name}")
+            log.warning("No active connection to %s (live connections: %s)", client_name, list(self.connections))
             return
         conn, addr = self.connections[client_name]
         try:
-            conn.sendall(json.dumps(message).encode("utf-8") + b"\n")
-            print(f"Message {message} sent to {client_name} at {addr}")
+            data = self.encode(conn, message)
+            self.send_raw(conn, data)
+            metrics.inc("bytes_sent", len(data), client_name)
+            log.debug("Message %s sent to %s at %s", message, client_name, addr)
         except Exception as e:
-            print(f"Failed to send message to {client_name} - {e}")
+            log.warning("Failed to send message to %s - %s", client_name, e)
             self.close_connection(client_name)
 
     def handle_client(self, conn, addr, handler_function):
-        """Handles communication with a specific client."""
+        """Handles communication with a specific client, in either direction of the link."""
+        if handler_function is None:
+            self.server_ready.wait()
+            handler_function = self.handler_function
         while True:
             msg = self.receive_message(conn)
             if not msg:
-                print(f"Connection from {addr} closed")
+                log.info("Connection from %s closed", addr)
                 break
-            handler_function(conn, addr, msg)
+            if conn not in self.conn_names:
+                # A peer without the hello handshake, register it like before
+                self.register(f"Client-{addr[1]}", conn, addr)
+            self.dispatcher.submit(conn, handler_function, conn, addr, msg)
+        self.dispatcher.close(conn)
+        self.unregister(conn)
         conn.close()
 
     def broadcast_message(self, message):
         """Sends a message to all active connections."""
-        print(f"Broadcasting message from {message['sender']}")
-        for client_name, (conn, addr) in self.connections.items():
+        log.debug("Broadcasting message from %s", message["sender"])
+        encoded = {}  # Encode once per wire format, not once per peer
+        with self.lock:
+            links = list(self.connections.items())
+        for client_name, (conn, addr) in links:
+            binary = conn in self.binary_conns
+            if binary not in encoded:
+                encoded[binary] = self.encode(conn, message)
             try:
-                conn.sendall(json.dumps(message).encode("utf-8") + b"\n")
-                print(f"Message broadcast to {client_name} at {addr}")
-            except BrokenPipeError:
-                print(f"Connection to {client_name} is broken, removing...")
-                self.connections.pop(client_name)
-                conn.close()
+                self.send_raw(conn, encoded[binary])
+                metrics.inc("bytes_sent", len(encoded[binary]), client_name)
+                log.debug("Message broadcast to %s at %s", client_name, addr)
+            except OSError:
+                log.warning("Connection to %s is broken, removing...", client_name)
+                self.close_connection(client_name)
 
     def receive_message(self, conn):
         """
-        Block until exactly one JSON message can be parsed from the connection,
+        Block until exactly one message (JSON line or binary frame) can be parsed from the connection,
         or until the connection is closed (in which case return None).
         """
-        # print("print in rec_msg: ", threading.current_thread().name, conn,  flush=True) 
-        if conn not in self.buffers:
-            self.buffers[conn] = b""
-
+        buffer = self.buffers.setdefault(conn, wire.FrameBuffer())
         while True:
-            # First, see if there's already a complete JSON object in self.buffers[conn].
-            msg, leftover = self.try_parse_one_message(self.buffers[conn])
+            # First, see if there's already a complete message in the buffer.
+            msg = buffer.next_message()
             if msg is not None:
-                # Found one complete JSON object in the buffer
-                self.buffers[conn] = leftover  # store any leftover bytes
+                if msg.get("type") in peer_links.HANDSHAKE_TYPES:
+                    self.answer_handshake(conn, msg)
+                    continue
                 return msg
 
-            # No complete JSON message yet, so read more data from socket
-            chunk = conn.recv(1024)
-            if not chunk:
+            # No complete message yet, so read more data from socket straight into the buffer
+            try:
+                received = buffer.fill_from(conn)
+            except OSError:
+                # Reset by the peer or closed locally, same as a clean close
+                received = 0
+            if not received:
                 # Connection closed, no more data
                 return None
 
-            # Accumulate the newly-read data
-            self.buffers[conn] += chunk
-
-    def try_parse_one_message(self, buffer: bytes):
-        """
-        Attempt to parse EXACTLY one JSON message from the front of `buffer`.
-        Return (messageDict, leftoverBytes) if successful, or (None, buffer) if not enough data.
-
-        A simple approach: use newline-delimited JSON, or do a "look for one balanced JSON object".
-        """
-        # -- Option A: If using newline-delimited JSON:
-        if b"\n" not in buffer:
-            return None, buffer  # no complete JSON line yet
-
-        line, leftover = buffer.split(b"\n", 1)  # split on the first newline only
-        line = line.strip()
-        if not line:
-            # If the line is empty, skip and keep going
-            return None, leftover
+    def answer_handshake(self, conn, msg):
+        """Handshake messages are answered here, the handler never sees them."""
+        if msg["type"] == "hello":
+            reply = peer_links.hello_reply(msg, self.name, self.pid, self.codec)
+        elif msg["type"] == "codec_hello":
+            # Codec-only handshake of older peers
+            reply = wire.hello_reply(msg, self.codec)
+        else:
+            return  # A late hello_ack / codec_ack, nothing to do
+        if reply["codec"] == wire.BINARY_CODEC:
+            self.binary_conns.add(conn)
+        self.send_locks.setdefault(conn, threading.Lock())
+        self.send_raw(conn, wire.encode_json(reply))
+        if msg["type"] == "hello":
+            self.register(msg["name"], conn, conn.getpeername())
 
-        # Attempt JSON parse
+    def close_socket(self, conn):
         try:
-            msg_dict = json.loads(line.decode("utf-8"))
-            return msg_dict, leftover
-        except json.JSONDecodeError:
-            # Not a valid JSON string yet (or malformed).
-            # Possibly you want to handle errors or keep reading.
-            return None, buffer
-        
+            conn.shutdown(socket.SHUT_RDWR)  # wakes up the reader thread, which unregisters the link
+        except OSError:
+            pass
+        conn.close()
+
     def close_connection(self, client_name):
         """Closes a specific connection to a client."""
         if client_name in self.connections:
             conn, addr = self.connections[client_name]
-            conn.close()
-            del self.connections[client_name]
-            print(f"Connection to {client_name} at {addr} closed")
+            self.unregister(conn)
+            self.close_socket(conn)
+            log.info("Connection to %s at %s closed", client_name, addr)
     def shutdown(self):
         """Closes all active connections and shuts down the server."""
-        print(f"Shutting down {self.id} network...")
-        for addr, conn in self.connections.items():
-            conn.close() 
+        log.info("Shutting down %d network...", self.id)
+        self.stopping.set()
+        with self.lock:
+            links = list(self.connections.values())
+        for conn, addr in links:
+            self.close_socket(conn)
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)  # wakes up the accept() in start_server
+        except OSError:
+            pass
         self.socket.close()  # close the listening socket
-        self.connections.clear()  # clear the connection dictionary
-        print(f"{self.id} network shut down")
+        with self.lock:
+            self.connections.clear()  # clear the connection dictionary
+        self.dispatcher.shutdown()
+        log.info("%d network shut down", self.id)
@@ -0,0 +1,65 @@
+import random
+import socket
+from client import codec as wire
+
+# Handshake sent by the dialing side right after connecting, answered with a hello_ack. It ties the socket
+# to the peer's name and Lamport process id and negotiates the wire codec (see client.codec). Peers from
+# before the handshake pass the unknown type to their handler and never answer, so the dialer falls
+# back to JSON and to the name it dialed.
+HELLO_TIMEOUT = 0.5  # Seconds to wait for a hello_ack
+HANDSHAKE_TYPES = ("hello", "hello_ack", "codec_hello", "codec_ack")
+
+
+def peer_pid(config):
+    """Lamport process id of a peer from its clients.json entry (port % 1000, as in Client)."""
+    return config["port"] % 1000
+
+
+def should_dial(my_pid, peer_pid):
+    """Exactly one side of every pair dials: the one with the lower process id. The other side only
+    accepts, so each pair ends up with a single full-duplex link instead of two half-used ones."""
+    return my_pid < peer_pid
+
+
+def hello_message(name, pid, codec):
+    hello = wire.hello_message(codec)
+    hello.update({"type": "hello", "name": name, "pid": pid})
+    return hello
+
+
+def hello_reply(message, name, pid, codec):
+    reply = wire.hello_reply(message, codec)
+    reply.update({"type": "hello_ack", "name": name, "pid": pid})
+    return reply
+
+
+def configure_socket(sock, keepalive_idle=10, keepalive_interval=5, keepalive_count=3):
+    """No Nagle delay for small protocol messages, and TCP keepalive so a dead peer is noticed
+    (and the link reconnected) within keepalive_idle + keepalive_interval * keepalive_count seconds."""
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    # Fine-grained keepalive knobs are Linux specific
+    for option, value in (("TCP_KEEPIDLE", keepalive_idle), ("TCP_KEEPINTVL", keepalive_interval),
+                          ("TCP_KEEPCNT", keepalive_count)):
+        if hasattr(socket, option):
+            sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+
+
+class Backoff:
+    """Exponential reconnect delay with jitter: base * 2^attempt capped at cap, then scaled by a random
+    factor in [1 - jitter, 1 + jitter] so restarted nodes do not all redial in lockstep."""
+    def __init__(self, base=0.1, cap=10.0, jitter=0.5, rng=None):
+        self.base = base
+        self.cap = cap
+        self.jitter = jitter
+        self.rng = rng or random.Random()
+        self.attempt = 0
+
+    def next_delay(self):
+        delay = min(self.cap, self.base * (2 ** self.attempt))
+        if delay < self.cap:
+            self.attempt += 1  # Stops once capped: 2 ** attempt would overflow a float after ~1024 failures
+        return delay * self.rng.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def reset(self):
+        self.attempt = 0
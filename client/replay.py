@@ -0,0 +1,176 @@
+from array import array
+from blockchain_module.block import BATCH_HEADER, BATCH_MARKER
+
+numpy = None  # Optional: vectorized replay, imported on first use (see load_numpy)
+
+CHUNK = 1 << 13  # Operations replayed in one vectorized pass
+MAX_BACKOFF = 64  # Most windows handed to the loop after one with an overdraft
+SAFE_TOTAL = 2 ** 62  # Bound on balances + moved amounts in a chunk, so int64 sums cannot overflow
+
+
+def load_numpy():
+    """numpy, or None if it is not installed; then the columns are replayed in a plain loop instead.
+    Imported on the first replay rather than with the module, numpy alone takes longer to import
+    than the whole client (see benchmarks.bench_startup)."""
+    global numpy
+    if numpy is None:
+        try:
+            import numpy
+        except ImportError:
+            numpy = False
+    return numpy or None
+
+
+class Columns:
+    """Operations of a chain range in columnar form: account ids of the senders and receivers and the
+    amounts, as int64 arrays, with names[id] the account name of each id."""
+    __slots__ = ("names", "senders", "receivers", "amounts")
+
+    def __init__(self, names, senders, receivers, amounts):
+        self.names = names
+        self.senders = senders
+        self.receivers = receivers
+        self.amounts = amounts
+
+    def __len__(self):
+        return len(self.amounts)
+
+    def __repr__(self):
+        return f"Columns(operations={len(self)}, accounts={len(self.names)})"
+
+
+def load_columns(payloads, names=()):
+    """Parse block payloads (single operations or batches, see blockchain_module.block) straight into
+    Columns. Account names are only decoded once each; names get the first ids, in order."""
+    ids = {name.encode("utf-8"): index for index, name in enumerate(names)}
+    senders, receivers, amounts = array("q"), array("q"), array("q")
+    # Hot loop (once per operation of the chain): lengths read byte by byte rather than with struct,
+    # bound methods hoisted
+    add_sender, add_receiver, add_amount, get_id = senders.append, receivers.append, amounts.append, ids.get
+    from_bytes = int.from_bytes
+    for payload in payloads:
+        payload = bytes(payload)
+        pos, size = BATCH_HEADER.size if payload[:2] == BATCH_MARKER else 0, len(payload)
+        while pos < size:  # A batch's operations fill the rest of its payload
+            end = pos + 2 + (payload[pos] << 8 | payload[pos + 1])
+            sender = payload[pos + 2:end]
+            pos = end + 2 + (payload[end] << 8 | payload[end + 1])
+            receiver = payload[end + 2:pos]
+            index = get_id(sender)
+            if index is None:
+                index = ids[sender] = len(ids)
+            add_sender(index)
+            index = get_id(receiver)
+            if index is None:
+                index = ids[receiver] = len(ids)
+            add_receiver(index)
+            add_amount(from_bytes(payload[pos:pos + 8], "big", signed=True))
+            pos += 8
+    return Columns([name.decode("utf-8") for name in ids], senders, receivers, amounts)
+
+
+def replay(table, payloads):
+    """Balances once the operations in payloads are applied to table ({account: balance}), with the
+    semantics of BalanceTable.apply_batch: in order, each checked against the balances left by the
+    ones before it, overdrawing ones skipped. Returns (new table, number of operations skipped)."""
+    columns = load_columns(payloads, list(table))
+    balances = [table.get(name, 0) for name in columns.names]
+    touched = bytearray(len(columns.names))  # Accounts in the result: the table's and those of accepted operations
+    touched[:len(table)] = b"\x01" * len(table)
+    if len(columns) and load_numpy():
+        rejected = replay_vectorized(balances, touched, columns)
+    else:
+        rejected = replay_loop(balances, touched, columns.senders, columns.receivers, columns.amounts)
+    return {name: balances[index] for index, name in enumerate(columns.names) if touched[index]}, rejected
+
+
+def replay_loop(balances, touched, senders, receivers, amounts):
+    """Apply the operations one at a time to balances (a list indexed by account id). Returns the number skipped."""
+    rejected = 0
+    for sender, receiver, amount in zip(senders, receivers, amounts):
+        if balances[sender] < amount:
+            rejected += 1
+            continue
+        balances[sender] -= amount
+        balances[receiver] += amount
+        touched[sender] = touched[receiver] = 1
+    return rejected
+
+
+def replay_vectorized(balances, touched, columns):
+    """replay_loop with NumPy, a window of CHUNK operations at a time.
+    Every operation becomes a debit and a credit event; sorted by account (stably, so in chain order
+    with the debit first), a prefix sum per account gives the balance after every event. If no debit
+    leaves a negative balance, the last of those sums per account is its new balance. Otherwise the
+    operations before the first overdraft are applied and the loop takes over from it, for the rest of
+    the window and as many more as windows in a row have had overdrafts (up to MAX_BACKOFF), so a
+    chain where they are common costs little more than the loop."""
+    senders = numpy.frombuffer(columns.senders, dtype=numpy.int64)
+    receivers = numpy.frombuffer(columns.receivers, dtype=numpy.int64)
+    amounts = numpy.frombuffer(columns.amounts, dtype=numpy.int64)
+    if any(abs(balance) >= SAFE_TOTAL for balance in balances):
+        return replay_loop(balances, touched, columns.senders, columns.receivers, columns.amounts)
+    state = numpy.array(balances, dtype=numpy.int64)
+    marks = numpy.zeros(len(balances), dtype=bool)
+    rejected, start, backoff = 0, 0, 0
+    while start < len(amounts):
+        end = min(start + CHUNK, len(amounts))
+        chunk = slice(start, end)
+        if int(numpy.abs(amounts[chunk]).max()) * 2 * (end - start) + int(numpy.abs(state).max()) >= SAFE_TOTAL:
+            overdraft = 0  # Huge amounts: one operation at a time, in Python ints
+        else:
+            overdraft, last, final = first_overdraft(state, senders[chunk], receivers[chunk], amounts[chunk])
+            if overdraft is None:
+                # Every account's balance after its last event in the window is its new balance
+                state[last] = final
+                marks[last] = True
+                start, backoff = end, 0
+                continue
+            applied = slice(start, start + overdraft)
+            numpy.add.at(state, senders[applied], -amounts[applied])
+            numpy.add.at(state, receivers[applied], amounts[applied])
+            marks[senders[applied]] = marks[receivers[applied]] = True
+        backoff = min(2 * backoff or 1, MAX_BACKOFF)
+        rest = slice(start + overdraft, min(start + backoff * CHUNK, len(amounts)))
+        values = state.tolist()
+        rejected += replay_loop(values, touched, columns.senders[rest], columns.receivers[rest], columns.amounts[rest])
+        state[:] = values
+        start = rest.stop
+    for index in numpy.flatnonzero(marks).tolist():
+        touched[index] = 1
+    balances[:] = state.tolist()
+    return rejected
+
+
+def first_overdraft(state, senders, receivers, amounts):
+    """(index of the first operation that overdraws when applied in order to state, or None; the
+    accounts the operations touch; their balances after all of them)."""
+    count = len(amounts)
+    accounts = numpy.empty(2 * count, dtype=numpy.int64)
+    accounts[0::2], accounts[1::2] = senders, receivers
+    deltas = numpy.empty(2 * count, dtype=numpy.int64)
+    deltas[0::2], deltas[1::2] = -amounts, amounts
+    order = sort_ids(accounts, len(state))
+    accounts, deltas = accounts[order], deltas[order]
+    running = numpy.cumsum(deltas)
+    # Start of each account's run of events, and the running sum just before it
+    starts = numpy.flatnonzero(numpy.concatenate(([True], accounts[1:] != accounts[:-1])))
+    before = numpy.concatenate(([0], running[starts[1:] - 1]))
+    lengths = numpy.diff(numpy.concatenate((starts, [len(accounts)])))
+    after = running + numpy.repeat(state[accounts[starts]] - before, lengths)
+    ends = starts + lengths - 1
+    overdrawn = (after < 0) & (order % 2 == 0)  # Only a debit can overdraw
+    if not overdrawn.any():
+        return None, accounts[ends], after[ends]
+    return int((order[overdrawn] // 2).min()), accounts[ends], after[ends]
+
+
+def sort_ids(ids, count):
+    """Stable argsort of account ids below count: NumPy radix sorts 16-bit keys, so ids are sorted as
+    one or two 16-bit digits (least significant first) rather than comparison sorted as int64."""
+    if count > 1 << 32:
+        return numpy.argsort(ids, kind="stable")
+    order = numpy.argsort(ids.astype(numpy.uint16), kind="stable")
+    if count > 1 << 16:
+        order = order[numpy.argsort((ids[order] >> 16).astype(numpy.uint16), kind="stable")]
+    return order
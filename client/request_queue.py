@@ -1,19 +1,82 @@
 import heapq
+import threading
+
 
 class RequestQueue:
-    """Priority queue implementation for mutual exclusion requests, 
-    will ensure correct ordering of requests based on Lamport timestamps."""
+    """Priority queue implementation for mutual exclusion requests,
+    will ensure correct ordering of requests based on Lamport timestamps.
+    * Requests are totally ordered by ((clock, process id), client_id): the process id breaks clock ties.
+    * Indexed by sender, each client has at most one request queued; a new one replaces the old.
+    * remove_request(client_id) is O(log n) amortized by lazy deletion: the heap entry stays behind and
+      is dropped once it reaches the head. The heap is rebuilt when stale entries outnumber live ones.
+    * Thread-safe, every method takes the queue's lock."""
     def __init__(self):
-        self.queue = []  # Min-heap for requests: (lamport_time, client_id)
+        self.queue = []  # Min-heap of [lamport_time, client_id, live] entries, some of them stale
+        self.entries = {}  # client_id -> its live heap entry
+        self.lock = threading.Lock()
 
     def add_request(self, lamport_time, client_id):
-        heapq.heappush(self.queue, (lamport_time[0], client_id))
+        entry = [tuple(lamport_time), client_id, True]
+        with self.lock:
+            previous = self.entries.get(client_id)
+            if previous is not None:
+                previous[2] = False
+            self.entries[client_id] = entry
+            heapq.heappush(self.queue, entry)
+            self.compact()
 
     def get_next_request(self):
-        return heapq.heappop(self.queue) if self.queue else None
+        """Pop the oldest request as (lamport_time, client_id), or None."""
+        with self.lock:
+            self.drop_stale()
+            if not self.queue:
+                return None
+            lamport_time, client_id, _ = heapq.heappop(self.queue)
+            del self.entries[client_id]
+            return lamport_time, client_id
+
+    def remove_request(self, client_id):
+        """Remove the request of client_id wherever it sits in the queue (returns it, or None)."""
+        with self.lock:
+            entry = self.entries.pop(client_id, None)
+            if entry is None:
+                return None
+            entry[2] = False
+            self.drop_stale()
+            self.compact()
+            return entry[0], client_id
+
     def peek_next_request(self):
-        return self.queue[0] if self.queue else None
+        with self.lock:
+            self.drop_stale()
+            return (self.queue[0][0], self.queue[0][1]) if self.queue else None
+
+    def get_request(self, client_id):
+        # Lamport time of client_id's queued request, or None
+        with self.lock:
+            entry = self.entries.get(client_id)
+            return entry[0] if entry else None
+
+    def drop_stale(self):
+        # Called with the lock held: pop removed entries off the head
+        while self.queue and not self.queue[0][2]:
+            heapq.heappop(self.queue)
+
+    def compact(self):
+        # Called with the lock held: bound the memory held by removed entries buried in the heap
+        if len(self.queue) > 2 * len(self.entries) + 32:
+            self.queue = [entry for entry in self.queue if entry[2]]
+            heapq.heapify(self.queue)
+
     def is_empty(self):
-        return len(self.queue) == 0
+        return not self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, client_id):
+        return client_id in self.entries
+
     def __repr__(self):
-        return f"RequestQueue(queue={self.queue})"
+        with self.lock:
+            return f"RequestQueue(queue={sorted((entry[0], entry[1]) for entry in self.entries.values())})"
@@ -0,0 +1,256 @@
+import hashlib
+import heapq
+import json
+import logging
+import random
+import threading
+from client import codec as wire
+from client.dispatch import Dispatcher
+from telemetry import metrics
+
+log = logging.getLogger(__name__)
+
+
+def decode(data):
+    """One whole frame or JSON line, as produced by codec.encode_binary / encode_json."""
+    if data[0] == wire.MAGIC:
+        _, msg_type, _ = wire.FRAME_HEADER.unpack_from(data)
+        return wire.decode_payload(msg_type, memoryview(data)[wire.FRAME_HEADER.size:])
+    return json.loads(data)
+
+
+class SimWorld:
+    """In-memory network of SimNetwork transports on a virtual clock, for running many Clients in one
+    process without sockets, threads or real time.
+    * Pass world.transport as Client(..., transport=world.transport). Every message is still encoded
+      with the client's wire codec and decoded on delivery, so handlers see exactly what TCP delivers.
+    * A message on link sender -> receiver is delivered latency (uniform in [low, high] seconds) after
+      it has been transmitted; with bandwidth (bytes per second) each direction of a link transmits one
+      message at a time, so a burst queues up behind itself. Links are FIFO, except that a message is
+      reordered with probability reorder (extra latency, may overtake or be overtaken) and lost with
+      probability drop.
+    * Nothing happens until run(): it delivers the messages and fires the call_at / every callbacks in
+      virtual time order, calling handlers synchronously on the caller's thread. Randomness comes from
+      one Random(seed) and ties are broken by scheduling order, so a run is reproducible: the same
+      seed and scenario give the same deliveries at the same virtual times (trace_digest).
+    * With skip_empty_tips, the sync_tip a client with an empty chain broadcasts at start is not sent.
+      It only makes peers that already have blocks answer with their tip, so in a cluster where every
+      node starts empty it is N*(N-1) deliveries that change nothing.
+    * Only the transport is virtual. Components with their own threads or timers (batcher, gossip
+      anti-entropy loop, sync timeouts) keep running on real time; a scenario drives them with
+      every() instead."""
+    def __init__(self, seed=0, latency=(0.0005, 0.002), bandwidth=None, drop=0.0, reorder=0.0, skip_empty_tips=False):
+        self.rng = random.Random(seed)
+        self.skip_empty_tips = skip_empty_tips
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.drop = drop
+        self.reorder = reorder
+        self.now = 0.0  # Virtual seconds
+        self.events = []  # Min-heap of (time, seq, callback, args)
+        self.seq = 0
+        self.lock = threading.Lock()  # Guards the heap and the link state, clients may send from any thread
+        self.networks = {}  # name -> SimNetwork
+        self.links = {}  # (sender, receiver) -> [transmit free at, last delivery time] of that direction
+        self.stats = dict.fromkeys(("sent", "delivered", "dropped", "reordered", "bytes"), 0)
+        self.trace = hashlib.blake2b(digest_size=16)  # Over every delivery: time, sender, receiver, bytes
+
+    def transport(self, host, port, codec="binary", name=None, pid=None, dispatcher=None):
+        """Transport factory with the Network constructor's signature, for Client(transport=...)."""
+        return SimNetwork(self, host, port, codec, name, pid, dispatcher)
+
+    # Virtual clock
+    def call_at(self, at, callback, *args):
+        with self.lock:
+            self.seq += 1
+            heapq.heappush(self.events, (max(at, self.now), self.seq, callback, args))
+
+    def call_later(self, delay, callback, *args):
+        self.call_at(self.now + delay, callback, *args)
+
+    def every(self, interval, callback, start=None):
+        """Call callback() every interval virtual seconds (first at start, default now + interval).
+        Periodic callbacks never run out, so run() needs an until with them."""
+        def tick():
+            callback()
+            self.call_later(interval, tick)
+        self.call_at(self.now + interval if start is None else start, tick)
+
+    def run(self, until=None, check=None):
+        """Process events in virtual time order until there are none left, the next one is later than
+        until, or check() (called after every event) returns True. Returns the number of events run.
+        Waits (briefly) for every transport's start_server first, Client.start runs it on a thread."""
+        for network in list(self.networks.values()):
+            network.server_ready.wait(1.0)
+        count = 0
+        while True:
+            with self.lock:
+                if not self.events or (until is not None and self.events[0][0] > until):
+                    break
+                self.now, _, callback, args = heapq.heappop(self.events)
+            callback(*args)
+            count += 1
+            if check is not None and check():
+                break
+        if until is not None and (not self.events or self.events[0][0] > until):
+            self.now = max(self.now, until)
+        return count
+
+    # Links
+    def register(self, network):
+        self.networks[network.name] = network
+        for other in self.networks.values():
+            if network.name in other.wanted:
+                self.connect(other.name, network.name)
+
+    def connect(self, name, peer):
+        """Open the link name <-> peer (both must exist), like a finished hello handshake."""
+        with self.lock:
+            for sender, receiver in ((name, peer), (peer, name)):
+                self.links.setdefault((sender, receiver), [self.now, self.now])
+                self.networks[sender].connections[receiver] = self.networks[receiver].address
+        log.debug("Linked %s and %s", name, peer)
+
+    def disconnect(self, name, peer):
+        """Close the link name <-> peer; messages in flight on it are lost."""
+        with self.lock:
+            for sender, receiver in ((name, peer), (peer, name)):
+                self.links.pop((sender, receiver), None)
+                if sender in self.networks:
+                    self.networks[sender].connections.pop(receiver, None)
+
+    def transmit(self, sender, receiver, data):
+        with self.lock:
+            link = self.links.get((sender, receiver))
+            if link is None:
+                raise ConnectionError(f"no link from {sender} to {receiver}")
+            self.stats["sent"] += 1
+            self.stats["bytes"] += len(data)
+            start = max(self.now, link[0])
+            if self.bandwidth:
+                link[0] = start + len(data) / self.bandwidth
+            at = link[0] if self.bandwidth else start
+            at += self.rng.uniform(*self.latency)
+            if self.drop and self.rng.random() < self.drop:
+                self.stats["dropped"] += 1
+                return
+            if self.reorder and self.rng.random() < self.reorder:
+                self.stats["reordered"] += 1
+                at += self.rng.uniform(*self.latency)
+            else:
+                at = link[1] = max(at, link[1])  # FIFO behind everything sent before on this link
+            self.seq += 1
+            heapq.heappush(self.events, (at, self.seq, self.deliver, (sender, receiver, data)))
+
+    def deliver(self, sender, receiver, data):
+        network = self.networks.get(receiver)
+        if network is None or (sender, receiver) not in self.links:
+            self.stats["dropped"] += 1  # The link went down while the message was in flight
+            return
+        self.stats["delivered"] += 1
+        self.trace.update(b"%r %s %s " % (self.now, sender.encode(), receiver.encode()) + data)
+        network.receive(sender, data)
+
+    def trace_digest(self):
+        return self.trace.hexdigest()
+
+    def __repr__(self):
+        return f"SimWorld(now={self.now:.6f}, networks={len(self.networks)}, pending={len(self.events)}, stats={self.stats})"
+
+
+class SimNetwork:
+    """Transport of one client inside a SimWorld, with the interface Client uses from Network:
+    start_server(handler), connect_peers(peers), wait_for_peers(names, timeout), send_message(name, msg),
+    broadcast_message(msg), close_connection(name), shutdown() and the dispatcher.
+    * Links come up at once, with no handshake: both sides exist in the world as soon as their clients
+      are constructed, and connect_peers links to peers created later as soon as they register.
+    * Received messages go straight to the handler on the world's thread, not through the dispatcher
+      (its worker threads would make the order of a run depend on the scheduler); the dispatcher is
+      only kept for offload()."""
+    def __init__(self, world, host, port, codec="binary", name=None, pid=None, dispatcher=None):
+        self.world = world
+        self.host = host
+        self.port = port
+        self.address = (host, port)
+        self.id = port % 1000
+        self.name = name or f"Client-{port}"
+        self.pid = self.id if pid is None else pid
+        self.codec = codec
+        self.connections = {}  # Linked peer name -> its address
+        self.wanted = set()  # Peers connect_peers asked for, linked once they exist
+        self.handler_function = None
+        self.dispatcher = dispatcher or Dispatcher(name=self.name)
+        self.server_ready = threading.Event()
+        world.register(self)
+
+    def start_server(self, handler_function):
+        """Returns at once: the world calls handler_function when it delivers a message."""
+        self.handler_function = handler_function
+        self.server_ready.set()
+        log.info("Simulated server started for %s", self.name)
+
+    def connect_peers(self, peers):
+        for peer in peers:
+            self.wanted.add(peer["name"])
+            if peer["name"] in self.world.networks:
+                self.world.connect(self.name, peer["name"])
+
+    def wait_for_peers(self, names, timeout):
+        # Links never take time to come up here, so there is nothing to wait for
+        return [name for name in names if name not in self.connections]
+
+    def encode(self, peer, message):
+        peer_codec = self.world.networks[peer].codec
+        if self.codec == "binary" and peer_codec == "binary":
+            return wire.encode_binary(message)
+        return wire.encode_json(message)
+
+    def send_message(self, client_name, message):
+        if client_name not in self.connections:
+            log.warning("No active connection to %s (live connections: %s)", client_name, list(self.connections))
+            return
+        try:
+            data = self.encode(client_name, message)
+            self.world.transmit(self.name, client_name, data)
+            metrics.inc("bytes_sent", len(data), client_name)
+        except (ConnectionError, KeyError) as e:
+            log.warning("Failed to send message to %s - %s", client_name, e)
+
+    def broadcast_message(self, message):
+        if self.world.skip_empty_tips and message.get("type") == "sync_tip" and not message["height"]:
+            return
+        encoded = {}  # Encode once per wire format, not once per peer
+        for client_name in list(self.connections):
+            try:
+                binary = self.codec == "binary" and self.world.networks[client_name].codec == "binary"
+                if binary not in encoded:
+                    encoded[binary] = self.encode(client_name, message)
+                self.world.transmit(self.name, client_name, encoded[binary])
+                metrics.inc("bytes_sent", len(encoded[binary]), client_name)
+            except (ConnectionError, KeyError):
+                log.warning("Connection to %s is broken, removing...", client_name)
+                self.close_connection(client_name)
+
+    def receive(self, sender, data):
+        # Called by the world on delivery
+        msg = decode(data)
+        if metrics.enabled:
+            metrics.inc("messages_received", 1, msg.get("type"))
+        try:
+            self.handler_function(sender, self.world.networks[sender].address if sender in self.world.networks else None, msg)
+        except Exception as e:
+            log.exception("Handler failed on message from %s: %s", sender, e)
+
+    def close_connection(self, client_name):
+        self.world.disconnect(self.name, client_name)
+        log.info("Connection to %s closed", client_name)
+
+    def shutdown(self):
+        for client_name in list(self.connections):
+            self.world.disconnect(self.name, client_name)
+        self.world.networks.pop(self.name, None)
+        self.dispatcher.shutdown()
+        log.info("%s simulated network shut down", self.name)
+
+    def __repr__(self):
+        return f"SimNetwork(name={self.name}, links={len(self.connections)})"
@@ -0,0 +1,131 @@
+import logging
+import os
+import struct
+import zlib
+from blockchain_module.block import GENESIS_DIGEST
+from client.replay import replay
+
+log = logging.getLogger(__name__)
+
+# Snapshot file layout (snapshot-<height>.bin):
+#   header  -> magic (4 bytes), block height (u64), digest of block height - 1 (32 bytes), entry count (u32)
+#   entries -> name (u16 length + utf-8), balance (i64), one per client
+#   trailer -> CRC32 (u32) of everything before it
+SNAPSHOT_MAGIC = b"BTS1"
+SNAPSHOT_HEADER = struct.Struct(">4sQ32sI")
+SNAPSHOT_ENTRY = struct.Struct(">q")
+SNAPSHOT_TRAILER = struct.Struct(">I")
+
+
+def encode_snapshot(height, digest, table):
+    entries = []
+    for name, balance in sorted(table.items()):
+        name = name.encode("utf-8")
+        entries.append(struct.pack(">H", len(name)) + name + SNAPSHOT_ENTRY.pack(balance))
+    data = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, height, digest, len(entries)) + b"".join(entries)
+    return data + SNAPSHOT_TRAILER.pack(zlib.crc32(data))
+
+
+def decode_snapshot(data):
+    """Returns (height, digest, table), raises ValueError for a torn or corrupted snapshot."""
+    if len(data) < SNAPSHOT_HEADER.size + SNAPSHOT_TRAILER.size:
+        raise ValueError("snapshot too short")
+    body, (crc,) = data[:-SNAPSHOT_TRAILER.size], SNAPSHOT_TRAILER.unpack_from(data, len(data) - SNAPSHOT_TRAILER.size)
+    if zlib.crc32(body) != crc:
+        raise ValueError("snapshot checksum mismatch")
+    magic, height, digest, count = SNAPSHOT_HEADER.unpack_from(body, 0)
+    if magic != SNAPSHOT_MAGIC:
+        raise ValueError("not a balance table snapshot")
+    table = {}
+    pos = SNAPSHOT_HEADER.size
+    for _ in range(count):
+        (name_len,) = struct.unpack_from(">H", body, pos)
+        name = body[pos + 2:pos + 2 + name_len].decode("utf-8")
+        (table[name],) = SNAPSHOT_ENTRY.unpack_from(body, pos + 2 + name_len)
+        pos += 2 + name_len + SNAPSHOT_ENTRY.size
+    return height, digest, table
+
+
+class SnapshotStore:
+    """Periodic snapshots of a BalanceTable, so a restart replays only the blocks after the newest one.
+    * A snapshot is taken every interval blocks and keyed by the chain height it covers plus the digest
+      of the last block it includes; only the newest retention snapshots are kept.
+    * Files are written to a temporary name, fsynced and renamed, so a crash never leaves a half
+      written snapshot under a real name (the CRC catches anything else).
+    * A snapshot is only used if the chain still has a block with its digest at its height."""
+    def __init__(self, directory, interval=1000, retention=3):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.interval = interval
+        self.retention = retention
+        heights = self.heights()
+        self.last_height = heights[-1] if heights else 0
+
+    def path(self, height):
+        return os.path.join(self.directory, f"snapshot-{height:012d}.bin")
+
+    def heights(self):
+        heights = []
+        for file_name in os.listdir(self.directory):
+            if file_name.startswith("snapshot-") and file_name.endswith(".bin"):
+                heights.append(int(file_name[len("snapshot-"):-len(".bin")]))
+        return sorted(heights)
+
+    def maybe_save(self, height, digest, table):
+        # Called after every commit, writes a snapshot once interval blocks have been added since the last one
+        if self.interval and height - self.last_height >= self.interval:
+            self.save(height, digest, table)
+
+    def save(self, height, digest, table):
+        temporary = self.path(height) + ".tmp"
+        with open(temporary, "wb") as file:
+            file.write(encode_snapshot(height, digest, table))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, self.path(height))
+        self.last_height = height
+        for old_height in self.heights()[:-self.retention]:
+            os.remove(self.path(old_height))
+
+    def load(self, height):
+        with open(self.path(height), "rb") as file:
+            return decode_snapshot(file.read())
+
+    def latest(self, blockchain, max_height=None):
+        """Newest snapshot matching blockchain, as (height, table), or None.
+        Snapshots beyond the chain (e.g. blocks lost in a crash) or from a different chain are skipped."""
+        chain = blockchain.chain
+        for height in reversed(self.heights()):
+            if height > len(chain) or (max_height is not None and height > max_height):
+                continue
+            try:
+                snapshot_height, digest, table = self.load(height)
+            except (OSError, ValueError) as e:
+                log.warning("Skipping snapshot at height %d: %s", height, e)
+                continue
+            expected = chain[height - 1].digest if height else GENESIS_DIGEST
+            if snapshot_height == height and digest == expected:
+                return height, table
+        return None
+
+    def __repr__(self):
+        return f"SnapshotStore(directory={self.directory!r}, interval={self.interval}, retention={self.retention})"
+
+
+def recover_balances(blockchain, balance_table, snapshots=None):
+    """Rebuild balance_table from blockchain: load the newest valid snapshot (if any), then apply the
+    operations of the blocks after it. Returns the height replay started from."""
+    snapshot = snapshots.latest(blockchain) if snapshots else None
+    start = 0
+    if snapshot:
+        start, table = snapshot
+        balance_table.replace(table)
+    if snapshots:
+        snapshots.last_height = start  # Snapshots past a chain truncated by a crash get rewritten
+    if len(blockchain.chain) > start:
+        # Bulk replay over the raw payloads, same outcome as apply_batch over every operation
+        table, rejected = replay(balance_table.get_whole_table(), blockchain.payloads(start))
+        balance_table.replace(table)
+        if rejected:
+            log.warning("Skipped %d overdrawing operations replaying blocks %d and up", rejected, start)
+    return start
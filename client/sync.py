@@ -0,0 +1,244 @@
+import base64
+import logging
+import threading
+import time
+from collections import deque
+from blockchain_module.block import GENESIS_DIGEST, to_hex
+from blockchain_module.store import RECORD_HEADER
+from client.snapshot import decode_snapshot, encode_snapshot
+
+# Chain synchronization messages (all carry "sender"):
+#   sync_tip             {height, tip}           announce the local chain (tip is the hex digest of the last block)
+#   sync_headers_request {start, end}            ask for the headers of blocks [start, end)
+#   sync_headers         {start, headers, seen}  prev_digest || digest of each block, base64, plus
+#                                                optionally the newest balance snapshot inside the range;
+#                                                seen: [sender, clock, pid, height] of the live messages
+#                                                processed into the range
+#   sync_blocks_request  {start, end}            ask for the full blocks [start, end)
+#   sync_blocks          {start, records}        store records (header + payload) back to back, base64
+log = logging.getLogger(__name__)
+
+SYNC_TYPES = ("sync_tip", "sync_headers_request", "sync_headers", "sync_blocks_request", "sync_blocks")
+HEADER_SIZE = 64
+SEEN_LIMIT = 10000  # Newest processed live messages remembered for the headers' seen list
+
+
+def pack_records(records):
+    """Serialize (payload, prev_digest, digest) records in the BlockStore segment layout."""
+    return b"".join(RECORD_HEADER.pack(len(payload), prev_digest, digest) + bytes(payload)
+                    for payload, prev_digest, digest in records)
+
+
+def unpack_records(data):
+    records = []
+    view = memoryview(data)
+    pos = 0
+    while pos < len(data):
+        payload_len, prev_digest, digest = RECORD_HEADER.unpack_from(view, pos)
+        pos += RECORD_HEADER.size
+        records.append((bytes(view[pos:pos + payload_len]), prev_digest, digest))
+        pos += payload_len
+    return records
+
+
+class ChainSync:
+    """Catch-up protocol for clients that joined late or restarted.
+    * Every client announces its tip (height + digest) once its links are up; a peer that is behind
+      asks the announcer for the headers of the missing range, checks that they link to its own tip
+      and to the announced digest, then fetches the blocks in chunks of chunk_size, keeping up to
+      window requests in flight.
+    * Each chunk is verified against the headers and by Blockchain.extend_records before it is
+      appended, and its operations are applied to the balance table, so catching up costs one hash
+      per block instead of a replay of every broadcast.
+    * Only a chain that extends the local one is fetched; if the peer's chain forked from ours the
+      sync is abandoned (there is no fork choice rule to decide which one wins).
+    * With snapshots (client.snapshot.SnapshotStore), the headers come with the server's newest balance
+      snapshot inside the range. Its digest is checked against the headers, and balances are then
+      taken from it instead of applying every operation up to its height (the serving peer is trusted
+      for balances the same way it is for the transactions it broadcasts).
+    * apply(records, snapshot) is called with each verified chunk (under the caller's commit lock) and
+      the pending (height, table) snapshot, or None. If the sync ends before the chain reaches the
+      snapshot (stalled, or a later chunk fails verification), the blocks appended since it started
+      never had their operations applied: restore(start) is then called to apply those of blocks
+      [start, height). send(peer, message) delivers a message.
+    * Live transactions that arrive during a sync are held back with hold() and handed to
+      on_complete() once the chain has caught up, minus those the synced blocks already hold: every
+      client record()s the (sender, lamport_time) of the live messages it processes with its chain
+      height, the headers carry those inside the range, and a held message listed there at a height
+      now in the chain is dropped. A message is recorded at the height read after processing it,
+      which concurrent commits can make later than its block; such a message is kept (and applied a
+      second time) rather than dropped wrongly, and so are messages older than the SEEN_LIMIT newest."""
+    def __init__(self, name, blockchain, send, apply, on_complete=None, chunk_size=1000, window=8, timeout=10.0,
+                 snapshots=None, restore=None):
+        self.name = name
+        self.blockchain = blockchain
+        self.snapshots = snapshots
+        self.send = send
+        self.apply = apply
+        self.restore = restore
+        self.on_complete = on_complete
+        self.chunk_size = chunk_size
+        self.window = window
+        self.timeout = timeout  # Give up on a peer that sends nothing for this many seconds
+        self.lock = threading.RLock()
+        self.peer = None  # Peer we are syncing from, None when idle
+        self.target = 0  # Height the sync is catching up to
+        self.target_tip = None  # Digest the peer announced for block target - 1
+        self.expected = []  # Digest of each missing block, from the headers
+        self.base = 0  # Height of expected[0]
+        self.snapshot = None  # (height, table) received with the headers, until the chain reaches it
+        self.next_request = 0  # Start of the next chunk to request
+        self.held = []  # Live messages waiting for the sync to finish
+        self.seen = deque(maxlen=SEEN_LIMIT)  # (sender, clock, pid, height) of processed live messages
+        self.covered = {}  # (sender, clock, pid) -> height, live messages the sync source put in the range
+        self.started_at = None
+        self.last_progress = None
+
+    def message(self, msg_type, **fields):
+        fields.update({"type": msg_type, "sender": self.name})
+        return fields
+
+    def tip(self):
+        last_block = self.blockchain.get_last_block()
+        return self.message("sync_tip", height=len(self.blockchain.chain),
+                            tip=to_hex(last_block.digest if last_block else GENESIS_DIGEST))
+
+    def check_stalled(self):
+        if self.peer is not None and time.monotonic() - self.last_progress > self.timeout:
+            log.warning("%s: sync from %s stalled, giving up", self.name, self.peer)
+            self.finish()
+
+    def record(self, sender, lamport_time, height):
+        """A live message from sender stamped lamport_time has been processed, the chain is height long."""
+        self.seen.append((sender, *lamport_time, height))
+
+    def hold(self, msg):
+        """Keep a live message for later if a sync is running. Returns whether it was held."""
+        with self.lock:
+            self.check_stalled()
+            if self.peer is None:
+                return False
+            self.held.append(msg)
+            return True
+
+    def on_message(self, msg):
+        handler = getattr(self, "on_" + msg["type"][len("sync_"):])
+        handler(msg)
+
+    # Serving side
+    def on_tip(self, msg):
+        height = len(self.blockchain.chain)
+        with self.lock:
+            self.check_stalled()
+            if msg["height"] > height and self.peer is None:
+                log.info("%s is %d blocks behind %s, syncing", self.name, msg["height"] - height, msg["sender"])
+                self.peer = msg["sender"]
+                self.target = msg["height"]
+                self.target_tip = bytes.fromhex(msg["tip"])
+                self.started_at = time.perf_counter()
+                self.last_progress = time.monotonic()
+                self.send(self.peer, self.message("sync_headers_request", start=height, end=msg["height"]))
+                return
+        if msg["height"] < height:
+            # The announcer is the one behind, tell it about our chain
+            self.send(msg["sender"], self.tip())
+
+    def on_headers_request(self, msg):
+        end = min(msg["end"], len(self.blockchain.chain))
+        headers = b"".join(prev_digest + digest for _, prev_digest, digest in self.blockchain.records(msg["start"], end))
+        reply = self.message("sync_headers", start=msg["start"], headers=base64.b64encode(headers).decode("ascii"),
+                             seen=[list(entry) for entry in list(self.seen) if msg["start"] < entry[3] <= end])
+        snapshot = self.snapshots.latest(self.blockchain, max_height=end) if self.snapshots else None
+        if snapshot and snapshot[0] > msg["start"]:
+            height, table = snapshot
+            reply["snapshot"] = base64.b64encode(encode_snapshot(height, self.blockchain.chain[height - 1].digest, table)).decode("ascii")
+        self.send(msg["sender"], reply)
+
+    def on_blocks_request(self, msg):
+        records = self.blockchain.records(msg["start"], msg["end"])
+        self.send(msg["sender"], self.message("sync_blocks", start=msg["start"], records=base64.b64encode(pack_records(records)).decode("ascii")))
+
+    # Fetching side
+    def on_headers(self, msg):
+        with self.lock:
+            if msg["sender"] != self.peer:
+                return
+            headers = base64.b64decode(msg["headers"])
+            last_block = self.blockchain.get_last_block()
+            prev = last_block.digest if last_block else GENESIS_DIGEST
+            expected = []
+            for pos in range(0, len(headers), HEADER_SIZE):
+                prev_digest, digest = headers[pos:pos + 32], headers[pos + 32:pos + HEADER_SIZE]
+                if prev_digest != prev:
+                    log.warning("%s: chain of %s forked from ours at height %d, not syncing", self.name, self.peer, msg["start"] + len(expected))
+                    return self.finish()
+                expected.append(digest)
+                prev = digest
+            if msg["start"] != len(self.blockchain.chain) or not expected or expected[-1] != self.target_tip:
+                log.warning("%s: headers from %s do not match its announced tip, not syncing", self.name, self.peer)
+                return self.finish()
+            self.snapshot = None
+            if "snapshot" in msg:
+                try:
+                    height, digest, table = decode_snapshot(base64.b64decode(msg["snapshot"]))
+                except ValueError as e:
+                    log.warning("%s: ignoring snapshot from %s: %s", self.name, self.peer, e)
+                else:
+                    if msg["start"] < height <= msg["start"] + len(expected) and expected[height - 1 - msg["start"]] == digest:
+                        self.snapshot = (height, table)
+            self.covered = {(sender, clock, pid): height for sender, clock, pid, height in msg.get("seen", ())}
+            self.last_progress = time.monotonic()
+            self.base = msg["start"]
+            self.expected = expected
+            self.target = self.base + len(expected)
+            self.next_request = self.base
+            for _ in range(self.window):
+                self.request_chunk()
+
+    def request_chunk(self):
+        if self.next_request >= self.target:
+            return
+        end = min(self.next_request + self.chunk_size, self.target)
+        self.send(self.peer, self.message("sync_blocks_request", start=self.next_request, end=end))
+        self.next_request = end
+
+    def on_blocks(self, msg):
+        with self.lock:
+            if msg["sender"] != self.peer:
+                return
+            records = unpack_records(base64.b64decode(msg["records"]))
+            start = msg["start"]
+            digests = self.expected[start - self.base:start - self.base + len(records)]
+            if start != len(self.blockchain.chain) or [digest for _, _, digest in records] != digests:
+                log.warning("%s: blocks from %s do not match the headers, not syncing", self.name, self.peer)
+                return self.finish()
+            try:
+                self.apply(records, self.snapshot)
+            except ValueError as e:
+                log.warning("%s: rejected blocks from %s: %s", self.name, self.peer, e)
+                return self.finish()
+            self.last_progress = time.monotonic()
+            if self.snapshot and len(self.blockchain.chain) >= self.snapshot[0]:
+                self.snapshot = None  # Installed by apply
+            if len(self.blockchain.chain) >= self.target:
+                log.info("%s caught up %d blocks from %s in %.2fs", self.name, self.target - self.base, self.peer,
+                         time.perf_counter() - self.started_at)
+                return self.finish()
+            self.request_chunk()
+
+    def finish(self):
+        if self.snapshot and len(self.blockchain.chain) > self.base and self.restore:
+            # Ended before the chain reached the snapshot: nothing appended so far has been applied
+            self.restore(self.base)
+        self.peer = None
+        self.expected = []
+        self.snapshot = None
+        held, self.held = self.held, []
+        height = len(self.blockchain.chain)
+        # Drop the held messages the synced blocks already hold
+        applied = [msg for msg in held if self.covered.get((msg["sender"], *msg["lamport_time"]), height + 1) > height]
+        if len(applied) < len(held):
+            log.info("%s: %d held messages were already in the synced blocks", self.name, len(held) - len(applied))
+        held, self.covered = applied, {}
+        if self.on_complete:
+            self.on_complete(held)
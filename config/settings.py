@@ -0,0 +1,92 @@
+# Shared tunables for the clients. Values here are read by client.client and main.py.
+
+# Directory holding one BlockStore per client (<DATA_DIR>/<client name>/), e.g. "data". None (the default)
+# keeps chains in memory only; a relative path is resolved against the working directory of the client
+DATA_DIR = None
+
+# Group commit for the block store: fsync once this many blocks are pending, or after this many seconds
+STORE_SYNC_EVERY = 64
+STORE_SYNC_INTERVAL = 0.05
+
+# When a locally submitted transfer counts as committed (see blockchain_module.store.BlockStore), checked
+# before it is broadcast or its Future resolves: "none" right away (a crash may lose the last group commit),
+# "batch" once a group commit covering it is on disk (concurrent commits share one fsync), "every" after an
+# fsync of its own block. Restart recovery is the same for all three: torn blocks are dropped, balances rebuilt
+STORE_DURABILITY = "none"
+
+# Batching mode for locally submitted transfers: seal up to BATCH_MAX_SIZE transfers into one block,
+# waiting at most BATCH_MAX_DELAY seconds for a batch to fill, and broadcast it as one message
+BATCH_MODE = False
+BATCH_MAX_SIZE = 64
+BATCH_MAX_DELAY = 0.01
+
+# Network engine: "threaded" (client.network.Network, one thread per connection)
+# or "asyncio" (client.async_network.AsyncNetwork, one event loop for all connections).
+# Simulations pass their own transport instead, see client.sim_network and benchmarks.sim_cluster
+NETWORK_BACKEND = "threaded"
+
+# Wire format offered to peers: "binary" (length-prefixed frames, see client.codec; falls back to JSON
+# for peers that only speak JSON) or "json" (newline-delimited JSON only)
+WIRE_CODEC = "binary"
+
+# Mutual exclusion algorithm used by Client.request_mutex / release_mutex (see client.mutex):
+# "lamport" (3(N-1) messages), "ricart_agrawala" (2(N-1) messages) or "maekawa" (quorums of about 2*sqrt(N))
+MUTEX_ALGORITHM = "ricart_agrawala"
+
+
+# Seconds Client.start waits for the links to every peer before going on (they keep being retried after that)
+PEER_CONNECT_TIMEOUT = 10
+
+# Chain sync for late joiners and restarts (see client.sync): blocks per request, requests kept in flight
+SYNC_CHUNK_SIZE = 1000
+SYNC_WINDOW = 8
+
+# Balance table snapshots (see client.snapshot): one every SNAPSHOT_INTERVAL blocks, keeping the newest
+# SNAPSHOT_RETENTION. Only used with DATA_DIR; 0 disables them (a restart replays the whole chain)
+SNAPSHOT_INTERVAL = 1000
+SNAPSHOT_RETENTION = 3
+
+# Balance every client starts out with (REQUIREMENT)
+INITIAL_BALANCE = 10
+
+# History index (see blockchain_module.history): cumulative balance checkpoint every this many blocks,
+# so a balance-at-height query replays at most this many of the account's blocks
+HISTORY_CHECKPOINT_EVERY = 1000
+# Seconds to wait for a peer's answer to a history / balance-at query before its Future fails with TimeoutError
+QUERY_TIMEOUT = 10.0
+
+# Logging (see telemetry.logs): per-message traffic is logged at DEBUG, lifecycle events at INFO
+LOG_LEVEL = "INFO"
+
+# Metrics (see telemetry.metrics): off by default, near-zero cost when off. When on, served as text on
+# http://<client ip>:<client port + METRICS_PORT_OFFSET>/metrics (None: no endpoint) and/or logged
+# every METRICS_DUMP_INTERVAL seconds (0: never)
+METRICS_ENABLED = False
+METRICS_PORT_OFFSET = 1000
+METRICS_DUMP_INTERVAL = 0
+
+# Transaction dissemination (see client.gossip): "flood" sends every transaction to every peer over a full
+# mesh; "gossip" only links each client to about 2*log2(N) overlay neighbors and relays every transaction to
+# GOSSIP_FANOUT random ones, with anti-entropy (a digest to a random neighbor every
+# GOSSIP_ANTI_ENTROPY_INTERVAL seconds) repairing from the last GOSSIP_CACHE_SIZE messages.
+# Gossip has no direct link between every pair of clients, so the mutex and peer queries need "flood".
+# Every relay round misses about e^-fanout of the clients; a fanout around ln(N) + 2 leaves few repairs to do
+BROADCAST_MODE = "flood"
+GOSSIP_FANOUT = 6
+GOSSIP_CACHE_SIZE = 10000
+GOSSIP_ANTI_ENTROPY_INTERVAL = 2.0
+
+# Receive pipeline (see client.dispatch): received messages are handled by DISPATCH_WORKERS threads, in order
+# per link, with at most DISPATCH_QUEUE_LIMIT messages queued per link. Past that, the DISPATCH_SHED_TYPES
+# (requests a peer can repeat) are dropped and everything else waits, slowing down that link only.
+# DISPATCH_PROCESS_WORKERS > 0 hashes synced blocks on a pool of that many processes instead of in-process
+DISPATCH_WORKERS = 8
+DISPATCH_QUEUE_LIMIT = 1024
+DISPATCH_SHED_TYPES = ("balance_request", "history_request", "balance_at_request", "gossip_digest")
+DISPATCH_PROCESS_WORKERS = 0
+
+# Start method of the client processes launched by main.py: "forkserver" forks every client from a template
+# process that has already imported the client code, so starting one costs a fork instead of an interpreter
+# start and a full import; "spawn" starts each from scratch; "fork" copies the launcher. Falls back to the
+# platform default where the method does not exist (forkserver and fork are POSIX only)
+START_METHOD = "forkserver"
@@ -1,17 +1,33 @@
 import json
-import threading
-import time
-from client.client import Client, run_client
 import multiprocessing
+from client.client import run_client
+from config import settings
+
+# Modules the forkserver template imports once, so every client forked from it starts with them loaded
+PRELOAD = ["client.client", "config.settings"]
+
 # Load configuration from the JSON file
 def load_config(config_file):
     with open(config_file, 'r') as file:
         return json.load(file)
 
+def get_context(start_method=None):
+    """multiprocessing context for the client processes (settings.START_METHOD by default).
+    With "forkserver" the template process preloads PRELOAD, plus client.async_network for the asyncio backend."""
+    start_method = start_method or settings.START_METHOD
+    if start_method not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context()
+    context = multiprocessing.get_context(start_method)
+    if start_method == "forkserver":
+        preload = PRELOAD + (["client.async_network"] if settings.NETWORK_BACKEND == "asyncio" else [])
+        context.set_forkserver_preload(preload)
+    return context
+
 # Main function to initialize and test clients
 def main():
     config_file = "config/clients.json"
-    client_configs = load_config(config_file)
+    client_configs = load_config(config_file)  # Parsed once here, every client gets its peers from it
+    context = get_context()
 
     processes = []
     # 1. Create all processes (but don't start them yet)
@@ -22,7 +38,7 @@ def main():
         peers = [peer for peer in client_configs if peer["name"] != name]
         first = (name == "ClientA")
         
-        p = multiprocessing.Process(
+        p = context.Process(
             target=run_client,  # your function that runs a single client
             args=(name, host, port, peers, first)
         )
@@ -0,0 +1,2 @@
+from .metrics import metrics, Metrics
+from .logs import configure_logging
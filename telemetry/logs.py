@@ -0,0 +1,13 @@
+import logging
+
+LOG_FORMAT = "%(asctime)s %(processName)s %(levelname)s %(name)s: %(message)s"
+
+
+def configure_logging(level="INFO"):
+    """Route the package loggers to stderr at level (a name like "DEBUG" or a logging constant).
+    Per-message traffic (sends, receives, balance updates) is logged at DEBUG, lifecycle events
+    (connections, syncs, commits) at INFO and failures at WARNING."""
+    if isinstance(level, str):
+        level = getattr(logging, level.upper())
+    logging.basicConfig(level=level, format=LOG_FORMAT)
+    logging.getLogger().setLevel(level)
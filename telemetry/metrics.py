@@ -0,0 +1,190 @@
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# Latency histogram buckets: upper bounds in seconds, powers of two from ~1us to ~34s
+BUCKETS = [2 ** exponent / 1_000_000 for exponent in range(26)]
+
+
+class Histogram:
+    """Latency histogram with fixed power-of-two buckets. Quantiles are read back as bucket upper
+    bounds, so they are accurate to a factor of two, which is plenty to spot a regression."""
+    __slots__ = ("counts", "count", "total")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds):
+        index = 0
+        while index < len(BUCKETS) and seconds > BUCKETS[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.total += seconds
+
+    def quantile(self, fraction):
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return BUCKETS[index] if index < len(BUCKETS) else float("inf")
+        return 0.0
+
+
+class Timer:
+    __slots__ = ("metrics", "name", "label", "start")
+
+    def __init__(self, metrics, name, label):
+        self.metrics = metrics
+        self.name = name
+        self.label = label
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.name, time.perf_counter() - self.start, self.label)
+
+
+class NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return None
+
+
+NULL_TIMER = NullTimer()
+
+
+class Metrics:
+    """Process-wide counters, latency histograms and gauges.
+    * Off by default: every recording call returns right away and time() hands out a shared no-op
+      context manager, so instrumented hot paths pay one attribute check. Code that would compute
+      something only for a metric checks `metrics.enabled` first.
+    * Series are keyed by (name, label), e.g. ("bytes_sent", "ClientB").
+    * Gauges are callbacks evaluated when the metrics are rendered, so queue depths cost nothing
+      until someone looks.
+    * render() gives a plain text dump (one `name{label} value` line per series), served over HTTP
+      by serve() or logged periodically by start_dump()."""
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self.servers = []
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    def inc(self, name, amount=1, label=None):
+        if not self.enabled:
+            return
+        key = (name, label)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, seconds, label=None):
+        if not self.enabled:
+            return
+        key = (name, label)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def time(self, name, label=None):
+        """Context manager recording the duration of its block into the histogram name."""
+        if not self.enabled:
+            return NULL_TIMER
+        return Timer(self, name, label)
+
+    def gauge(self, name, function, label=None):
+        # Registered even while disabled, it costs nothing until rendered
+        with self.lock:
+            self.gauges[(name, label)] = function
+
+    def remove_gauge(self, name, label=None):
+        with self.lock:
+            self.gauges.pop((name, label), None)
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    @staticmethod
+    def series(name, label, suffix=""):
+        return f"{name}{suffix}" if label is None else f'{name}{suffix}{{label="{label}"}}'
+
+    def render(self):
+        with self.lock:
+            counters = sorted(self.counters.items(), key=lambda item: (item[0][0], str(item[0][1])))
+            histograms = sorted(self.histograms.items(), key=lambda item: (item[0][0], str(item[0][1])))
+            gauges = sorted(self.gauges.items(), key=lambda item: (item[0][0], str(item[0][1])))
+        lines = [f"{self.series(name, label)} {value}" for (name, label), value in counters]
+        for (name, label), histogram in histograms:
+            lines.append(f"{self.series(name, label, '_count')} {histogram.count}")
+            lines.append(f"{self.series(name, label, '_sum')} {histogram.total:.6f}")
+            for fraction in (0.5, 0.9, 0.99):
+                lines.append(f"{self.series(name, label, f'_p{round(fraction * 100)}')} {histogram.quantile(fraction):.6f}")
+        for (name, label), function in gauges:
+            try:
+                lines.append(f"{self.series(name, label)} {function()}")
+            except Exception as e:  # A gauge of an object being torn down
+                log.debug("gauge %s failed: %s", name, e)
+        return "\n".join(lines) + "\n"
+
+    def serve(self, host, port):
+        """Serve render() as text/plain on http://host:port/metrics from a daemon thread."""
+        # Imported here: http.server pulls in email and http.client, too slow to load in every client for an
+        # endpoint that is off by default
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip("/") not in ("", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                log.debug("metrics endpoint: " + format, *args)
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        self.servers.append(server)
+        threading.Thread(target=server.serve_forever, daemon=True, name="metrics-http").start()
+        log.info("Metrics served on http://%s:%d/metrics", host, port)
+
+    def start_dump(self, interval):
+        """Log render() every interval seconds from a daemon thread."""
+        def dump_loop():
+            while True:
+                time.sleep(interval)
+                log.info("metrics\n%s", self.render())
+        threading.Thread(target=dump_loop, daemon=True, name="metrics-dump").start()
+
+    def stop(self):
+        servers, self.servers = self.servers, []
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+
+
+metrics = Metrics()  # The registry every module records into